@@ -0,0 +1,87 @@
+"""
+Micro-benchmark of the user profile lookup behind GET /user: ORM entity vs Core fast path.
+
+    python -m app.benchmark.profile_lookup [--lookups 5000] [--users 1000]
+
+Each lookup opens a session, loads one profile and copies it into UserProfileInfo like
+UserProfileController.get_user_profile. The ORM path is the former select(UserProfile) lookup, the fast
+path is UserRepository._select_user_by_username (prebuilt Core statement mapped into UserProfileSnapshot).
+Reports CPU time per lookup, the peak memory a lookup allocates and the memory a loaded profile retains.
+The in-memory SQLite database keeps I/O out of the numbers, the profile cache is bypassed.
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from app.model.user_profile import Base, UserProfile
+from app.repository.user_repo import UserRepository
+from app.schema.user import UserProfileInfo
+
+
+async def orm_lookup(username:str, db:AsyncSession):
+    result = await db.execute(select(UserProfile).where(UserProfile.username == username))
+    return result.scalars().first()
+
+
+async def fast_lookup(username:str, db:AsyncSession):
+    return await UserRepository._select_user_by_username(username, db)
+
+
+def profile_info(user)->UserProfileInfo:
+    return UserProfileInfo(username=user.username, first_name=user.first_name, last_name=user.last_name,
+                           mobile=user.mobile_number, mobile_verified=user.is_mobile_number_verified,
+                           email=user.email_address, email_verified=user.is_email_address_verified)
+
+
+async def run(lookup, session_maker, usernames, keep:list | None=None):
+    for username in usernames:
+        async with session_maker() as db:
+            user = await lookup(username, db)
+            profile_info(user)
+        if keep is not None:
+            keep.append(user)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(UserProfile.__table__.insert(), [
+            dict(username=f"user{index}", first_name="First", last_name="Last", mobile_number=f"+9733{index:07d}",
+                 is_mobile_number_verified=True, email_address=f"user{index}@example.com", is_email_address_verified=True)
+            for index in range(args.users)])
+    session_maker = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    usernames = [f"user{index % args.users}" for index in range(args.lookups)]
+
+    print(f"{args.lookups} lookups over {args.users} profiles")
+    for name, lookup in [("ORM select(UserProfile)", orm_lookup), ("Core fast path", fast_lookup)]:
+        # Warm up the compiled statement caches
+        await run(lookup, session_maker, usernames[:100])
+        started_at = time.process_time()
+        await run(lookup, session_maker, usernames)
+        cpu = (time.process_time() - started_at) / args.lookups
+
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await run(lookup, session_maker, usernames[:1])
+        _, peak = tracemalloc.get_traced_memory()
+        kept = []
+        before_kept, _ = tracemalloc.get_traced_memory()
+        await run(lookup, session_maker, usernames[:args.users], keep=kept)
+        retained = (tracemalloc.get_traced_memory()[0] - before_kept) / len(kept)
+        tracemalloc.stop()
+        print(f"{name:<26} {cpu * 1e6:8.1f} µs CPU/lookup  {(peak - before) / 1024:7.1f} KiB peak/lookup  {retained:7.0f} B retained/profile")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
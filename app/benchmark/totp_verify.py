@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of the TOTP verification paths.
+
+    python -m app.benchmark.totp_verify [--codes 10000] [--repeat 5]
+
+Compares pyotp.TOTP(seed).now() == code (the former verification) with TOTPVerifier on a seed and on
+pre-decoded keys, single codes and batches. The verifier checks the whole drift window, 3 codes per
+verification with the default TOTP_DRIFT_WINDOW=1, while pyotp checks a single one (compare with window=0).
+"""
+import argparse
+import time
+import timeit
+import pyotp
+from app.helper.totp_verifier import TOTPVerifier, np
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--codes", type=int, default=10000, help="verifications per run")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per path, the best one is reported")
+    args = parser.parse_args()
+
+    now = time.time()
+    seeds = [pyotp.random_base32() for _ in range(args.codes)]
+    codes = [pyotp.TOTP(seed).at(now) for seed in seeds]
+    keys = [TOTPVerifier.decode_key(seed) for seed in seeds]
+    pairs = list(zip(keys, codes))
+
+    def pyotp_now():
+        for seed, code in zip(seeds, codes):
+            pyotp.TOTP(seed).now() == code
+
+    def verifier_seed():
+        for seed, code in zip(seeds, codes):
+            TOTPVerifier.verify(TOTPVerifier.decode_key(seed), code)
+
+    def verifier_key():
+        for key, code in pairs:
+            TOTPVerifier.verify(key, code)
+
+    def verifier_key_single_step():
+        for key, code in pairs:
+            TOTPVerifier.verify(key, code, window=0)
+
+    def verifier_batch():
+        TOTPVerifier.verify_batch(pairs)
+
+    paths = [("pyotp TOTP(seed).now() == code", pyotp_now),
+             ("TOTPVerifier.verify(decode_key(seed))", verifier_seed),
+             ("TOTPVerifier.verify(key)", verifier_key),
+             ("TOTPVerifier.verify(key, window=0)", verifier_key_single_step),
+             (f"TOTPVerifier.verify_batch ({'numpy' if np is not None else 'pure python'})", verifier_batch)]
+    print(f"{args.codes} verifications, best of {args.repeat}")
+    baseline = None
+    for name, path in paths:
+        best = min(timeit.repeat(path, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f"{name:<48} {best * 1e6 / args.codes:8.2f} µs/code  {baseline / best:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Round trips per UserRepository write, before and after the single statement RETURNING writes.
+
+    python -m app.benchmark.user_repo_round_trips [--database-url URL] [--calls 200]
+
+Statements and commits are counted with engine events, each one is a round trip to the database. The
+former writes (SELECT, commit, refresh) are reproduced below for the comparison. The default in-memory
+SQLite database shows the round trip counts, point --database-url at Postgres (postgresql+asyncpg://...)
+to see what they cost over the network.
+"""
+import argparse
+import asyncio
+import time
+from sqlalchemy import event, select, delete
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from app.model.user_profile import Base, UserProfile
+from app.repository.user_repo import UserRepository
+
+
+async def legacy_create_new_user(user_profile:UserProfile, db:AsyncSession)->UserProfile:
+    db.add(user_profile)
+    await db.commit()
+    await db.refresh(user_profile)
+    return user_profile
+
+
+async def legacy_update_user_email(username:str, email:str, db:AsyncSession)->UserProfile | None:
+    result = await db.execute(select(UserProfile).where(UserProfile.username == username))
+    user = result.scalars().first()
+    if user:
+        user.email_address = email
+        user.is_email_address_verified = True
+        await db.commit()
+        await db.refresh(user)
+    return user
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///:memory:")
+    parser.add_argument("--calls", type=int, default=200, help="calls per write")
+    args = parser.parse_args()
+
+    sqlite = args.database_url.startswith("sqlite")
+    engine = create_async_engine(args.database_url, **(dict(poolclass=StaticPool) if sqlite else {}))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    round_trips = 0
+
+    def _count(*_):
+        nonlocal round_trips
+        round_trips += 1
+    event.listen(engine.sync_engine, "before_cursor_execute", _count)
+    event.listen(engine.sync_engine, "commit", _count)
+
+    session_maker = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    writes = [
+        ("create_new_user (add, commit, refresh)",
+         lambda index, db: legacy_create_new_user(UserProfile(username=f"bench-legacy-{index}"), db)),
+        ("create_new_user (INSERT ... RETURNING)",
+         lambda index, db: UserRepository.create_new_user(UserProfile(username=f"bench-{index}"), db)),
+        ("update_user_email (SELECT, commit, refresh)",
+         lambda index, db: legacy_update_user_email(f"bench-legacy-{index}", f"{index}@example.com", db)),
+        ("update_user_email (UPDATE ... RETURNING)",
+         lambda index, db: UserRepository.update_user_email(f"bench-{index}", f"{index}@example.com", db)),
+    ]
+    print(f"{args.calls} calls per write on {engine.dialect.name}")
+    for name, write in writes:
+        round_trips = 0
+        started_at = time.perf_counter()
+        for index in range(args.calls):
+            # A session per call like a request
+            async with session_maker() as db:
+                await write(index, db)
+        elapsed = time.perf_counter() - started_at
+        print(f"{name:<46} {round_trips / args.calls:4.1f} round trips/call  {elapsed * 1e3 / args.calls:7.3f} ms/call")
+
+    async with engine.begin() as conn:
+        await conn.execute(delete(UserProfile).where(UserProfile.username.like("bench-%")))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,6 +7,8 @@ class Settings:
     issuer_name:str
     otp_size:int
     otp_life:int
+    otp_max_attempts:int
+    totp_drift_window:int
     # Postgres Settings
     pg_db_user:str
     pg_db_password:str
@@ -15,10 +17,25 @@ class Settings:
     pg_db_port:int
     pg_db_pool_min_size:int
     pg_db_pool_max_size:int
+    pg_db_replica_hosts:str
+    pg_db_replica_balancing:str
+    pg_db_replica_max_lag:float
+    pg_db_replica_lag_check_interval:float
+    pg_db_read_after_write_window:int
     # Redis Settings
     redis_url:str
     redis_max_connections:int
     redis_ttl:int
+    redis_cluster:bool
+    state_backend:str
+    redis_sentinels:str
+    redis_sentinel_master:str
+    redis_read_from_replicas:bool
+    redis_replica_url:str
+    redis_socket_timeout:float
+    redis_socket_connect_timeout:float
+    redis_health_check_interval:int
+    redis_migrate_legacy_otp_keys:bool
     # Keycloak Settings
     keycloak_url:str
     keycloak_realm:str
@@ -26,6 +43,58 @@ class Settings:
     keycloak_client_secret:str
     keycloak_admin_username:str
     keycloak_admin_password:str
+    keycloak_token_validation:str
+    keycloak_jwks_ttl:int
+    keycloak_jwks_min_refresh_interval:int
+    keycloak_audience:str
+    keycloak_verify_audience:bool
+    keycloak_issuer:str
+    keycloak_admin_token_refresh_ahead:int
+    keycloak_user_cache_ttl:int
+    keycloak_user_cache_max_size:int
+    keycloak_call_timeout:float
+    keycloak_slow_call_threshold:float
+    keycloak_breaker_failure_threshold:int
+    keycloak_breaker_reset_timeout:float
+    keycloak_breaker_half_open_max_calls:int
+    keycloak_mobile_claim:str
+    keycloak_mobile_verified_claim:str
+    # User Profile Settings
+    auto_provision_user_profile:bool
+    auto_provision_cache_size:int
+    user_profile_cache_enabled:bool
+    user_profile_cache_ttl:int
+    user_profile_cache_max_size:int
+    user_profile_cache_redis:bool
+    # Rate Limit Settings
+    rate_limit_enabled:bool
+    rate_limit_window:int
+    rate_limit_verify_per_user:int
+    rate_limit_verify_per_ip:int
+    rate_limit_update_per_user:int
+    rate_limit_update_per_ip:int
+    # Authentication Cache Settings
+    auth_cache_enabled:bool
+    auth_cache_max_size:int
+    auth_cache_expiry_margin:int
+    auth_cache_secret:str
+    auth_cache_hash_iterations:int
+    auth_cache_redis:bool
+    auth_cache_local_ttl:int
+    # Outbound HTTP Client Settings
+    http_max_connections:int
+    http_max_keepalive_connections:int
+    http_keepalive_expiry:float
+    http_connect_timeout:float
+    http_read_timeout:float
+    http_http2:bool
+    # QR Code Rendering Settings
+    qr_render_executor:str
+    qr_render_workers:int
+    qr_render_max_pending:int
+    qr_box_size:int
+    qr_border:int
+    qr_error_correction:str
     # Send Email Service API
     resend_from_email:str
     resend_api_url:str
@@ -41,6 +110,8 @@ class Settings:
             issuer_name=os.getenv("ISSUER_NAME","2FA-MIDDLEWARE"),
             otp_size=int(os.getenv("OTP_SIZE","6")),
             otp_life=int(os.getenv("OTP_LIFE",10)),
+            otp_max_attempts=int(os.getenv("OTP_MAX_ATTEMPTS","5")),
+            totp_drift_window=int(os.getenv("TOTP_DRIFT_WINDOW","1")),
             pg_db_user=os.getenv("PG_DB_USER","user"),
             pg_db_password=os.getenv("PG_DB_PASSWORD","password"),
             pg_db_database=os.getenv("PG_DB_DATABASE","6"),
@@ -48,15 +119,77 @@ class Settings:
             pg_db_port=int(os.getenv("PG_DB_PORT","6")),
             pg_db_pool_min_size=int(os.getenv("PG_DB_POOL_MIN_SIZE","6")),
             pg_db_pool_max_size=int(os.getenv("PG_DB_POOL_MAX_SIZE","6")),
+            pg_db_replica_hosts=os.getenv("PG_DB_REPLICA_HOSTS",""),
+            pg_db_replica_balancing=os.getenv("PG_DB_REPLICA_BALANCING","round-robin").lower(),
+            pg_db_replica_max_lag=float(os.getenv("PG_DB_REPLICA_MAX_LAG","5")),
+            pg_db_replica_lag_check_interval=float(os.getenv("PG_DB_REPLICA_LAG_CHECK_INTERVAL","5")),
+            pg_db_read_after_write_window=int(os.getenv("PG_DB_READ_AFTER_WRITE_WINDOW","10")),
             redis_url=os.getenv("REDIS_URL","redis://localhost:6379/0"),
             redis_max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS","20")),
             redis_ttl=int(os.getenv("REDIS_TTL","660")),
+            redis_cluster=os.getenv("REDIS_CLUSTER","false").lower()=="true",
+            state_backend=os.getenv("STATE_BACKEND","redis").lower(),
+            redis_sentinels=os.getenv("REDIS_SENTINELS",""),
+            redis_sentinel_master=os.getenv("REDIS_SENTINEL_MASTER","mymaster"),
+            redis_read_from_replicas=os.getenv("REDIS_READ_FROM_REPLICAS","false").lower()=="true",
+            redis_replica_url=os.getenv("REDIS_REPLICA_URL",""),
+            redis_socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT","2")),
+            redis_socket_connect_timeout=float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT","1")),
+            redis_health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL","15")),
+            redis_migrate_legacy_otp_keys=os.getenv("REDIS_MIGRATE_LEGACY_OTP_KEYS","false").lower()=="true",
             keycloak_url=os.getenv("KEYCLOAK_URL","http://localhost:8080"),
             keycloak_realm=os.getenv("KEYCLOAK_REALM","2faproject"),
             keycloak_client_id=os.getenv("KEYCLOAK_CLIENT_ID","fastapi-client"),
             keycloak_client_secret=os.getenv("KEYCLOAK_CLIENT_SECRET","secret"),
             keycloak_admin_username=os.getenv("KEYCLOAK_ADMIN_USERNAME","admin"),
             keycloak_admin_password=os.getenv("KEYCLOAK_ADMIN_PASSWORD","admin-password"),
+            keycloak_token_validation=os.getenv("KEYCLOAK_TOKEN_VALIDATION","jwks").lower(),
+            keycloak_jwks_ttl=int(os.getenv("KEYCLOAK_JWKS_TTL","300")),
+            keycloak_jwks_min_refresh_interval=int(os.getenv("KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL","10")),
+            keycloak_audience=os.getenv("KEYCLOAK_AUDIENCE") or os.getenv("KEYCLOAK_CLIENT_ID","fastapi-client"),
+            keycloak_verify_audience=os.getenv("KEYCLOAK_VERIFY_AUDIENCE","true").lower()=="true",
+            keycloak_issuer=os.getenv("KEYCLOAK_ISSUER",""),
+            keycloak_admin_token_refresh_ahead=int(os.getenv("KEYCLOAK_ADMIN_TOKEN_REFRESH_AHEAD","30")),
+            keycloak_user_cache_ttl=int(os.getenv("KEYCLOAK_USER_CACHE_TTL","60")),
+            keycloak_user_cache_max_size=int(os.getenv("KEYCLOAK_USER_CACHE_MAX_SIZE","10000")),
+            keycloak_call_timeout=float(os.getenv("KEYCLOAK_CALL_TIMEOUT","3")),
+            keycloak_slow_call_threshold=float(os.getenv("KEYCLOAK_SLOW_CALL_THRESHOLD","1.5")),
+            keycloak_breaker_failure_threshold=int(os.getenv("KEYCLOAK_BREAKER_FAILURE_THRESHOLD","5")),
+            keycloak_breaker_reset_timeout=float(os.getenv("KEYCLOAK_BREAKER_RESET_TIMEOUT","15")),
+            keycloak_breaker_half_open_max_calls=int(os.getenv("KEYCLOAK_BREAKER_HALF_OPEN_MAX_CALLS","1")),
+            keycloak_mobile_claim=os.getenv("KEYCLOAK_MOBILE_CLAIM","mobile"),
+            keycloak_mobile_verified_claim=os.getenv("KEYCLOAK_MOBILE_VERIFIED_CLAIM","mobileVerified"),
+            auto_provision_user_profile=os.getenv("AUTO_PROVISION_USER_PROFILE","false").lower()=="true",
+            auto_provision_cache_size=int(os.getenv("AUTO_PROVISION_CACHE_SIZE","100000")),
+            user_profile_cache_enabled=os.getenv("USER_PROFILE_CACHE_ENABLED","true").lower()=="true",
+            user_profile_cache_ttl=int(os.getenv("USER_PROFILE_CACHE_TTL","300")),
+            user_profile_cache_max_size=int(os.getenv("USER_PROFILE_CACHE_MAX_SIZE","10000")),
+            user_profile_cache_redis=os.getenv("USER_PROFILE_CACHE_REDIS","true").lower()=="true",
+            rate_limit_enabled=os.getenv("RATE_LIMIT_ENABLED","true").lower()=="true",
+            rate_limit_window=int(os.getenv("RATE_LIMIT_WINDOW","60")),
+            rate_limit_verify_per_user=int(os.getenv("RATE_LIMIT_VERIFY_PER_USER","10")),
+            rate_limit_verify_per_ip=int(os.getenv("RATE_LIMIT_VERIFY_PER_IP","60")),
+            rate_limit_update_per_user=int(os.getenv("RATE_LIMIT_UPDATE_PER_USER","5")),
+            rate_limit_update_per_ip=int(os.getenv("RATE_LIMIT_UPDATE_PER_IP","30")),
+            auth_cache_enabled=os.getenv("AUTH_CACHE_ENABLED","true").lower()=="true",
+            auth_cache_max_size=int(os.getenv("AUTH_CACHE_MAX_SIZE","10000")),
+            auth_cache_expiry_margin=int(os.getenv("AUTH_CACHE_EXPIRY_MARGIN","30")),
+            auth_cache_secret=os.getenv("AUTH_CACHE_SECRET",""),
+            auth_cache_hash_iterations=int(os.getenv("AUTH_CACHE_HASH_ITERATIONS","20000")),
+            auth_cache_redis=os.getenv("AUTH_CACHE_REDIS","false").lower()=="true",
+            auth_cache_local_ttl=int(os.getenv("AUTH_CACHE_LOCAL_TTL","30")),
+            http_max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS","100")),
+            http_max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS","20")),
+            http_keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY","30")),
+            http_connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT","5")),
+            http_read_timeout=float(os.getenv("HTTP_READ_TIMEOUT","10")),
+            http_http2=os.getenv("HTTP_HTTP2","false").lower()=="true",
+            qr_render_executor=os.getenv("QR_RENDER_EXECUTOR","thread").lower(),
+            qr_render_workers=int(os.getenv("QR_RENDER_WORKERS","2")),
+            qr_render_max_pending=int(os.getenv("QR_RENDER_MAX_PENDING","64")),
+            qr_box_size=int(os.getenv("QR_BOX_SIZE","6")),
+            qr_border=int(os.getenv("QR_BORDER","4")),
+            qr_error_correction=os.getenv("QR_ERROR_CORRECTION","M").upper(),
             resend_from_email=os.getenv("RESEND_FROM_EMAIL","2FA-Middleware <onboarding@resend.dev>"),
             resend_api_url=os.getenv("RESEND_API_URL","https://api.resend.com/emails"),
             resend_api_key=os.getenv("RESEND_API_KEY",""),
@@ -3,26 +3,62 @@ from app.repository.user_repo import UserRepository
 from app.repository.totp_repo import TOTPRepository
 from app.repository.otp_repo import OTPRepository
 from app.schema.token import TokenValidationResponse
-from app.schema.totp import SeedFullInfo,TOTPVerificationResult,TOTPGenerationResult
+from app.schema.totp import SeedFullInfo,TOTPVerificationResult,TOTPGenerationResult,QRCodeFormat
 from app.schema.user import UserProfileInfo,UpdateUserInfo,UpdateUserInfoResponse,UserProfileInfoResponse
 from app.schema.otp import OTPVerificationResponse,SendOTPSchema
+from app.schema.user import KeycloakUserInfo
+from app.config.settings import settings
+from app.helper.cache import TTLCache
 from app.helper.keycloak_helper import KeycloakHelper
 from app.helper.totp_helper import TOTPHelper
 from app.helper.otp_helper import OTPHelper
 from app.helper.email_helper import EmailHelper
 from app.helper.sms_helper import SMSHelper
 from app.exception.exceptions import (NoMatchingUserError,NoMatchingOTPError,NoMatchingSeedError,
-                                      SeedWaitingForConfirmationError,TechnicalError,MatchingUserError,
+                                      TechnicalError,MatchingUserError,
                                       ExistingOTPError)
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import BackgroundTasks,Depends
-import redis.asyncio as aioredis
+from app.repository.state_backend import StateBackend
 import logging
 
 class UserProfileController:
 
     logger=logging.getLogger(__name__)
 
+    # Usernames whose profile is known to exist, provisioning runs once per user
+    _provisioned_users=TTLCache(max_size=settings.auto_provision_cache_size)
+
+    @staticmethod
+    def user_profile_from_attributes(user_attributes:KeycloakUserInfo)->UserProfile:
+        """Map Keycloak user attributes to a new profile record."""
+        return UserProfile(
+                            username=user_attributes.username,
+                            first_name=user_attributes.first_name,
+                            last_name=user_attributes.last_name,
+                            mobile_number= user_attributes.mobile,
+                            is_mobile_number_verified=user_attributes.mobile_verified,
+                            email_address=user_attributes.email,
+                            is_email_address_verified=user_attributes.email_verified
+                        )
+
+    @staticmethod
+    async def provision_user_profile(authentication_results: TokenValidationResponse,db:AsyncSession):
+        """Create the user profile from the validated token claims the first time a user is seen.
+        Args:
+            authentication_results (TokenValidationResponse): The validated token containing the claims.
+            db (AsyncSession): The database session for performing operations.
+        """
+        username=authentication_results.username
+        if not(authentication_results.claims) or not(username) or username in UserProfileController._provisioned_users:
+            return
+        user_attributes=KeycloakHelper.user_info_from_claims(authentication_results.claims)
+        # Concurrent first requests race safely, the losing insert does nothing
+        created=await UserRepository.create_user_if_missing(UserProfileController.user_profile_from_attributes(user_attributes),db)
+        if created:
+            UserProfileController.logger.info(f"# Provisioned a profile for {username} from token claims")
+        UserProfileController._provisioned_users.set(username,True)
+
     @staticmethod
     async def create_user_profile(authentication_results: TokenValidationResponse,db:AsyncSession) -> UserProfileInfoResponse:
         """Create a new user profile in the database if one does not already exist.
@@ -39,21 +75,16 @@ class UserProfileController:
             if user_profile:
                 raise MatchingUserError() # Return user creation failed because user already exists
             UserProfileController.logger.info(f"# Good news no record for :{authentication_results.username}")
-            # Get user attributes from keycloak
-            user_attributes=await KeycloakHelper.return_matching_user_info(authentication_results.username)
+            # Get user attributes from the token claims when allowed, otherwise from keycloak
+            if settings.auto_provision_user_profile and authentication_results.claims:
+                user_attributes=KeycloakHelper.user_info_from_claims(authentication_results.claims)
+            else:
+                user_attributes=await KeycloakHelper.return_matching_user_info(authentication_results.username)
             UserProfileController.logger.info(f"# {authentication_results.username} Attributes were retrieved from keycloak")
             if user_attributes.id==None:
                 raise NoMatchingUserError()
             # Create a new profile record
-            user_profile=UserProfile(
-                                        username=user_attributes.username,
-                                        first_name=user_attributes.first_name,
-                                        last_name=user_attributes.last_name,
-                                        mobile_number= user_attributes.mobile,
-                                        is_mobile_number_verified=user_attributes.mobile_verified,
-                                        email_address=user_attributes.email,
-                                        is_email_address_verified=user_attributes.email_verified
-                                    )
+            user_profile=UserProfileController.user_profile_from_attributes(user_attributes)
             UserProfileController.logger.info(f"# Creating the following record {user_profile}")
             refreshed_user_profile=await UserRepository.create_new_user(user_profile,db)
             
@@ -90,42 +121,68 @@ class UserProfileController:
         
     # Generate TOTP
     @staticmethod
-    async def generate_totp_seed(authentication_results: TokenValidationResponse,db:AsyncSession,redis:aioredis.Redis)->TOTPGenerationResult:
-        """Generate a TOTP seed for the user.
+    async def generate_totp_seed(authentication_results: TokenValidationResponse,db:AsyncSession,state:StateBackend,
+                                 qrcode_format:QRCodeFormat=QRCodeFormat.PNG,regenerate:bool=False)->TOTPGenerationResult:
+        """Generate a TOTP seed for the user, repeated calls return the enrollment of the seed waiting for confirmation.
         Args:
             authentication_results (TokenValidationResponse): The token validation response containing user information.
             db (AsyncSession): The database session for performing operations.
-            redis (aioredis.Redis): The Redis instance for caching and OTP storage.
+            state (StateBackend): The backend holding the OTP and TOTP state.
+            qrcode_format (QRCodeFormat): png (base64 encoded), svg (markup) or uri-only (no image).
+            regenerate (bool): Replace the seed waiting for confirmation with a new one.
         Returns:
             TOTPGenerationResult: The response containing the result of the TOTP generation.
         """
         try:
-            user_profile=await UserRepository.get_user_by_username(authentication_results.username,db)
+            username=authentication_results.username
+            if not(regenerate):
+                # Repeated calls are served from the enrollment rendered by the first one
+                enrollment=await TOTPRepository.get_totp_enrollment(state,username,qrcode_format)
+                if enrollment:
+                    return TOTPGenerationResult(successful=True,message="",data=enrollment)
+            user_profile=await UserRepository.get_user_by_username(username,db)
             if not(user_profile):
                 raise NoMatchingUserError() # indicate that this can not be done because there are not records for user in our db
-            # Is there is a current token
-            current_token=await TOTPRepository.get_totp_seed(redis,authentication_results.username)
-            if current_token:
-                raise SeedWaitingForConfirmationError() # Return an error wait for x minutes before trying again
-            # Generate totp for the user
-            totp_info=TOTPHelper.generate_seed_with_uri_image(authentication_results.username)
-            # Store totp in Redis
-            successful_seed_insertion=await TOTPRepository.store_totp_seed(redis,authentication_results.username,totp_info.seed)
-            if not(successful_seed_insertion):
-                raise TechnicalError() # Return and error seed can not be inserted
-            return TOTPGenerationResult(successful=True,message="",data=totp_info)
+            seed=TOTPHelper.generate_seed()
+            if regenerate:
+                await TOTPRepository.replace_totp_seed(state,username,seed)
+            else:
+                # Reserve a new seed for the user unless one is already waiting for confirmation,
+                # that one is then rendered in the requested format
+                seed=await TOTPRepository.reserve_totp_seed(state,username,seed) or seed
+            totp_info=await TOTPHelper.render_seed_uri_image(seed,username,qrcode_format)
+            enrollment=SeedFullInfo(seed=seed,user_name=username,seed_uri=totp_info.seed_uri,qrcode=totp_info.qrcode,
+                                    qrcode_format=totp_info.qrcode_format)
+            await TOTPRepository.store_totp_enrollment(state,username,enrollment)
+            return TOTPGenerationResult(successful=True,message="",data=enrollment)
         except Exception as exc:
             return TOTPGenerationResult(successful=False,message=str(exc),data=None)
     
     @staticmethod
-    async def verify_totp_seed(authentication_results: TokenValidationResponse,totp:str,new_seed:bool,db:AsyncSession,redis:aioredis.Redis)->TOTPVerificationResult:
+    async def get_pending_totp_qrcode(authentication_results: TokenValidationResponse,state:StateBackend,
+                                      qrcode_format:QRCodeFormat=QRCodeFormat.PNG)->bytes | None:
+        """Render the QR code image of the seed waiting for confirmation.
+        Args:
+            authentication_results (TokenValidationResponse): The token validation response containing user information.
+            state (StateBackend): The backend holding the OTP and TOTP state.
+            qrcode_format (QRCodeFormat): QRCodeFormat.PNG or QRCodeFormat.SVG.
+        Returns:
+            bytes | None: The encoded image, None when no seed is waiting for confirmation.
+        """
+        pending_seed=await TOTPRepository.get_totp_seed(state,authentication_results.username)
+        if not(pending_seed):
+            return None
+        return await TOTPHelper.render_qrcode(pending_seed,authentication_results.username,qrcode_format)
+
+    @staticmethod
+    async def verify_totp_seed(authentication_results: TokenValidationResponse,totp:str,new_seed:bool,db:AsyncSession,state:StateBackend)->TOTPVerificationResult:
         """Verify the TOTP for the user.
         Args:
             authentication_results (TokenValidationResponse): The token validation response containing user information.
             totp (str): The TOTP code sent by the user.
             new_seed (bool): Flag indicating if this is a new seed verification.
             db (AsyncSession): The database session for performing operations.
-            redis (aioredis.Redis): The Redis instance for caching and OTP storage.
+            state (StateBackend): The backend holding the OTP and TOTP state.
         Returns:
             TOTPVerificationResult: The response containing the result of the TOTP verification.
         """
@@ -138,13 +195,13 @@ class UserProfileController:
             # Is the request to verify a new seed
             if new_seed:
                 # Is there is a current new seed
-                current_seed=await TOTPRepository.get_totp_seed(redis,authentication_results.username)
+                current_seed=await TOTPRepository.get_totp_seed(state,authentication_results.username)
                 # If there is no current seed return an error
                 if not(current_seed):
                     return NoMatchingSeedError # Return an error wait for x minutes before trying again
-                # Verify the totp and if it is valid delete the seed from redis and update user profile
+                # Verify the totp and if it is valid delete the pending seed and update user profile
                 if TOTPHelper.verify_totp(current_seed,totp):
-                    await TOTPRepository.delete_totp_seed(redis,authentication_results.username)
+                    await TOTPRepository.delete_totp_seed(state,authentication_results.username)
                     encoded_seed=TOTPHelper.encrypt_seed(current_seed)
                     user_profile=await UserRepository.update_user_totp(authentication_results.username,encoded_seed,db)
                     return TOTPVerificationResult(successful=True,message=None)
@@ -152,20 +209,22 @@ class UserProfileController:
                     return TOTPVerificationResult(successful=False,message="Invalid TOTP for the new seed.")
             # If it is not a new seed verification then check if user has a seed and verify it
             else:
-                decoded_seed=TOTPHelper.decrypt_seed(user_profile.totp_secret_encrypted)
+                # The seed is kept out of the cached profile
+                encrypted_seed=await UserRepository.get_user_totp_secret(authentication_results.username,db)
+                decoded_seed=TOTPHelper.decrypt_seed(encrypted_seed)
                 return TOTPVerificationResult(successful=TOTPHelper.verify_totp(decoded_seed,totp),message=None)
         except Exception as exc:
             return TOTPVerificationResult(successful=False,message=str(exc))
 
     @staticmethod
     async def update_user_info(authentication_results: TokenValidationResponse,updated_user_info:UpdateUserInfo,db:AsyncSession,
-                               redis:aioredis.Redis,background_tasks: BackgroundTasks)->UpdateUserInfoResponse:
+                               state:StateBackend,background_tasks: BackgroundTasks)->UpdateUserInfoResponse:
         """Update user information such as email and mobile number.
         Args:
             authentication_results (TokenValidationResponse): The token validation response containing user information.
             updated_user_info (UpdateUserInfo): The new user information to be updated.
             db (AsyncSession): The database session for performing operations.
-            redis (aioredis.Redis): The Redis client for OTP storage.
+            state (StateBackend): The backend holding the OTP and TOTP state.
             background_tasks (BackgroundTasks): FastAPI BackgroundTasks instance for sending emails/SMS.
         Returns:
             UpdateUserInfoResponse: The response indicating the result of the update operation.
@@ -181,13 +240,12 @@ class UserProfileController:
             # Check for email changes and send OTP if changed
             if updated_user_info.email and (updated_user_info.email!=user_profile.email_address):
                 UserProfileController.logger.info(f"# newly requested email update for User {authentication_results.username} is allowed")
-                has_existing_otp=await OTPRepository.user_has_existing_otp_by_otp_type(redis,authentication_results.username,'email')
-                if has_existing_otp:
-                    raise ExistingOTPError()
                 # Create OTP
                 generated_otp=OTPHelper.generate_otp()
-                # Store OTP in Redis
-                await OTPRepository.store_email_otp(redis,user_profile.username,updated_user_info.email,generated_otp)
+                # Reserve the OTP in Redis unless one is still pending, a double submit does not send a second OTP
+                reserved,_=await OTPRepository.reserve_otp(state,user_profile.username,updated_user_info.email,generated_otp,'email')
+                if not(reserved):
+                    raise ExistingOTPError()
                 UserProfileController.logger.info(f"Email OTP for user {user_profile.username} stored in Redis")
                 # Send OTP via email in the background
                 background_tasks.add_task(EmailHelper.send_email_otp,updated_user_info.email,user_profile.last_name,generated_otp)
@@ -203,13 +261,12 @@ class UserProfileController:
             # Check for mobile changes and send OTP if changed
             if updated_user_info.mobile and (updated_user_info.mobile!=user_profile.mobile_number):
                 UserProfileController.logger.info(f"# newly requested mobile update for User {authentication_results.username} is allowed")
-                has_existing_otp=await OTPRepository.user_has_existing_otp_by_otp_type(redis,authentication_results.username,'mobile')
-                if has_existing_otp:
-                    raise ExistingOTPError()
                 # Create OTP
                 generated_otp=OTPHelper.generate_otp()
-                # Store OTP in Redis
-                await OTPRepository.store_sms_otp(redis,user_profile.username,updated_user_info.mobile,generated_otp)
+                # Reserve the OTP in Redis unless one is still pending, a double submit does not send a second OTP
+                reserved,_=await OTPRepository.reserve_otp(state,user_profile.username,updated_user_info.mobile,generated_otp,'mobile')
+                if not(reserved):
+                    raise ExistingOTPError()
                 UserProfileController.logger.info(f"Mobile OTP for user {user_profile.username} stored in Redis")
                 # Send OTP via SMS in the background
                 update_response.successful=True
@@ -230,14 +287,14 @@ class UserProfileController:
 
     # Verify OTP
     @staticmethod
-    async def verify_otp(authentication_results: TokenValidationResponse,received_otp:SendOTPSchema,db:AsyncSession,redis:aioredis.Redis)->OTPVerificationResponse:
+    async def verify_otp(authentication_results: TokenValidationResponse,received_otp:SendOTPSchema,db:AsyncSession,state:StateBackend)->OTPVerificationResponse:
         """Verify the OTP for the user.
 
         Args:
             authentication_results (TokenValidationResponse): The token validation response containing user information.
             received_otp (SendOTPSchema): The OTP details sent by the user.
             db (AsyncSession): The database session for performing operations.
-            redis (aioredis.Redis): The Redis instance for caching and OTP storage.
+            state (StateBackend): The backend holding the OTP and TOTP state.
         Returns:
             OTPVerificationResponse: The response containing the result of the OTP verification.
         """
@@ -249,12 +306,10 @@ class UserProfileController:
             # If user does not exist flag operation as failed
             if not(user_profile):
                 raise NoMatchingUserError()
-            #Look for a matching otp
-            matching_otp_identifier=await OTPRepository.find_user_key_value_by_otp(redis,authentication_results.username,received_otp.otp,received_otp.otp_type)
+            # Look for a matching otp and consume it in a single atomic call
+            matching_otp_identifier=await OTPRepository.verify_and_consume_otp(state,authentication_results.username,received_otp.otp,received_otp.otp_type)
             if not (matching_otp_identifier):
                 raise NoMatchingOTPError()
-            # Delete OTP
-            await OTPRepository.confirm_and_delete_otp(redis,authentication_results.username,matching_otp_identifier,received_otp.otp,received_otp.otp_type)
             # Update user data based on type
             if received_otp.otp_type=="mobile":
                 await UserRepository.update_user_mobile(authentication_results.username,matching_otp_identifier,db)
@@ -1,21 +1,88 @@
 from fastapi import Depends,HTTPException,status
+from app.config.settings import settings
 from app.helper.keycloak_helper import KeycloakHelper
+from app.helper.auth_cache import AuthCache
 from app.schema.token import TokenValidationResponse
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from app.exception.exceptions import ServiceUnavailableError
+from fastapi.security import HTTPBasic, HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
+from app.dependacy.pg_database import get_pg_db_connection
+from app.controller.user_profile import UserProfileController
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 
-security=HTTPBasic()
+# Both schemes are optional on their own, the Authorization header scheme decides which one is used
+basic_security=HTTPBasic(auto_error=False)
+bearer_security=HTTPBearer(auto_error=False)
 class AuthenticateUser():
 
     logger = logging.getLogger(__name__)
 
     @staticmethod
-    async def get_logged_in_user(credentials: HTTPBasicCredentials = Depends(security))->TokenValidationResponse:
+    async def authenticate(credentials: HTTPBasicCredentials,introspect:bool=False)->TokenValidationResponse:
+        """Generate a token for the given credentials and validate it, reusing cached logins when allowed."""
+        use_cache=settings.auth_cache_enabled and not introspect
+        if use_cache:
+            digest=await AuthCache.digest(credentials.username,credentials.password)
+            cached_results=await AuthCache.get(credentials.username,digest)
+            if cached_results:
+                return cached_results
         token=await KeycloakHelper.generat_token(credentials.username,credentials.password)
-        token_validation_results=await KeycloakHelper.validate_token(token.token)
+        token_validation_results=await KeycloakHelper.validate_token(token.token,introspect=introspect)
         if not(token_validation_results.successful):
             AuthenticateUser.logger.info(f"Could not generate token for {credentials.username}")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="Token is Invalid or cannot be validated at the moment")
         AuthenticateUser.logger.info(f"Authentication results : {token_validation_results}")
+        if use_cache:
+            await AuthCache.set(digest,token_validation_results,token.token_expires_in)
         return token_validation_results
+
+    @staticmethod
+    async def authenticate_bearer(credentials: HTTPAuthorizationCredentials,introspect:bool=False)->TokenValidationResponse:
+        """Validate an access token the client already obtained from Keycloak."""
+        token_validation_results=await KeycloakHelper.validate_token(credentials.credentials,introspect=introspect)
+        if not(token_validation_results.successful):
+            AuthenticateUser.logger.info("Bearer token could not be validated")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                detail="Token is Invalid or cannot be validated at the moment",
+                                headers={"WWW-Authenticate": "Bearer"})
+        return token_validation_results
+
+    @staticmethod
+    async def resolve(basic_credentials: HTTPBasicCredentials|None,bearer_credentials: HTTPAuthorizationCredentials|None,
+                      introspect:bool=False)->TokenValidationResponse:
+        """Authenticate the request using whichever scheme the Authorization header carries."""
+        try:
+            if bearer_credentials:
+                return await AuthenticateUser.authenticate_bearer(bearer_credentials,introspect)
+            if basic_credentials:
+                return await AuthenticateUser.authenticate(basic_credentials,introspect)
+        except ServiceUnavailableError as exc:
+            # Keycloak is down or too slow, fail fast instead of queuing more requests behind it
+            AuthenticateUser.logger.warning(f"Authentication rejected: {exc}")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail=str(exc),
+                                headers={"Retry-After": str(exc.retry_after or 1)})
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Basic, Bearer"})
+
+    @staticmethod
+    async def get_logged_in_user(basic_credentials: HTTPBasicCredentials|None = Depends(basic_security),
+                                 bearer_credentials: HTTPAuthorizationCredentials|None = Depends(bearer_security))->TokenValidationResponse:
+        return await AuthenticateUser.resolve(basic_credentials,bearer_credentials)
+
+    @staticmethod
+    async def get_introspected_user(basic_credentials: HTTPBasicCredentials|None = Depends(basic_security),
+                                    bearer_credentials: HTTPAuthorizationCredentials|None = Depends(bearer_security))->TokenValidationResponse:
+        """Same as get_logged_in_user but always asks Keycloak, use it for revocation sensitive routes."""
+        return await AuthenticateUser.resolve(basic_credentials,bearer_credentials,introspect=True)
+
+    @staticmethod
+    # Depend on the plain function so dependency overrides of AuthenticateUser.get_logged_in_user apply
+    async def get_provisioned_user(authentication_results: TokenValidationResponse = Depends(get_logged_in_user.__func__),
+                                   db: AsyncSession = Depends(get_pg_db_connection))->TokenValidationResponse:
+        """Authenticated user whose profile is created from the token claims when AUTO_PROVISION_USER_PROFILE is on."""
+        if settings.auto_provision_user_profile:
+            await UserProfileController.provision_user_profile(authentication_results,db)
+        return authentication_results
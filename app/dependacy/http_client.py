@@ -0,0 +1,68 @@
+import httpx
+import logging
+from app.config.settings import settings
+try:
+    import h2  # noqa: F401
+    _HAS_H2 = True
+except Exception:
+    _HAS_H2 = False
+
+logger = logging.getLogger(__name__)
+
+# Upstream services, each one gets its own connection pool
+KEYCLOAK = "keycloak"
+RESEND = "resend"
+TWILIO = "twilio"
+UPSTREAMS = (KEYCLOAK, RESEND, TWILIO)
+
+# Global app-lifetime clients indexed by upstream name
+http_clients: dict[str, httpx.AsyncClient] = {}
+# Transport used by every client, tests inject an httpx.MockTransport here
+http_transport: httpx.AsyncBaseTransport | None = None
+
+def build_http_client() -> httpx.AsyncClient:
+    """Builds a pooled client using the keep-alive and timeout settings."""
+    http2 = settings.http_http2 and _HAS_H2
+    if settings.http_http2 and not _HAS_H2:
+        logger.warning("🌐 HTTP/2 requested but the h2 package is not installed, falling back to HTTP/1.1.")
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(settings.http_read_timeout, connect=settings.http_connect_timeout),
+        http2=http2,
+        transport=http_transport,
+    )
+
+async def create_http_clients(transport: httpx.AsyncBaseTransport | None = None):
+    """Initializes one HTTP client per upstream service.
+
+    Args:
+        transport (httpx.AsyncBaseTransport | None): Optional transport replacing the network, used by tests.
+    """
+    global http_transport
+    if transport is not None:
+        await close_http_clients()
+        http_transport = transport
+    for upstream in UPSTREAMS:
+        if upstream not in http_clients:
+            http_clients[upstream] = build_http_client()
+    logger.info("🌐 Outbound HTTP clients created.")
+
+async def close_http_clients():
+    """Closes every HTTP client and its pooled connections."""
+    global http_transport
+    for client in http_clients.values():
+        await client.aclose()
+    http_clients.clear()
+    http_transport = None
+    logger.info("🌐 Outbound HTTP clients closed.")
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    """Returns the shared client of an upstream, creating it when the lifespan did not run."""
+    client = http_clients.get(upstream)
+    if client is None or client.is_closed:
+        client = http_clients[upstream] = build_http_client()
+    return client
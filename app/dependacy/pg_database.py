@@ -1,27 +1,288 @@
 from typing import AsyncGenerator
+import asyncio
+import itertools
 import logging
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+import time
+from sqlalchemy import Select, event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
 from app.config.settings import settings
+from app.helper.cache import TTLCache
+from app.helper.metrics import (PG_REPLICA_LAG_SECONDS, PG_REPLICA_AVAILABLE, PG_READS_ROUTED,
+                                PG_POOL_CHECKOUT_SECONDS, PG_POOL_HOLD_SECONDS)
 
 logger = logging.getLogger(__name__)
 
 # SQLAlchemy async engine and session maker
 _engine = None
 _async_session_maker: async_sessionmaker[AsyncSession] | None = None
+# Read replicas, empty when PG_DB_REPLICA_HOSTS is not set
+_replicas: list["Replica"] = []
+_replica_monitor: asyncio.Task | None = None
+_round_robin = itertools.count()
+# Keys (usernames) written recently, their reads stay on the primary until the replicas caught up
+_recent_writes = TTLCache(max_size=100000, ttl=settings.pg_db_read_after_write_window)
+
+# Seconds the replica is behind the primary, 0 when it replayed everything it received
+REPLICA_LAG_QUERY = text("""
+SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+""")
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Connection pool recording how long checkouts wait, labelled by the pool name."""
+
+    name = "primary"
+
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            PG_POOL_CHECKOUT_SECONDS.labels(pool=self.name).observe(time.perf_counter() - started_at)
+
+    def recreate(self):
+        # Engines recreate their pool on dispose
+        pool = super().recreate()
+        pool.name = self.name
+        return pool
+
+def _create_engine(url:str, name:str)->AsyncEngine:
+    """Engine whose pool reports checkout wait and hold times under the name label."""
+    engine = create_async_engine(url, pool_size=settings.pg_db_pool_max_size, poolclass=TimedQueuePool)
+    engine.sync_engine.pool.name = name
+
+    @event.listens_for(engine.sync_engine, "checkout")
+    def _checked_out(dbapi_connection, record, proxy):
+        record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "checkin")
+    def _checked_in(dbapi_connection, record):
+        checked_out_at = record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            PG_POOL_HOLD_SECONDS.labels(pool=name).observe(time.perf_counter() - checked_out_at)
+    return engine
+
+class LazySession:
+    """
+    Stand-in for an AsyncSession that is only opened on first use.
+
+    Attribute access is forwarded to the session, created on demand. release() gives the connection
+    back to the pool once a read finished, a request thus holds a connection only while it talks to
+    Postgres and not across Keycloak calls, Redis round trips or early exits.
+    """
+
+    def __init__(self, session_maker:async_sessionmaker[AsyncSession]):
+        self._session_maker = session_maker
+        self._session: AsyncSession | None = None
+        # The current transaction flushed or executed a write
+        self._wrote = False
+
+    def __getattr__(self, name:str):
+        if self._session is None:
+            self._session = self._session_maker()
+            sync_session = self._session.sync_session
+            event.listen(sync_session, "after_flush", self._on_write)
+            event.listen(sync_session, "do_orm_execute", self._on_execute)
+            event.listen(sync_session, "after_transaction_end", self._on_transaction_end)
+        return getattr(self._session, name)
+
+    def _on_write(self, *args):
+        self._wrote = True
+
+    def _on_execute(self, orm_execute_state):
+        if not orm_execute_state.is_select:
+            self._wrote = True
+
+    def _on_transaction_end(self, session, transaction):
+        if transaction.parent is None:
+            self._wrote = False
+
+    @property
+    def opened(self)->bool:
+        return self._session is not None
+
+    async def release(self):
+        """End the current read-only unit of work, the session stays usable and checks out again when used."""
+        session = self._session
+        if session is None or self._wrote or session.new or session.dirty or session.deleted:
+            return
+        # Loaded objects stay readable, expire_on_commit is off
+        await session.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+async def release_connection(db:AsyncSession):
+    """Give the connection of a request session back to the pool after a read (no-op for plain sessions)."""
+    if isinstance(db, LazySession):
+        await db.release()
+
+def session_maker_of(db:AsyncSession)->async_sessionmaker[AsyncSession]:
+    """Session maker opening new sessions on the same database as db, for work that must not use db itself."""
+    if isinstance(db, LazySession):
+        return db._session_maker
+    return async_sessionmaker(db.bind, expire_on_commit=False, class_=AsyncSession, sync_session_class=type(db.sync_session))
+
+class Replica:
+    """A read replica engine with the health and lag found by the replica monitor."""
+
+    def __init__(self, name:str, engine:AsyncEngine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.lag: float | None = None
+
+    def available(self)->bool:
+        return self.healthy and (self.lag is None or self.lag <= settings.pg_db_replica_max_lag)
+
+    def set_state(self, healthy:bool, lag:float | None=None):
+        if healthy != self.healthy:
+            logger.warning(f"🛢️ Replica {self.name} is {'back' if healthy else 'unavailable, reading from the primary'}.")
+        self.healthy, self.lag = healthy, lag
+        if lag is not None:
+            PG_REPLICA_LAG_SECONDS.labels(replica=self.name).set(lag)
+        PG_REPLICA_AVAILABLE.labels(replica=self.name).set(1 if self.available() else 0)
+
+def pick_replica()->Replica | None:
+    """Next available replica by PG_DB_REPLICA_BALANCING, None when every replica is down or lagging."""
+    available = [replica for replica in _replicas if replica.available()]
+    if not available:
+        return None
+    if settings.pg_db_replica_balancing == "least-connections":
+        return min(available, key=lambda replica: replica.engine.sync_engine.pool.checkedout())
+    return available[next(_round_robin) % len(available)]
+
+class RoutingSession(Session):
+    """
+    Session sending SELECT statements to a read replica and everything else to the primary (its bind).
+
+    A session sticks to the primary once it wrote and to the first replica it read from. Statements with
+    the primary execution option always run on the primary. info["routed_to"] holds the replica the last
+    statement was sent to, None when it ran on the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        self.info["routed_to"] = None
+        if not isinstance(clause, Select):
+            return self.bind
+        if self.info.get("wrote") or clause.get_execution_options().get("primary"):
+            PG_READS_ROUTED.labels(target="primary").inc()
+            return self.bind
+        replica = self.info.get("replica")
+        if replica is None or not replica.available():
+            replica = pick_replica()
+        if replica is None:
+            PG_READS_ROUTED.labels(target="fallback").inc()
+            return self.bind
+        self.info["replica"] = self.info["routed_to"] = replica
+        PG_READS_ROUTED.labels(target="replica").inc()
+        return replica.engine.sync_engine
+
+def _routing_wrote(session:Session):
+    # Everything after a write reads from the primary, the replica may not have it yet
+    session.info["wrote"] = True
+    session.info.pop("replica", None)
+
+@event.listens_for(RoutingSession, "before_flush")
+def _routing_before_flush(session, flush_context, instances):
+    _routing_wrote(session)
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _routing_execute(orm_execute_state):
+    if not orm_execute_state.is_select:
+        _routing_wrote(orm_execute_state.session)
+
+def mark_written(key:str):
+    """Keep the reads of key on the primary for PG_DB_READ_AFTER_WRITE_WINDOW seconds."""
+    if _replicas:
+        _recent_writes.set(key, True)
+
+def written_recently(key:str)->bool:
+    return key in _recent_writes
+
+async def execute_read(db:AsyncSession, statement:Select, params:dict | None=None):
+    """
+    Execute a read, retried on the primary when the replica it was routed to fails.
+
+    Args:
+        db (AsyncSession): The database session.
+        statement (Select): The read-only statement.
+        params (dict | None): Values of its bound parameters.
+    """
+    try:
+        return await db.execute(statement, params)
+    except (DBAPIError, OSError):
+        replica = db.info.get("routed_to")
+        # Only a statement the replica failed is retried, and never after a write the rollback would discard
+        if replica is None or db.info.get("wrote"):
+            raise
+        logger.exception(f"🛢️ Read on replica {replica.name} failed, retrying on the primary")
+        replica.set_state(healthy=False)
+        db.info.pop("replica", None)
+        # The session only read so far, the rollback discards nothing
+        await db.rollback()
+        return await db.execute(statement.execution_options(primary=True), params)
+
+async def _check_replica(replica:Replica):
+    try:
+        async with replica.engine.connect() as connection:
+            lag = float(await asyncio.wait_for(connection.scalar(REPLICA_LAG_QUERY), timeout=settings.pg_db_replica_lag_check_interval))
+        replica.set_state(healthy=True, lag=lag)
+    except Exception:
+        logger.exception(f"🛢️ Lag check of replica {replica.name} failed")
+        replica.set_state(healthy=False)
+
+async def monitor_replicas():
+    """Measure the lag of every replica every PG_DB_REPLICA_LAG_CHECK_INTERVAL seconds until cancelled."""
+    while True:
+        await asyncio.gather(*(_check_replica(replica) for replica in _replicas))
+        await asyncio.sleep(settings.pg_db_replica_lag_check_interval)
+
+def _db_url(host:str, port:int)->str:
+    return f"postgresql+asyncpg://{settings.pg_db_user}:{settings.pg_db_password}@{host}:{port}/{settings.pg_db_database}"
+
+def _replica_addresses()->list[tuple[str,int]]:
+    addresses = []
+    for address in settings.pg_db_replica_hosts.split(","):
+        host, _, port = address.strip().partition(":")
+        addresses.append((host, int(port) if port else settings.pg_db_port))
+    return addresses
 
 async def create_pg_db_pool():
     """Initializes the SQLAlchemy async engine and session maker."""
-    global _engine, _async_session_maker
+    global _engine, _async_session_maker, _replicas, _replica_monitor
     if _engine is not None:
         return
-    db_url = f"postgresql+asyncpg://{settings.pg_db_user}:{settings.pg_db_password}@{settings.pg_db_host}:{settings.pg_db_port}/{settings.pg_db_database}"
-    _engine = create_async_engine(db_url, pool_size=settings.pg_db_pool_max_size)
-    _async_session_maker = async_sessionmaker(_engine, expire_on_commit=False, class_=AsyncSession)
+    db_url = _db_url(settings.pg_db_host, settings.pg_db_port)
+    _engine = _create_engine(db_url, "primary")
+    if settings.pg_db_replica_hosts:
+        _replicas = [Replica(f"{host}:{port}", _create_engine(_db_url(host, port), f"{host}:{port}"))
+                     for host, port in _replica_addresses()]
+        _async_session_maker = async_sessionmaker(_engine, expire_on_commit=False, class_=AsyncSession, sync_session_class=RoutingSession)
+        _replica_monitor = asyncio.create_task(monitor_replicas())
+        logger.info(f"🛢️ Routing reads to {len(_replicas)} replicas ({settings.pg_db_replica_balancing}).")
+    else:
+        _async_session_maker = async_sessionmaker(_engine, expire_on_commit=False, class_=AsyncSession)
     logger.info("🛢️ SQLAlchemy async engine and session maker created.")
 
 async def close_pg_db_pool():
     """Disposes the SQLAlchemy engine."""
-    global _engine, _async_session_maker
+    global _engine, _async_session_maker, _replicas, _replica_monitor
+    if _replica_monitor is not None:
+        _replica_monitor.cancel()
+        try:
+            await _replica_monitor
+        except asyncio.CancelledError:
+            pass
+        _replica_monitor = None
+    for replica in _replicas:
+        await replica.engine.dispose()
+    _replicas = []
     if _engine is not None:
         await _engine.dispose()
         _engine = None
@@ -29,10 +290,13 @@ async def close_pg_db_pool():
         logger.info("🛢️ SQLAlchemy engine disposed.")
 
 async def get_pg_db_connection() -> AsyncGenerator[AsyncSession, None]:
-    """Dependency that yields a SQLAlchemy AsyncSession."""
+    """Dependency that yields a SQLAlchemy AsyncSession, opened lazily on first use (see LazySession)."""
     global _async_session_maker
     if _async_session_maker is None:
         logger.info("🛢️ SQLAlchemy session maker was not initialized.")
         raise ConnectionError("Database session maker is not initialized.")
-    async with _async_session_maker() as session:
-        yield session
\ No newline at end of file
+    session = LazySession(_async_session_maker)
+    try:
+        yield session
+    finally:
+        await session.close()
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import redis.asyncio as aioredis
+from app.config.settings import settings
+from app.helper.user_profile_cache import UserProfileCache
+import app.dependacy.redis_database as redis_database
+from app.dependacy.pg_database import mark_written
+
+logger = logging.getLogger(__name__)
+
+# Global task evicting the profiles other workers invalidated
+profile_cache_listener: asyncio.Task | None = None
+# Plain client the listener subscribes with in cluster mode
+_cluster_pubsub_client: aioredis.Redis | None = None
+
+async def listen_for_invalidations(redis:aioredis.Redis, reconnect_delay:float=1.0):
+    """
+    Evict the local copy of every profile published on the invalidation channel until cancelled.
+
+    Messages published while the subscription is down are lost, so the local tier is dropped whenever
+    the subscription is (re)established.
+    """
+    while True:
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(UserProfileCache.CHANNEL)
+            UserProfileCache.clear()
+            while True:
+                # Poll below the socket timeout so an idle channel does not look like a dead connection
+                message = await pubsub.get_message(timeout=min(1.0, settings.redis_socket_timeout / 2))
+                if message and message.get("type") == "message":
+                    username = message["data"]
+                    username = username.decode() if isinstance(username, (bytes, bytearray)) else username
+                    UserProfileCache.evict(username)
+                    # The profile was just written by another worker
+                    mark_written(username)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("User profile invalidation subscription failed, resubscribing")
+            await asyncio.sleep(reconnect_delay)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+async def create_profile_cache_listener():
+    """Starts listening for profile invalidations when the Redis tier of the profile cache is used."""
+    global profile_cache_listener, _cluster_pubsub_client
+    if profile_cache_listener is not None:
+        return
+    if not (settings.user_profile_cache_enabled and settings.user_profile_cache_redis) or redis_database.redis_pool is None:
+        return
+    if settings.redis_cluster:
+        # The cluster client has no pub/sub, a plain connection to the REDIS_URL node receives every message
+        _cluster_pubsub_client = aioredis.from_url(settings.redis_url, **redis_database._connection_kwargs())
+        redis = _cluster_pubsub_client
+    else:
+        redis = redis_database.redis_pool
+    profile_cache_listener = asyncio.create_task(listen_for_invalidations(redis))
+    logger.info("👤 User profile cache invalidation listener started.")
+
+async def close_profile_cache_listener():
+    """Stops the invalidation listener."""
+    global profile_cache_listener, _cluster_pubsub_client
+    if profile_cache_listener is None:
+        return
+    task, profile_cache_listener = profile_cache_listener, None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    if _cluster_pubsub_client is not None:
+        await _cluster_pubsub_client.aclose()
+        _cluster_pubsub_client = None
+    logger.info("👤 User profile cache invalidation listener stopped.")
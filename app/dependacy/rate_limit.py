@@ -0,0 +1,82 @@
+import logging
+from fastapi import Depends, HTTPException, Request, status
+from app.config.settings import settings
+from app.dependacy.authenticate_user import AuthenticateUser
+from app.dependacy.state_backend import get_state_backend
+from app.helper.metrics import RATE_LIMITED
+from app.repository.state_backend import StateBackend
+from app.schema.token import TokenValidationResponse
+
+class RateLimiter:
+    """
+    Sliding window rate limit dependencies keyed per client IP and per user (optionally per OTP type).
+
+    The limiter itself checks the client IP bucket. Add it to the route decorator dependencies so it is
+    resolved before the authentication dependency, rejected requests then never reach Keycloak, Postgres or
+    the OTP senders. check_user checks the per user bucket once the credentials were validated, so nobody
+    can spend the budget of another user by sending its username with a wrong password. Windows live in the
+    state backend (Redis or process memory with STATE_BACKEND=memory). Backend errors let the request through.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, scope:str, per_user:int, per_ip:int, by_otp_type:bool=False):
+        """
+        Args:
+            scope (str): Name of the limited operation, part of the keys and metric labels.
+            per_user (int): Requests allowed per user within RATE_LIMIT_WINDOW, 0 disables the limit.
+            per_ip (int): Requests allowed per client IP within RATE_LIMIT_WINDOW, 0 disables the limit.
+            by_otp_type (bool): Keep a separate user bucket per otp_type of the JSON body.
+        """
+        self.scope = scope
+        self.per_user = per_user
+        self.per_ip = per_ip
+        self.by_otp_type = by_otp_type
+
+    async def _hit(self, state:StateBackend, key:str, limit:int)->int:
+        """Record a request in the bucket, return 0 when allowed or the seconds to wait."""
+        retry_in = await state.sliding_window_hit(key, limit, settings.rate_limit_window * 1000)
+        if not retry_in:
+            return 0
+        return max(1, -(-retry_in // 1000))
+
+    async def _check(self, state:StateBackend, bucket:str, key:str, limit:int):
+        try:
+            retry_after = await self._hit(state, key, limit)
+        except Exception:
+            RateLimiter.logger.exception(f"Rate limit check for {self.scope} failed, letting the request through")
+            return
+        if retry_after:
+            RATE_LIMITED.labels(scope=self.scope, bucket=bucket).inc()
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail="Too many requests, please try again later.",
+                                headers={"Retry-After": str(retry_after)})
+
+    async def __call__(self, request:Request, state:StateBackend=Depends(get_state_backend)):
+        if not settings.rate_limit_enabled or not self.per_ip or not request.client:
+            return
+        await self._check(state, "ip", f"rate:{self.scope}:ip:{{{request.client.host}}}", self.per_ip)
+
+    async def check_user(self, request:Request,
+                         authentication_results:TokenValidationResponse=Depends(AuthenticateUser.get_provisioned_user),
+                         state:StateBackend=Depends(get_state_backend)):
+        """Per user bucket, resolved after the authentication (the same dependency as the route, run once)."""
+        if not settings.rate_limit_enabled or not self.per_user:
+            return
+        suffix = ""
+        if self.by_otp_type:
+            try:
+                suffix = f":{(await request.json()).get('otp_type')}"
+            except Exception:
+                suffix = ":invalid"
+        # Hash tagged on the username like the other per user keys
+        await self._check(state, "user", f"{{{authentication_results.username}}}:rate:{self.scope}{suffix}", self.per_user)
+
+# Verification endpoints, guessing codes is what they have to withstand
+otp_verification_rate_limit = RateLimiter("verify-otp", per_user=settings.rate_limit_verify_per_user,
+                                          per_ip=settings.rate_limit_verify_per_ip, by_otp_type=True)
+totp_verification_rate_limit = RateLimiter("verify-totp", per_user=settings.rate_limit_verify_per_user,
+                                           per_ip=settings.rate_limit_verify_per_ip)
+# Profile updates send paid SMS and emails
+update_rate_limit = RateLimiter("update", per_user=settings.rate_limit_update_per_user,
+                                per_ip=settings.rate_limit_update_per_ip)
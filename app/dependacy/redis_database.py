@@ -1,4 +1,6 @@
 import redis.asyncio as aioredis
+from redis.asyncio.connection import parse_url
+from redis.asyncio.sentinel import Sentinel
 from typing import AsyncGenerator
 from app.config.settings import settings
 import logging
@@ -7,32 +9,96 @@ logger = logging.getLogger(__name__)
 
 # Global variable for the connection pool
 redis_pool = None
+# Client for reads that tolerate replication lag, None when no replicas are configured
+redis_replica_pool = None
+
+def _connection_kwargs()->dict:
+    """Socket timeouts and health checks shared by every Redis client, timed out calls are retried by the client."""
+    return dict(
+        encoding="utf-8",
+        decode_responses=True,
+        max_connections=settings.redis_max_connections,
+        socket_timeout=settings.redis_socket_timeout,
+        socket_connect_timeout=settings.redis_socket_connect_timeout,
+        health_check_interval=settings.redis_health_check_interval,
+    )
+
+def _sentinel_addresses()->list[tuple[str,int]]:
+    addresses = []
+    for address in settings.redis_sentinels.split(","):
+        host, _, port = address.strip().rpartition(":")
+        addresses.append((host, int(port)))
+    return addresses
 
 async def create_redis_db_pool():
     """Initializes the Redis connection pool."""
     # Consider redis_pool variable global
-    global redis_pool
+    global redis_pool, redis_replica_pool
+    if settings.redis_cluster:
+        # Cluster aware client, discovers the nodes and routes every key to the node owning its slot
+        redis_pool = aioredis.RedisCluster.from_url(settings.redis_url, **_connection_kwargs())
+        await redis_pool.initialize()
+        if settings.redis_read_from_replicas:
+            redis_replica_pool = aioredis.RedisCluster.from_url(settings.redis_url, read_from_replicas=True, **_connection_kwargs())
+            await redis_replica_pool.initialize()
+        logger.info("⛁ Redis cluster client created.")
+        return
+    if settings.redis_sentinels:
+        # Sentinel tells which node is the primary, connections follow it after a failover.
+        # Database and credentials still come from REDIS_URL.
+        url_kwargs = {key: value for key, value in parse_url(settings.redis_url).items() if key in ("db", "username", "password")}
+        sentinel = Sentinel(_sentinel_addresses(),
+                            sentinel_kwargs=dict(socket_timeout=settings.redis_socket_timeout,
+                                                 socket_connect_timeout=settings.redis_socket_connect_timeout),
+                            **url_kwargs, **_connection_kwargs())
+        redis_pool = sentinel.master_for(settings.redis_sentinel_master)
+        if settings.redis_read_from_replicas:
+            redis_replica_pool = sentinel.slave_for(settings.redis_sentinel_master)
+        logger.info(f"⛁ Redis connection pool created through sentinel for {settings.redis_sentinel_master}.")
+        return
     # Create the Redis connection pool
-    redis_pool = aioredis.from_url(
-        settings.redis_url,
-        encoding="utf-8",
-        decode_responses=True,
-        max_connections=settings.redis_max_connections
-    )
+    redis_pool = aioredis.from_url(settings.redis_url, **_connection_kwargs())
+    if settings.redis_read_from_replicas and settings.redis_replica_url:
+        redis_replica_pool = aioredis.from_url(settings.redis_replica_url, **_connection_kwargs())
     logger.info("⛁ Redis connection pool created.")
 
+async def _close_client(client):
+    if isinstance(client, aioredis.RedisCluster):
+        await client.aclose()
+    else:
+        # Sentinel managed clients do not own their pool unless told so
+        await client.aclose(close_connection_pool=True)
+
 async def close_redis_db_pool():
     """Closes the Redis connection pool."""
     # Consider redis_pool variable global
-    global redis_pool
+    global redis_pool, redis_replica_pool
     # Close the Redis connection pool if it exists
+    if redis_replica_pool:
+        await _close_client(redis_replica_pool)
+        redis_replica_pool = None
     if redis_pool:
-        await redis_pool.aclose()
+        await _close_client(redis_pool)
         logger.info("⛁ Redis connection pool closed.")
 
+def redis_reader(db:aioredis.Redis, allow_stale:bool=False)->aioredis.Redis:
+    """
+    Pick the client for a read-only call.
+
+    Args:
+        db (aioredis.Redis): Client the caller got from get_redis_db_client.
+        allow_stale (bool): The call site tolerates replication lag, e.g. a just written key may be missing.
+
+    Returns:
+        aioredis.Redis: A replica client when allowed and configured, otherwise db.
+    """
+    if allow_stale and redis_replica_pool is not None and db is redis_pool:
+        return redis_replica_pool
+    return db
+
 async def get_redis_db_client() -> AsyncGenerator[aioredis.Redis, None]:
     """Dependency to get a client from the pool."""
     # Raise an error if the pool is not initialized
     if redis_pool is None:
         raise ConnectionError("Redis pool is not initialized.")
-    yield redis_pool
\ No newline at end of file
+    yield redis_pool
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, TypeVar
+from app.config.settings import settings
+from app.helper.metrics import QR_RENDER_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Global app-lifetime executor for CPU heavy rendering (QR codes)
+render_executor: Executor | None = None
+# Jobs submitted and not finished yet, the executor queue is bounded by this semaphore
+_render_slots: asyncio.Semaphore | None = None
+
+def build_render_executor() -> Executor:
+    """Builds the thread or process pool configured by QR_RENDER_EXECUTOR and QR_RENDER_WORKERS."""
+    if settings.qr_render_executor == "process":
+        return ProcessPoolExecutor(max_workers=settings.qr_render_workers)
+    return ThreadPoolExecutor(max_workers=settings.qr_render_workers, thread_name_prefix="qr-render")
+
+async def create_render_pool():
+    """Initializes the rendering pool."""
+    global render_executor
+    if render_executor is None:
+        render_executor = build_render_executor()
+    logger.info(f"🖼 {settings.qr_render_executor} render pool created with {settings.qr_render_workers} workers.")
+
+async def close_render_pool():
+    """Waits for the running render jobs and shuts the pool down."""
+    global render_executor, _render_slots
+    _render_slots = None
+    if render_executor is not None:
+        executor, render_executor = render_executor, None
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+        logger.info("🖼 Render pool closed.")
+
+def get_render_pool() -> Executor:
+    """Returns the shared rendering pool, creating it when the lifespan did not run."""
+    global render_executor
+    if render_executor is None:
+        render_executor = build_render_executor()
+    return render_executor
+
+async def run_in_render_pool(function:Callable[..., T], *args) -> T:
+    """
+    Run function(*args) in the rendering pool without blocking the event loop.
+
+    At most QR_RENDER_MAX_PENDING jobs are handed to the pool, further callers wait here so a burst of
+    enrollments cannot queue unbounded work. With the process executor function and args must be picklable.
+    """
+    global _render_slots
+    if _render_slots is None:
+        _render_slots = asyncio.Semaphore(settings.qr_render_max_pending)
+    QR_RENDER_QUEUE_DEPTH.inc()
+    try:
+        async with _render_slots:
+            return await asyncio.get_running_loop().run_in_executor(get_render_pool(), function, *args)
+    finally:
+        QR_RENDER_QUEUE_DEPTH.dec()
@@ -0,0 +1,17 @@
+from typing import AsyncGenerator
+from app.config.settings import settings
+from app.repository.state_backend import StateBackend,InMemoryStateBackend,as_state_backend
+import app.dependacy.redis_database as redis_database
+
+# Process local OTP/TOTP state, used when STATE_BACKEND=memory
+memory_state_backend = InMemoryStateBackend()
+
+async def get_state_backend() -> AsyncGenerator[StateBackend, None]:
+    """Dependency to get the backend holding the OTP and TOTP state."""
+    if settings.state_backend == "memory":
+        yield memory_state_backend
+        return
+    # Raise an error if the pool is not initialized
+    if redis_database.redis_pool is None:
+        raise ConnectionError("Redis pool is not initialized.")
+    yield as_state_backend(redis_database.redis_pool)
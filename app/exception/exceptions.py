@@ -113,4 +113,31 @@ class ExistingOTPError(Exception):
     def __str__(self):
         if self.code:
             return f"Error Code {self.code}: {self.message}"
-        return self.message
\ No newline at end of file
+        return self.message
+
+class TooManyOTPAttemptsError(Exception):
+    """Too Many OTP Attempts Error class."""
+
+    def __init__(self, message="Too many OTP verification attempts, please request a new OTP.", code=None):
+        self.message = message
+        self.code = code
+        super().__init__(self.message) # Call the base Exception constructor
+
+    def __str__(self):
+        if self.code:
+            return f"Error Code {self.code}: {self.message}"
+        return self.message
+
+class ServiceUnavailableError(Exception):
+    """Service Unavailable Error class."""
+
+    def __init__(self, message="Upstream service is unavailable, please try again later.", code=None, retry_after=None):
+        self.message = message
+        self.code = code
+        self.retry_after = retry_after
+        super().__init__(self.message) # Call the base Exception constructor
+
+    def __str__(self):
+        if self.code:
+            return f"Error Code {self.code}: {self.message}"
+        return self.message
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import json
+import secrets
+import logging
+import weakref
+import redis.asyncio as aioredis
+from app.config.settings import settings
+from app.helper.cache import TTLCache
+from app.schema.token import TokenValidationResponse
+import app.dependacy.redis_database as redis_database
+
+# Stores the login ARGV[1] under KEYS[1] for ARGV[2] seconds, prefixed with the current login generation of
+# the user KEYS[2]. The generation key is created when missing and always outlives the logins stamped with it,
+# so a login can not come back to life once its generation was bumped.
+STORE_LOGIN_SCRIPT = """
+redis.call('SET', KEYS[2], '0', 'NX', 'EX', ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2], 'GT')
+local generation = redis.call('GET', KEYS[2])
+redis.call('SET', KEYS[1], generation .. ':' .. ARGV[1], 'EX', ARGV[2])
+return generation
+"""
+
+# Bumps the login generation KEYS[1] of a user. Without the key no login of the user is cached in Redis,
+# nothing to invalidate then, and creating it would leave a key without expiry behind.
+BUMP_GENERATION_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return 0
+"""
+
+class AuthCache:
+    """
+    Caches validated logins so repeated HTTPBasic requests skip Keycloak.
+
+    Entries are keyed by a salted PBKDF2 digest of the credentials, raw passwords are never stored.
+    The in-process LRU tier is always used, the Redis tier is shared between workers and requires
+    AUTH_CACHE_SECRET so every worker derives the same digests. Both tiers keep the token claims, so a
+    cached login carries the same result whichever tier answers.
+
+    invalidate_user (password change) and invalidate (logout) drop logins in this process and bump the
+    login generation of the user in Redis, logins stamped with an older generation are no longer served.
+    With the Redis tier the other workers keep their local copy for AUTH_CACHE_LOCAL_TTL seconds at most.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    _salt = settings.auth_cache_secret.encode() if settings.auth_cache_secret else secrets.token_bytes(16)
+    _local = TTLCache(max_size=settings.auth_cache_max_size)
+    # username -> digests cached locally for that user, bounded by the LRU like the logins themselves
+    _user_digests = TTLCache(max_size=settings.auth_cache_max_size)
+    # Scripts registered once per Redis client
+    _scripts: "weakref.WeakKeyDictionary[aioredis.Redis, dict]" = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _redis_enabled()->bool:
+        return settings.auth_cache_redis and bool(settings.auth_cache_secret) and redis_database.redis_pool is not None
+
+    @staticmethod
+    def _digest_key(username:str,digest:str)->str:
+        # Versioned, v2 entries had no generation. Hash tagged so a user's logins and generation share a slot
+        return f"auth-cache:v3:{{{username}}}:{digest}"
+
+    @staticmethod
+    def _generation_key(username:str)->str:
+        return f"auth-cache:v3:{{{username}}}:generation"
+
+    @staticmethod
+    def _script(redis:aioredis.Redis, name:str):
+        scripts = AuthCache._scripts.get(redis)
+        if scripts is None:
+            scripts = AuthCache._scripts[redis] = {"store": redis.register_script(STORE_LOGIN_SCRIPT),
+                                                   "bump": redis.register_script(BUMP_GENERATION_SCRIPT)}
+        return scripts[name]
+
+    @staticmethod
+    async def digest(username:str,password:str)->str:
+        """Derive the cache key for the credentials, hashing runs off the event loop."""
+        credentials = f"{username}\x00{password}".encode()
+        derived = await asyncio.to_thread(hashlib.pbkdf2_hmac, "sha256", credentials, AuthCache._salt,
+                                          settings.auth_cache_hash_iterations)
+        return derived.hex()
+
+    @staticmethod
+    async def get(username:str,digest:str)->TokenValidationResponse | None:
+        """
+        Return the cached login for the digest.
+
+        Args:
+            username (str): User the credentials belong to.
+            digest (str): Credentials digest.
+
+        Returns:
+            TokenValidationResponse | None: Cached validation result if found.
+        """
+        cached = AuthCache._local.get(digest)
+        if cached is not None:
+            return cached
+        if not AuthCache._redis_enabled():
+            return None
+        try:
+            # Invalidations must be seen right away, so this reads from the primary
+            async with redis_database.redis_pool.pipeline(transaction=False) as pipe:
+                pipe.get(AuthCache._digest_key(username, digest))
+                pipe.ttl(AuthCache._digest_key(username, digest))
+                pipe.get(AuthCache._generation_key(username))
+                data, ttl, generation = await pipe.execute()
+            if not data or ttl is None or ttl <= 0:
+                return None
+            data = data.decode() if isinstance(data, (bytes, bytearray)) else data
+            stamped, _, data = data.partition(":")
+            generation = generation.decode() if isinstance(generation, (bytes, bytearray)) else generation
+            # Invalidated since the login was cached
+            if stamped != (generation or "0"):
+                return None
+            cached = json.loads(data)
+        except Exception:
+            AuthCache.logger.exception("Could not read the shared authentication cache")
+            return None
+        result = TokenValidationResponse(successful=True, username=cached["username"], claims=cached.get("claims"))
+        AuthCache._store_local(digest, result, min(ttl, settings.auth_cache_local_ttl))
+        return result
+
+    @staticmethod
+    async def set(digest:str,result:TokenValidationResponse,expires_in:int):
+        """
+        Cache a successful login until shortly before its token expires.
+
+        Args:
+            digest (str): Credentials digest.
+            result (TokenValidationResponse): Successful validation result.
+            expires_in (int): Token lifetime in seconds.
+        """
+        ttl = expires_in - settings.auth_cache_expiry_margin
+        if not result.successful or ttl <= 0:
+            return
+        if not AuthCache._redis_enabled():
+            AuthCache._store_local(digest, result, ttl)
+            return
+        # Other workers learn about invalidations through Redis only
+        AuthCache._store_local(digest, result, min(ttl, settings.auth_cache_local_ttl))
+        try:
+            redis = redis_database.redis_pool
+            data = json.dumps({"username": result.username, "claims": result.claims}, separators=(",", ":"))
+            await AuthCache._script(redis, "store")(keys=[AuthCache._digest_key(result.username, digest), AuthCache._generation_key(result.username)],
+                                                args=[data, ttl])
+        except Exception:
+            AuthCache.logger.exception("Could not write the shared authentication cache")
+
+    @staticmethod
+    def _store_local(digest:str,result:TokenValidationResponse,ttl:int):
+        AuthCache._local.set(digest, result, ttl=ttl)
+        # Keep the digests the LRU still holds, peek does not refresh them
+        digests = {d for d in AuthCache._user_digests.peek(result.username, ()) if AuthCache._local.peek(d) is not None}
+        digests.add(digest)
+        AuthCache._user_digests.set(result.username, digests)
+
+    @staticmethod
+    async def invalidate(username:str,password:str):
+        """Forget a single login, e.g. on logout."""
+        digest = await AuthCache.digest(username, password)
+        AuthCache._local.pop(digest)
+        if AuthCache._redis_enabled():
+            try:
+                await redis_database.redis_pool.delete(AuthCache._digest_key(username, digest))
+            except Exception:
+                AuthCache.logger.exception("Could not invalidate the shared authentication cache")
+
+    @staticmethod
+    async def invalidate_user(username:str):
+        """Forget every cached login of a user, e.g. after a password change."""
+        for digest in AuthCache._user_digests.pop(username, ()):
+            AuthCache._local.pop(digest)
+        if AuthCache._redis_enabled():
+            try:
+                # INCR keeps the expiry the key got from the logins stamped with the previous generation
+                await AuthCache._script(redis_database.redis_pool, "bump")(keys=[AuthCache._generation_key(username)])
+            except Exception:
+                AuthCache.logger.exception("Could not invalidate the shared authentication cache")
+
+    @staticmethod
+    def clear():
+        """Drop the in-process tier."""
+        AuthCache._local.clear()
+        AuthCache._user_digests.clear()
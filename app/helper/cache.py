@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after their TTL."""
+
+    def __init__(self, max_size:int, ttl:float|None=None):
+        """
+        Args:
+            max_size (int): Maximum number of entries, least recently used entries are evicted first.
+            ttl (float | None): Default entry lifetime in seconds, None keeps entries until evicted.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float | None, Any]] = OrderedDict()
+
+    def get(self, key:Hashable, default:Any=None)->Any:
+        """Return the cached value for key or default when missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key:Hashable, value:Any, ttl:float|None=None):
+        """Cache value under key for ttl seconds (defaults to the cache TTL)."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def peek(self, key:Hashable, default:Any=None)->Any:
+        """Like get but leaves the recency of key untouched."""
+        entry = self._entries.get(key)
+        if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+            return default
+        return entry[1]
+
+    def pop(self, key:Hashable, default:Any=None)->Any:
+        """Remove key and return its value."""
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        """Remove every entry."""
+        self._entries.clear()
+
+    def __contains__(self, key:Hashable)->bool:
+        # Membership tests do not count as a use
+        return self.peek(key, _MISSING) is not _MISSING
+
+    def __len__(self)->int:
+        return len(self._entries)
+
+_MISSING = object()
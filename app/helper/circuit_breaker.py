@@ -0,0 +1,128 @@
+import asyncio
+import time
+import logging
+from typing import Any, Awaitable, Callable, TypeVar
+from app.config.settings import settings
+from app.exception.exceptions import ServiceUnavailableError
+from app.helper.metrics import (UPSTREAM_LATENCY, CIRCUIT_BREAKER_STATE, CIRCUIT_BREAKER_FAILURES,
+                                CIRCUIT_BREAKER_REJECTED)
+
+T = TypeVar("T")
+
+class CircuitBreaker:
+    """
+    Guards calls to an upstream service with a latency budget and a circuit breaker.
+
+    After failure_threshold consecutive failures (errors, calls over the latency budget or slower than
+    slow_call_threshold) the circuit opens and calls fail fast with ServiceUnavailableError. Once
+    reset_timeout elapsed a limited number of probe calls is let through (half-open), a successful probe
+    closes the circuit and a failed one opens it again.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, upstream:str, latency_budget:float, slow_call_threshold:float, failure_threshold:int,
+                 reset_timeout:float, half_open_max_calls:int=1):
+        self.upstream = upstream
+        self.latency_budget = latency_budget
+        self.slow_call_threshold = slow_call_threshold
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CircuitBreaker.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        CIRCUIT_BREAKER_STATE.labels(upstream=upstream).set(0)
+
+    def _set_state(self, state:str):
+        if state != self.state:
+            self.logger.warning("⚡ %s circuit %s -> %s", self.upstream, self.state, state)
+        self.state = state
+        CIRCUIT_BREAKER_STATE.labels(upstream=self.upstream).set(CircuitBreaker._STATE_VALUES[state])
+
+    def _retry_after(self)->int:
+        return max(1, int(self._opened_at + self.reset_timeout - time.monotonic()) + 1)
+
+    def _before_call(self)->bool:
+        """Raise when the call must be rejected, return True when the call is a half-open probe."""
+        if self.state == CircuitBreaker.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                CIRCUIT_BREAKER_REJECTED.labels(upstream=self.upstream).inc()
+                raise ServiceUnavailableError(f"{self.upstream} is unavailable, please try again later.",
+                                              retry_after=self._retry_after())
+            self._set_state(CircuitBreaker.HALF_OPEN)
+            self._probes = 0
+        if self.state == CircuitBreaker.HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                CIRCUIT_BREAKER_REJECTED.labels(upstream=self.upstream).inc()
+                raise ServiceUnavailableError(f"{self.upstream} is recovering, please try again later.", retry_after=1)
+            self._probes += 1
+            return True
+        return False
+
+    def _on_success(self, probe:bool):
+        if probe:
+            self._probes -= 1
+        self._failures = 0
+        if self.state != CircuitBreaker.CLOSED:
+            self._set_state(CircuitBreaker.CLOSED)
+
+    def _on_failure(self, probe:bool, reason:str):
+        CIRCUIT_BREAKER_FAILURES.labels(upstream=self.upstream, reason=reason).inc()
+        if probe:
+            self._probes -= 1
+        self._failures += 1
+        if probe or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(CircuitBreaker.OPEN)
+
+    async def call(self, call:Callable[[], Awaitable[T]], is_failure:Callable[[Any], bool]|None=None)->T:
+        """
+        Run call within the latency budget unless the circuit is open.
+
+        Args:
+            call (Callable[[], Awaitable[T]]): Starts the upstream call.
+            is_failure (Callable[[Any], bool] | None): Flags results that count as failures (e.g. 5xx responses).
+
+        Returns:
+            T: Result of the call.
+        """
+        probe = self._before_call()
+        started_at = time.monotonic()
+        try:
+            result = await asyncio.wait_for(call(), timeout=self.latency_budget)
+        except asyncio.TimeoutError:
+            self._on_failure(probe, "timeout")
+            raise ServiceUnavailableError(f"{self.upstream} did not answer within {self.latency_budget}s.")
+        except asyncio.CancelledError:
+            if probe:
+                self._probes -= 1
+            raise
+        except Exception:
+            self._on_failure(probe, "error")
+            raise
+        finally:
+            UPSTREAM_LATENCY.labels(upstream=self.upstream).observe(time.monotonic() - started_at)
+        if is_failure is not None and is_failure(result):
+            self._on_failure(probe, "error")
+        elif time.monotonic() - started_at > self.slow_call_threshold:
+            self._on_failure(probe, "slow")
+        else:
+            self._on_success(probe)
+        return result
+
+# Guards every call to Keycloak
+keycloak_breaker = CircuitBreaker(
+    "keycloak",
+    latency_budget=settings.keycloak_call_timeout,
+    slow_call_threshold=settings.keycloak_slow_call_threshold,
+    failure_threshold=settings.keycloak_breaker_failure_threshold,
+    reset_timeout=settings.keycloak_breaker_reset_timeout,
+    half_open_max_calls=settings.keycloak_breaker_half_open_max_calls,
+)
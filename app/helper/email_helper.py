@@ -1,4 +1,4 @@
-import httpx
+from app.dependacy.http_client import get_http_client,RESEND
 from app.config.settings import settings
 import logging
 
@@ -91,13 +91,13 @@ class EmailHelper:
                 "html":html
     }
     EmailHelper.logger.info(f"Resend payload:{payload}")
-    async with httpx.AsyncClient() as client:
-      response = await client.post(url=settings.resend_api_url, json=payload, headers=headers)
-      if response.status_code >= 400:
-        # print full body to understand the 4xx/5xx reason from Resend
-        EmailHelper.logger.error(f"Resend API error: {response.status_code}")
-        try:
-          EmailHelper.logger.error(f"response.json(): {response.json()}")
-        except Exception:
-          EmailHelper.logger.error(f"response.text(): {response.text}")
-      response.raise_for_status()
+    client=get_http_client(RESEND)
+    response = await client.post(url=settings.resend_api_url, json=payload, headers=headers)
+    if response.status_code >= 400:
+      # print full body to understand the 4xx/5xx reason from Resend
+      EmailHelper.logger.error(f"Resend API error: {response.status_code}")
+      try:
+        EmailHelper.logger.error(f"response.json(): {response.json()}")
+      except Exception:
+        EmailHelper.logger.error(f"response.text(): {response.text}")
+    response.raise_for_status()
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from app.dependacy.http_client import get_http_client,KEYCLOAK
+import jwt
+import logging
+from app.config.settings import settings
+from app.exception.exceptions import TokenValidationError
+from app.helper.circuit_breaker import keycloak_breaker
+
+# Only asymmetric algorithms are accepted, a JWKS never carries shared secrets
+ALLOWED_ALGORITHMS=["RS256","RS384","RS512","PS256","PS384","PS512","ES256","ES384","ES512"]
+
+class JWKSHelper:
+    """Caches the realm signing keys and validates access tokens locally."""
+
+    logger = logging.getLogger(__name__)
+
+    # Cached signing keys indexed by kid
+    _keys: dict[str, jwt.PyJWK] = {}
+    _fetched_at: float = 0.0
+    _refresh_lock: asyncio.Lock | None = None
+    _refresh_task: asyncio.Task | None = None
+
+    @staticmethod
+    def jwks_url()->str:
+        """Returns the realm JWKS endpoint."""
+        return f"{settings.keycloak_url}/realms/{settings.keycloak_realm}/protocol/openid-connect/certs"
+
+    @staticmethod
+    def issuer()->str:
+        """Returns the expected token issuer."""
+        return settings.keycloak_issuer or f"{settings.keycloak_url}/realms/{settings.keycloak_realm}"
+
+    @staticmethod
+    async def fetch_keys()->dict[str, jwt.PyJWK]:
+        """
+        Download the realm JWKS and keep only the signing keys.
+
+        Returns:
+            dict[str, jwt.PyJWK]: Signing keys indexed by kid.
+        """
+        client=get_http_client(KEYCLOAK)
+        response = await keycloak_breaker.call(lambda: client.get(JWKSHelper.jwks_url()),
+                                               is_failure=lambda response: response.status_code>=500)
+        response.raise_for_status()
+        jwks = response.json()
+        keys = {}
+        for jwk_data in jwks.get("keys", []):
+            # Skip encryption keys and keys signed with algorithms we do not accept
+            if jwk_data.get("use", "sig") != "sig" or not jwk_data.get("kid"):
+                continue
+            if jwk_data.get("alg") and jwk_data.get("alg") not in ALLOWED_ALGORITHMS:
+                continue
+            try:
+                keys[jwk_data["kid"]] = jwt.PyJWK(jwk_data)
+            except jwt.PyJWKError:
+                JWKSHelper.logger.warning("Skipping unsupported JWKS key kid=%s", jwk_data.get("kid"))
+        return keys
+
+    @staticmethod
+    async def refresh_keys():
+        """Refresh the cached keys, concurrent callers wait for a single download."""
+        if JWKSHelper._refresh_lock is None:
+            JWKSHelper._refresh_lock = asyncio.Lock()
+        started_at = time.monotonic()
+        async with JWKSHelper._refresh_lock:
+            # Another caller refreshed the keys while we were waiting
+            if JWKSHelper._fetched_at >= started_at:
+                return
+            JWKSHelper._keys = await JWKSHelper.fetch_keys()
+            JWKSHelper._fetched_at = time.monotonic()
+            JWKSHelper.logger.info("🔑 JWKS refreshed with %s signing keys", len(JWKSHelper._keys))
+
+    @staticmethod
+    async def _background_refresh():
+        try:
+            await JWKSHelper.refresh_keys()
+        except Exception:
+            # Keep serving the cached keys, the next request will try again
+            JWKSHelper.logger.exception("Background JWKS refresh failed")
+        finally:
+            JWKSHelper._refresh_task = None
+
+    @staticmethod
+    async def get_signing_key(kid:str)->jwt.PyJWK:
+        """
+        Return the signing key for kid, refreshing the cache when needed.
+
+        Args:
+            kid (str): Key id from the token header.
+
+        Returns:
+            jwt.PyJWK: Matching signing key.
+        """
+        if not JWKSHelper._keys:
+            await JWKSHelper.refresh_keys()
+        elif time.monotonic() - JWKSHelper._fetched_at > settings.keycloak_jwks_ttl and JWKSHelper._refresh_task is None:
+            # Keys are stale, refresh them without delaying this request
+            JWKSHelper._refresh_task = asyncio.create_task(JWKSHelper._background_refresh())
+        key = JWKSHelper._keys.get(kid)
+        # Unknown kid usually means the realm keys were rotated
+        if key is None and time.monotonic() - JWKSHelper._fetched_at > settings.keycloak_jwks_min_refresh_interval:
+            await JWKSHelper.refresh_keys()
+            key = JWKSHelper._keys.get(kid)
+        if key is None:
+            raise TokenValidationError("Token is signed with an unknown key.")
+        return key
+
+    @staticmethod
+    def issued_for(claims:dict, audience:str)->bool:
+        """Whether audience is in the aud claim (string or list) or is the authorized party (azp) of the token."""
+        aud = claims.get("aud")
+        audiences = [aud] if isinstance(aud, str) else (aud or [])
+        return audience in audiences or claims.get("azp") == audience
+
+    @staticmethod
+    async def decode_token(token:str)->dict:
+        """
+        Verify the token signature, exp, iss and aud and return its claims.
+
+        Args:
+            token (str): Access token.
+
+        Returns:
+            dict: Verified token claims.
+        """
+        header = jwt.get_unverified_header(token)
+        algorithm = header.get("alg")
+        if algorithm not in ALLOWED_ALGORITHMS:
+            raise TokenValidationError("Token is signed with an unsupported algorithm.")
+        key = await JWKSHelper.get_signing_key(header.get("kid"))
+        if key.algorithm_name != algorithm:
+            raise TokenValidationError("Token algorithm does not match its signing key.")
+        claims = jwt.decode(
+            token,
+            key=key.key,
+            algorithms=[algorithm],
+            issuer=JWKSHelper.issuer(),
+            # aud is checked below, Keycloak names the client in azp when it is not part of aud
+            options={"require": ["exp", "iss"], "verify_aud": False},
+        )
+        if settings.keycloak_verify_audience and not JWKSHelper.issued_for(claims, settings.keycloak_audience):
+            raise TokenValidationError("Token was not issued for this client.")
+        # Refuse refresh and ID tokens, only access tokens are accepted
+        if claims.get("typ", "Bearer") != "Bearer":
+            raise TokenValidationError("Token is not an access token.")
+        return claims
+
+    @staticmethod
+    def clear():
+        """Drop the cached keys."""
+        JWKSHelper._keys = {}
+        JWKSHelper._fetched_at = 0.0
@@ -1,20 +1,74 @@
+from app.dependacy.http_client import get_http_client,KEYCLOAK
+import asyncio
 import httpx
+import hashlib
+import time
 import logging
 from app.config.settings import settings
 from app.schema.token import TokenGenerationResponse,TokenValidationResponse
 from app.schema.user import KeycloakUserInfo,UpdateUserInfo,UpdateUserResults
-from app.exception.exceptions import TokenValidationError,TokenGenerationError,NoMatchingUserError
+from app.exception.exceptions import TokenValidationError,TokenGenerationError,NoMatchingUserError,ServiceUnavailableError
+from app.helper.jwks_helper import JWKSHelper
+from app.helper.cache import TTLCache
+from app.helper.single_flight import SingleFlight
+from app.helper.circuit_breaker import keycloak_breaker
+
+# Cached admin tokens closer than this to their expiry are never handed out
+ADMIN_TOKEN_MIN_VALIDITY=5
 
 class KeycloakHelper:
 
     logger = logging.getLogger(__name__)
 
+    # Cached admin token, its monotonic expiry time and the refresh in flight
+    _admin_token:TokenGenerationResponse|None=None
+    _admin_token_expires_at:float=0.0
+    _admin_token_refresh:asyncio.Task|None=None
+    # User info read through the admin API indexed by username
+    _user_info_cache=TTLCache(max_size=settings.keycloak_user_cache_max_size,ttl=settings.keycloak_user_cache_ttl)
+    # Identical concurrent upstream calls are collapsed onto one request
+    _token_flight=SingleFlight("keycloak_token")
+    _introspect_flight=SingleFlight("keycloak_introspect")
+    _user_info_flight=SingleFlight("keycloak_user_info")
+
+    @staticmethod
+    async def _send(method:str,url:str,**kwargs)->httpx.Response:
+        """Sends a request to Keycloak through the shared client and the Keycloak circuit breaker."""
+        client=get_http_client(KEYCLOAK)
+        return await keycloak_breaker.call(lambda: client.request(method,url,**kwargs),
+                                           is_failure=lambda response: response.status_code>=500)
+
     @staticmethod
     def get_customized_attribute_value(attributes: dict, key: str):
         """Extracts a specific attribute value from a dictionary of attributes."""
         attribute_value = attributes.get(key, [""])
         return attribute_value[0] if isinstance(attribute_value, list) and attribute_value else None
 
+    @staticmethod
+    def user_info_from_claims(claims:dict)->KeycloakUserInfo:
+        """
+        Build the user info from validated token claims instead of asking the admin API.
+
+        Args:
+            claims (dict): Validated access token (or introspection) claims.
+
+        Returns:
+            KeycloakUserInfo: User info carried by the token
+        """
+        mobile=claims.get(settings.keycloak_mobile_claim)
+        mobile=mobile[0] if isinstance(mobile,list) and mobile else mobile
+        mobile_verified=claims.get(settings.keycloak_mobile_verified_claim)
+        mobile_verified=mobile_verified[0] if isinstance(mobile_verified,list) and mobile_verified else mobile_verified
+        return KeycloakUserInfo(id=claims.get("sub"),
+                                username=claims.get("preferred_username"),
+                                first_name=claims.get("given_name"),
+                                last_name=claims.get("family_name"),
+                                email=claims.get("email"),
+                                email_verified=claims.get("email_verified"),
+                                mobile=mobile or None,
+                                mobile_verified=str(mobile_verified).lower()=="true"
+                                )
+
     @staticmethod
     async def generat_token(username:str,password:str)->TokenGenerationResponse:
         """
@@ -27,6 +81,13 @@ class KeycloakHelper:
         Returns:
             token_response (TokenGenerationResponse): Returns the response of token generation request.
         """
+        # Identical concurrent logins share one password grant, the password itself is not kept as key
+        key=(username,hashlib.sha256(password.encode()).hexdigest())
+        return await KeycloakHelper._token_flight.do(key,lambda: KeycloakHelper._request_token(username,password))
+
+    @staticmethod
+    async def _request_token(username:str,password:str)->TokenGenerationResponse:
+        """Runs the password grant against Keycloak."""
         # Generate Token generation URL
         token_url = f"{settings.keycloak_url}/realms/{settings.keycloak_realm}/protocol/openid-connect/token"
         # Generate request body payload
@@ -40,35 +101,112 @@ class KeycloakHelper:
         # Define request header
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
-        async with httpx.AsyncClient() as client:
-            try:
-                # Call Keyclock RestAPI to generate the token
-                response = await client.post(token_url, data=payload, headers=headers)
-                # If request failed raise an error
-                response.raise_for_status()
-                # Load response into token_data
-                token_data = response.json()
-                # Return Token (map to TokenGenerationResponse dataclass fields)
-                return TokenGenerationResponse(
-                    successful=True,
-                    token=token_data.get("access_token"),
-                    token_type=token_data.get("token_type"),
-                    token_expires_in=token_data.get("expires_in", 0),
-                )
-            except Exception as exc:
-                # Catch all possible errors such as network failure and invalid credentials
-                KeycloakHelper.logger.exception("Error generating token for user %s", username)
-                return TokenGenerationResponse(successful=False, token=None, token_type=None, token_expires_in=0)
+        try:
+            # Call Keyclock RestAPI to generate the token
+            response = await KeycloakHelper._send("POST", token_url, data=payload, headers=headers)
+            # If request failed raise an error
+            response.raise_for_status()
+            # Load response into token_data
+            token_data = response.json()
+            # Return Token (map to TokenGenerationResponse dataclass fields)
+            return TokenGenerationResponse(
+                successful=True,
+                token=token_data.get("access_token"),
+                token_type=token_data.get("token_type"),
+                token_expires_in=token_data.get("expires_in", 0),
+            )
+        except ServiceUnavailableError:
+            # Let callers fail fast instead of reporting invalid credentials
+            raise
+        except Exception as exc:
+            # Catch all possible errors such as network failure and invalid credentials
+            KeycloakHelper.logger.exception("Error generating token for user %s", username)
+            return TokenGenerationResponse(successful=False, token=None, token_type=None, token_expires_in=0)
 
 
     @staticmethod
-    async def get_admin_token()->TokenGenerationResponse:
-        """Fetches an admin token from Keycloak using admin user credentials."""
+    async def _refresh_admin_token()->TokenGenerationResponse:
+        """Fetches a new admin token and caches it when successful."""
         # use admin password from settings
-        return await KeycloakHelper.generat_token(settings.keycloak_admin_username, settings.keycloak_admin_password)
+        try:
+            admin_token=await KeycloakHelper.generat_token(settings.keycloak_admin_username, settings.keycloak_admin_password)
+        except ServiceUnavailableError:
+            KeycloakHelper.logger.warning("Admin token could not be refreshed, Keycloak is unavailable")
+            return TokenGenerationResponse(successful=False, token=None, token_type=None, token_expires_in=0)
+        if admin_token.successful:
+            KeycloakHelper._admin_token=admin_token
+            KeycloakHelper._admin_token_expires_at=time.monotonic()+admin_token.token_expires_in
+        return admin_token
+
+    @staticmethod
+    def _start_admin_token_refresh()->asyncio.Task:
+        """Starts an admin token refresh unless one is already running (single-flight)."""
+        if KeycloakHelper._admin_token_refresh is None or KeycloakHelper._admin_token_refresh.done():
+            KeycloakHelper._admin_token_refresh=asyncio.create_task(KeycloakHelper._refresh_admin_token())
+        return KeycloakHelper._admin_token_refresh
+
+    @staticmethod
+    async def get_admin_token()->TokenGenerationResponse:
+        """
+        Returns the cached admin token, fetching a new one from Keycloak when needed.
+
+        The token is refreshed in the background once less than KEYCLOAK_ADMIN_TOKEN_REFRESH_AHEAD
+        seconds remain, concurrent callers share a single refresh.
+        """
+        remaining=KeycloakHelper._admin_token_expires_at-time.monotonic()
+        if KeycloakHelper._admin_token and remaining>ADMIN_TOKEN_MIN_VALIDITY:
+            if remaining<=settings.keycloak_admin_token_refresh_ahead:
+                KeycloakHelper._start_admin_token_refresh()
+            return KeycloakHelper._admin_token
+        # Shield the shared refresh so a cancelled request does not cancel it for the other waiters
+        return await asyncio.shield(KeycloakHelper._start_admin_token_refresh())
+
+    @staticmethod
+    def invalidate_admin_token():
+        """Drops the cached admin token, e.g. after Keycloak rejected it."""
+        KeycloakHelper._admin_token=None
+        KeycloakHelper._admin_token_expires_at=0.0
     
     @staticmethod
-    async def validate_token(token: str)->TokenValidationResponse:
+    async def validate_token(token: str,introspect:bool=False)->TokenValidationResponse:
+        """
+        Validate user token.
+
+        Tokens are verified locally against the cached realm JWKS unless introspection is
+        requested or configured, introspection also catches revoked sessions.
+
+        Args:
+            token (str): Access token.
+            introspect (bool): Force validation through Keycloak token introspection.
+
+        Returns:
+            TokenValidationResponse: Returns the username if the token is valid.
+        """
+        if introspect or settings.keycloak_token_validation=="introspect":
+            return await KeycloakHelper.introspect_token(token)
+        try:
+            claims=await JWKSHelper.decode_token(token)
+            return TokenValidationResponse(
+                successful=True,
+                username=claims.get("preferred_username"),
+                claims=claims
+            )
+        except ServiceUnavailableError:
+            # Let callers fail fast instead of reporting invalid credentials
+            raise
+        except Exception as exc:
+            # Catch all possible errors such as expired, tampered or foreign tokens
+            KeycloakHelper.logger.info("Token could not be validated locally: %s", exc)
+            return TokenValidationResponse(successful=False, username=None)
+
+    @staticmethod
+    async def introspect_token(token: str)->TokenValidationResponse:
+        """Validate user token through Keycloak token introspection."""
+        return await KeycloakHelper._introspect_flight.do(token,lambda: KeycloakHelper._request_introspection(token))
+
+    @staticmethod
+    async def _request_introspection(token: str)->TokenValidationResponse:
+        """Calls the Keycloak token introspection endpoint."""
         # Generate Token validation URL
         token_url = f"{settings.keycloak_url}/realms/{settings.keycloak_realm}/protocol/openid-connect/token/introspect"
         # Define request header
@@ -80,41 +218,55 @@ class KeycloakHelper:
         "token": token
         }
         KeycloakHelper.logger.info(f"# Token Validation Payload:{payload}")
-        async with httpx.AsyncClient() as client:
-            try:
-                # Call Keyclock RestAPI to validate the token
-                response = await client.post(token_url, data=payload, headers=headers)
-                KeycloakHelper.logger.info("introspect status=%s", response.status_code)
-                KeycloakHelper.logger.info("introspect body=%s", response.text)  # safe for debugging; avoid tokens in prod logs
-                # If request failed raise an error
-                response.raise_for_status()
-                # Load response into validation_data (introspection response)
-                validation_data = response.json()
-                # If token is not active, raise a validation error
-                KeycloakHelper.logger.info(validation_data)
-                if not validation_data.get("active", False):
-                    raise TokenValidationError()
-                # Return username mapped to TokenValidationResponse dataclass
-                return TokenValidationResponse(
-                    successful=True,
-                    username=validation_data.get("preferred_username")
-                )
-            except Exception as exc:
-                # Catch all possible errors such as network failure and invalid token
-                KeycloakHelper.logger.exception("Error validating token")
-                return TokenValidationResponse(successful=False, username=None)
+        try:
+            # Call Keyclock RestAPI to validate the token
+            response = await KeycloakHelper._send("POST", token_url, data=payload, headers=headers)
+            KeycloakHelper.logger.info("introspect status=%s", response.status_code)
+            KeycloakHelper.logger.info("introspect body=%s", response.text)  # safe for debugging; avoid tokens in prod logs
+            # If request failed raise an error
+            response.raise_for_status()
+            # Load response into validation_data (introspection response)
+            validation_data = response.json()
+            # If token is not active, raise a validation error
+            KeycloakHelper.logger.info(validation_data)
+            if not validation_data.get("active", False):
+                raise TokenValidationError()
+            # Return username mapped to TokenValidationResponse dataclass
+            return TokenValidationResponse(
+                successful=True,
+                username=validation_data.get("preferred_username"),
+                claims=validation_data
+            )
+        except ServiceUnavailableError:
+            # Let callers fail fast instead of reporting invalid credentials
+            raise
+        except Exception as exc:
+            # Catch all possible errors such as network failure and invalid token
+            KeycloakHelper.logger.exception("Error validating token")
+            return TokenValidationResponse(successful=False, username=None)
     
     # Get a Matching username
-    async def return_matching_user_info(username:str)->KeycloakUserInfo:
+    @staticmethod
+    async def return_matching_user_info(username:str,use_cache:bool=True)->KeycloakUserInfo:
         """
         Look for a matching user in keyclock and return the user info
 
         Args:
             username (str): username to search for
+            use_cache (bool): Serve the user info from the cache when available
 
         Returns:
             KeycloakUserInfo: Matching username info
         """
+        if use_cache:
+            cached_user_info=KeycloakHelper._user_info_cache.get(username)
+            if cached_user_info is not None:
+                return cached_user_info
+        return await KeycloakHelper._user_info_flight.do(username,lambda: KeycloakHelper._fetch_user_info(username))
+
+    @staticmethod
+    async def _fetch_user_info(username:str)->KeycloakUserInfo:
+        """Searches the admin API for username and caches the result."""
         matching_user_info=None
         try:
             # Generate Admin token
@@ -122,26 +274,27 @@ class KeycloakHelper:
             # Raise an error if Admin token cannot be generated
             if not(admin_token.successful):
                 raise TokenGenerationError()
-            # Generate Token validation URL
-            search_user_url = f"{settings.keycloak_url}/admin/realms/{settings.keycloak_realm}/users?username={username}"
+            # Generate user search URL, exact search returns only the user with this username
+            search_user_url = f"{settings.keycloak_url}/admin/realms/{settings.keycloak_realm}/users"
             # Define request header
             headers = {"Authorization": f"Bearer {admin_token.token}"}
-            async with httpx.AsyncClient() as client:
-                response=await client.get(url=search_user_url,headers=headers)
-                response.raise_for_status()
-                search_results=response.json()
-                if len(search_results)==0:
-                    pass # Return no matching user was found
-                # Find matching user
-                for user in search_results:
-                    if user.get("username") == username:
-                        matching_user_info=user
-                # If no matching user was found raise an Error
-                if matching_user_info==None:
-                    raise NoMatchingUserError()
+            response=await KeycloakHelper._send("GET",search_user_url,params={"username":username,"exact":"true"},headers=headers)
+            if response.status_code==401:
+                KeycloakHelper.invalidate_admin_token()
+            response.raise_for_status()
+            search_results=response.json()
+            if len(search_results)==0:
+                pass # Return no matching user was found
+            # Find matching user
+            for user in search_results:
+                if user.get("username") == username:
+                    matching_user_info=user
+            # If no matching user was found raise an Error
+            if matching_user_info==None:
+                raise NoMatchingUserError()
             # Return Matching username info
-            mobile_verified=True if str(KeycloakHelper.get_customized_attribute_value(matching_user_info.get("attributes",{}),"mobileVerified")).lower == "true" else False
-            return KeycloakUserInfo(id=matching_user_info.get("id"),
+            mobile_verified=True if str(KeycloakHelper.get_customized_attribute_value(matching_user_info.get("attributes",{}),"mobileVerified")).lower() == "true" else False
+            user_info=KeycloakUserInfo(id=matching_user_info.get("id"),
                                     username=matching_user_info.get("username"),
                                     first_name=matching_user_info.get("firstName"),
                                     last_name=matching_user_info.get("lastName"),
@@ -150,16 +303,34 @@ class KeycloakHelper:
                                     mobile=KeycloakHelper.get_customized_attribute_value(matching_user_info.get("attributes",{}),"mobile"),
                                     mobile_verified=mobile_verified
                                     )
-            
+            KeycloakHelper._user_info_cache.set(username,user_info)
+            return user_info
+
         except Exception as exc:
             # Log and return Empty KeycloakUserInfo in case of a failure or non matching user.
             KeycloakHelper.logger.exception("Error retrieving matching user info for username=%s", username)
             return KeycloakUserInfo()
 
-    async def update_user_attributes(userinfo:UpdateUserInfo)->UpdateUserResults:
+    @staticmethod
+    def invalidate_user_info(username:str):
+        """Drops the cached user info of username."""
+        KeycloakHelper._user_info_cache.pop(username)
+
+    @staticmethod
+    async def update_user_attributes(username:str,userinfo:UpdateUserInfo)->UpdateUserResults:
+        """
+        Update the email and/or mobile attributes of a Keycloak user.
+
+        Args:
+            username (str): username of the user to update
+            userinfo (UpdateUserInfo): New email and/or mobile number
+
+        Returns:
+            UpdateUserResults: Whether the update succeeded
+        """
         try:
-            # Get Matching User info and if there is no match raise an Error
-            retrieved_user_info=await KeycloakHelper.return_matching_user_info(userinfo.username)
+            # Get fresh user info, the payload below overwrites every attribute so a stale copy must not be used
+            retrieved_user_info=await KeycloakHelper.return_matching_user_info(username,use_cache=False)
             if retrieved_user_info.id == None:
                 raise NoMatchingUserError()
             mobile=[retrieved_user_info.mobile] if retrieved_user_info.mobile else []
@@ -184,10 +355,14 @@ class KeycloakHelper:
             generate_user_update_url = f"{settings.keycloak_url}/admin/realms/{settings.keycloak_realm}/users/{retrieved_user_info.id}"
             headers={'Content-Type': 'application/json',
                      "Authorization": f"Bearer {admin_token.token}"}
-            async with httpx.AsyncClient() as client:
-                update_user_info_response=await client.put(url=generate_user_update_url,data=payload,headers=headers)
-                update_user_info_response.raise_for_status()
-                return UpdateUserResults(True)
+            update_user_info_response=await KeycloakHelper._send("PUT",generate_user_update_url,json=payload,headers=headers)
+            if update_user_info_response.status_code==401:
+                KeycloakHelper.invalidate_admin_token()
+            update_user_info_response.raise_for_status()
+            return UpdateUserResults(True)
         except Exception as exc:
-            KeycloakHelper.logger.exception("Error updating user attributes for username=%s", getattr(userinfo, "username", None))
-            return UpdateUserResults(False)
\ No newline at end of file
+            KeycloakHelper.logger.exception("Error updating user attributes for username=%s", username)
+            return UpdateUserResults(False)
+        finally:
+            # The user may have changed even when the response was lost
+            KeycloakHelper.invalidate_user_info(username)
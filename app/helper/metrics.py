@@ -26,6 +26,28 @@ ERROR_COUNT = Counter("error_count_total", "Total number of error responses", ["
 RESPONSE_SIZE = Histogram("response_size_bytes", "Size of responses in bytes")
 IN_PROGRESS = Gauge("in_progress_requests", "Number of requests in progress")
 
+# Upstream call metrics
+SINGLE_FLIGHT_CALLS = Counter("single_flight_calls_total", "Calls collapsed onto an identical in-flight call (hit) or starting a new one (miss)", ["group", "result"])
+UPSTREAM_LATENCY = Histogram("upstream_call_latency_seconds", "Latency of calls guarded by a circuit breaker", ["upstream"])
+CIRCUIT_BREAKER_STATE = Gauge("circuit_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ["upstream"])
+CIRCUIT_BREAKER_FAILURES = Counter("circuit_breaker_failures_total", "Calls counted as failures by a circuit breaker", ["upstream", "reason"])
+RATE_LIMITED = Counter("rate_limited_requests_total", "Requests rejected by a rate limit", ["scope", "bucket"])
+USER_PROFILE_CACHE_REQUESTS = Counter("user_profile_cache_requests_total", "User profile lookups answered (hit) or not (miss) by a cache tier", ["tier", "result"])
+USER_PROFILE_CACHE_INVALIDATIONS = Counter("user_profile_cache_invalidations_total", "Cached user profiles dropped after a write in this worker (local) or another one (remote)", ["source"])
+CIRCUIT_BREAKER_REJECTED = Counter("circuit_breaker_rejected_calls_total", "Calls rejected without reaching the upstream", ["upstream"])
+
+# Postgres pool and replica metrics
+PG_REPLICA_LAG_SECONDS = Gauge("pg_replica_lag_seconds", "Replication lag of a Postgres read replica", ["replica"])
+PG_REPLICA_AVAILABLE = Gauge("pg_replica_available", "Whether reads are routed to a Postgres read replica (1) or not (0)", ["replica"])
+PG_POOL_CHECKOUT_SECONDS = Histogram("pg_pool_checkout_seconds", "Time spent getting a connection out of a Postgres pool, waits included", ["pool"])
+PG_POOL_HOLD_SECONDS = Histogram("pg_pool_hold_seconds", "Time a Postgres connection stayed checked out of its pool", ["pool"])
+PG_READS_ROUTED = Counter("pg_reads_routed_total", "Reads sent to a replica, to the primary or to the primary because no replica was available (fallback)", ["target"])
+
+# Rendering pool metrics
+QR_RENDER_QUEUE_DEPTH = Gauge("qr_render_queue_depth", "QR code renders waiting for or running in the render pool")
+QR_RENDER_SECONDS = Histogram("qr_render_seconds", "Time spent rendering a QR code in the render pool")
+QR_RENDER_WAIT_SECONDS = Histogram("qr_render_wait_seconds", "Time a QR code render waited before a pool worker picked it up")
+
 def update_system_metrics():
     """Update system-level metrics."""
     # Get current process information
@@ -0,0 +1,53 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+from app.helper.metrics import SINGLE_FLIGHT_CALLS
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """
+    Collapses identical concurrent calls onto a single in-flight awaitable.
+
+    The first caller for a key starts the call, callers arriving while it runs await the same
+    result (or exception). Once the call finishes the key is forgotten, nothing is cached.
+    """
+
+    def __init__(self, group:str):
+        """
+        Args:
+            group (str): Name used to label the hit/miss metrics.
+        """
+        self.group = group
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key:Hashable, call:Callable[[], Awaitable[T]])->T:
+        """
+        Run call for key unless an identical call is already in flight.
+
+        Args:
+            key (Hashable): Identifies identical calls.
+            call (Callable[[], Awaitable[T]]): Starts the upstream call.
+
+        Returns:
+            T: Result of the shared call.
+        """
+        future = self._in_flight.get(key)
+        if future is not None:
+            SINGLE_FLIGHT_CALLS.labels(group=self.group, result="hit").inc()
+        else:
+            SINGLE_FLIGHT_CALLS.labels(group=self.group, result="miss").inc()
+            future = asyncio.ensure_future(call())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # Shield the shared call so one cancelled caller does not cancel it for the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key:Hashable, future:asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        # Mark the exception as retrieved when every caller was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def __len__(self)->int:
+        return len(self._in_flight)
@@ -1,5 +1,5 @@
 from app.config.settings import settings
-import httpx
+from app.dependacy.http_client import get_http_client,TWILIO
 
 class SMSHelper:
 
@@ -19,9 +19,9 @@ class SMSHelper:
                     "Body":SMSHelper.generate_sms_template(recepient_name=recepient_name,otp=otp)
                 }
             auth = (settings.twilio_account, settings.twilio_auth_token)  # Replace with your actual credentials
-            async with httpx.AsyncClient() as client:
-                response = await client.post(send_sms_url, data=data, auth=auth)
-                response.raise_for_status()
-                return True
+            client=get_http_client(TWILIO)
+            response = await client.post(send_sms_url, data=data, auth=auth)
+            response.raise_for_status()
+            return True
         except Exception as exc:
-            return False
\ No newline at end of file
+            return False
@@ -1,9 +1,18 @@
 import io
+import time
 import pyotp
 import base64
 import qrcode
 from app.config.settings import settings
-from app.schema.totp import SeedURIImage,SeedFullInfo
+from qrcode.image.svg import SvgPathImage
+from app.schema.totp import SeedURIImage,SeedFullInfo,QRCodeFormat
+from app.dependacy.render_pool import run_in_render_pool
+from app.helper.metrics import QR_RENDER_SECONDS,QR_RENDER_WAIT_SECONDS
+from app.helper.totp_verifier import TOTPVerifier
+
+# QR_ERROR_CORRECTION setting -> qrcode constant, lower levels give smaller codes
+QR_ERROR_CORRECTION={"L":qrcode.constants.ERROR_CORRECT_L,"M":qrcode.constants.ERROR_CORRECT_M,
+                     "Q":qrcode.constants.ERROR_CORRECT_Q,"H":qrcode.constants.ERROR_CORRECT_H}
 
 class TOTPHelper():
 
@@ -40,35 +49,101 @@ class TOTPHelper():
         Returns:
             bool: True if the TOTP code is valid, False otherwise.
         """
-        # Verify the provided TOTP code against the seed
-        totp=pyotp.TOTP(seed)
-        # Check if the provided TOTP code is valid
-        return totp.now()==totp_code
+        # Verify the provided TOTP code against the seed within the drift window, the key is decoded per call
+        # so no decrypted secret outlives the request
+        return TOTPVerifier.verify(TOTPVerifier.decode_key(seed),totp_code)
     
     @staticmethod
-    def generate_seed_uri_image(seed:str,username:str)->SeedURIImage:
+    def generate_qrcode(data:str,image_format:QRCodeFormat=QRCodeFormat.PNG)->bytes:
+        """Render data as a QR code image using the QR_* settings.
+
+        Args:
+            data (str): The content of the QR code, e.g. a seed URI.
+            image_format (QRCodeFormat): QRCodeFormat.PNG or QRCodeFormat.SVG.
+
+        Returns:
+            bytes: The encoded image.
+        """
+        qr=qrcode.QRCode(error_correction=QR_ERROR_CORRECTION[settings.qr_error_correction],
+                         box_size=settings.qr_box_size,border=settings.qr_border)
+        qr.add_data(data)
+        # Pick the smallest QR version that fits the data
+        qr.make(fit=True)
+        # Prepare a bytes buffer to hold the image data
+        img_byte_arr = io.BytesIO()
+        if image_format==QRCodeFormat.SVG:
+            # A single path scales without loss and needs no raster encoding
+            qr.make_image(image_factory=SvgPathImage).save(img_byte_arr)
+        else:
+            qr.make_image().save(img_byte_arr, format='PNG')
+        return img_byte_arr.getvalue()
+
+    @staticmethod
+    def generate_seed_uri_image(seed:str,username:str,image_format:QRCodeFormat=QRCodeFormat.PNG)->SeedURIImage:
         """Generate a seed URI and a QR code image for the given seed and name.
 
         Args:
             seed (str): The TOTP secret seed.
             username (str): The username of the user or account.
+            image_format (QRCodeFormat): png (base64 encoded), svg (markup) or uri-only (no image).
 
         Returns:
             SeedURIImage: An object containing the seed URI and the QR code image.
         """
         #Generate seed uri
         seed_uri=TOTPHelper.generate_seed_uri(seed,username)
-        # Create a QR code image from the seed URI
-        img = qrcode.make(data=seed_uri)
-        # Prepare a bytes buffer to hold the image data
-        img_byte_arr = io.BytesIO()
-        # Save the QR code image to the buffer in PNG format
-        img.save(img_byte_arr, format='PNG')
-        # Move the buffer's cursor to the beginning
-        img_byte_arr.seek(0)
-        # Return the seed URI and the QR code image encoded as a base64 string
-        return SeedURIImage(seed_uri=seed_uri, qrcode=base64.b64encode(img_byte_arr.read()).decode())
-    
+        if image_format==QRCodeFormat.URI_ONLY:
+            return SeedURIImage(seed_uri=seed_uri, qrcode=None, qrcode_format=image_format)
+        image=TOTPHelper.generate_qrcode(seed_uri,image_format)
+        # SVG is text already, only PNG needs base64 to travel in JSON
+        qrcode_data=image.decode() if image_format==QRCodeFormat.SVG else base64.b64encode(image).decode()
+        return SeedURIImage(seed_uri=seed_uri, qrcode=qrcode_data, qrcode_format=image_format)
+
+    @staticmethod
+    def _timed(function,submitted_at:float,*args):
+        # Runs in a pool worker, time.time() because monotonic clocks are not comparable across processes
+        started_at=time.time()
+        result=function(*args)
+        return result,started_at-submitted_at,time.time()-started_at
+
+    @staticmethod
+    async def _render(function,*args):
+        result,waited,rendered=await run_in_render_pool(TOTPHelper._timed,function,time.time(),*args)
+        QR_RENDER_WAIT_SECONDS.observe(max(0.0,waited))
+        QR_RENDER_SECONDS.observe(rendered)
+        return result
+
+    @staticmethod
+    async def render_seed_uri_image(seed:str,username:str,image_format:QRCodeFormat=QRCodeFormat.PNG)->SeedURIImage:
+        """Generate the seed URI and QR code image in the render pool so the event loop is not blocked.
+
+        Args:
+            seed (str): The TOTP secret seed.
+            username (str): The username of the user or account.
+            image_format (QRCodeFormat): png (base64 encoded), svg (markup) or uri-only (no image).
+
+        Returns:
+            SeedURIImage: An object containing the seed URI and the QR code image.
+        """
+        if image_format==QRCodeFormat.URI_ONLY:
+            # Nothing to render, the client draws the QR code itself
+            return TOTPHelper.generate_seed_uri_image(seed,username,image_format)
+        return await TOTPHelper._render(TOTPHelper.generate_seed_uri_image,seed,username,image_format)
+
+    @staticmethod
+    async def render_qrcode(seed:str,username:str,image_format:QRCodeFormat=QRCodeFormat.PNG)->bytes:
+        """Render the raw QR code image of the seed URI in the render pool.
+
+        Args:
+            seed (str): The TOTP secret seed.
+            username (str): The username of the user or account.
+            image_format (QRCodeFormat): QRCodeFormat.PNG or QRCodeFormat.SVG.
+
+        Returns:
+            bytes: The encoded image.
+        """
+        return await TOTPHelper._render(TOTPHelper.generate_qrcode,TOTPHelper.generate_seed_uri(seed,username),image_format)
+
     @staticmethod
     def generate_seed_with_uri_image(username:str)->SeedFullInfo:
         """Generate a random base32 secret key, a seed URI, and a QR code image for the given name.
@@ -0,0 +1,129 @@
+import base64
+import hmac
+import struct
+import time
+from typing import Sequence
+from app.config.settings import settings
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+class TOTPVerifier:
+    """
+    RFC 6238 TOTP verification on decoded key bytes, compatible with the codes of pyotp.TOTP (SHA1, 6 digits, 30s).
+
+    A code is accepted within ±window time steps around now to absorb clock drift. Every candidate of the
+    window is compared in constant time and without an early exit, so the time taken does not tell whether
+    or at which step the code matched.
+    """
+
+    DIGITS = 6
+    # Zero padded to DIGITS
+    _CODE_FORMAT = b"%06d"
+    INTERVAL = 30
+    DIGEST = "sha1"
+    # Below this many candidate codes setting up the numpy arrays costs more than the truncation it vectorizes
+    VECTORIZE_MIN_CODES = 64
+    _COUNTER = struct.Struct(">Q")
+    _MODULO = 10**DIGITS
+
+    @staticmethod
+    def decode_key(seed:str)->bytes:
+        """
+        Decode a base32 TOTP seed into the HMAC key, padding is optional like in pyotp.
+        Args:
+            seed (str): The TOTP secret seed.
+        Returns:
+            bytes: The key bytes.
+        """
+        return base64.b32decode(seed + "=" * (-len(seed) % 8), casefold=True)
+
+    @staticmethod
+    def _counters(for_time:float | None, window:int | None)->list[bytes]:
+        """Packed counters of the time steps within the drift window around for_time."""
+        window = settings.totp_drift_window if window is None else window
+        step = int((time.time() if for_time is None else for_time) // TOTPVerifier.INTERVAL)
+        pack = TOTPVerifier._COUNTER.pack
+        return [pack(counter) for counter in range(max(0, step - window), step + window + 1)]
+
+    @staticmethod
+    def truncate(digest:bytes)->int:
+        """RFC 4226 dynamic truncation of an HMAC digest to the numeric code."""
+        offset = digest[-1] & 0x0F
+        return (int.from_bytes(digest[offset:offset + 4], "big") & 0x7FFFFFFF) % TOTPVerifier._MODULO
+
+    @staticmethod
+    def _truncate_many(digests:list[bytes]):
+        """Dynamic truncation of equally sized digests at once, returns a numpy array of codes."""
+        rows = np.frombuffer(b"".join(digests), dtype=np.uint8).reshape(len(digests), -1)
+        offsets = (rows[:, -1] & 0x0F)[:, None] + np.arange(4)
+        chunk = np.take_along_axis(rows, offsets, axis=1).astype(np.uint32)
+        values = ((chunk[:, 0] & 0x7F) << 24) | (chunk[:, 1] << 16) | (chunk[:, 2] << 8) | chunk[:, 3]
+        return values % TOTPVerifier._MODULO
+
+    @staticmethod
+    def hotp(key:bytes, counter:int)->str:
+        """
+        Compute the HOTP code of a counter.
+        Args:
+            key (bytes): The decoded key.
+            counter (int): The moving factor, the time step for TOTP.
+        Returns:
+            str: The zero padded code.
+        """
+        digest = hmac.digest(key, TOTPVerifier._COUNTER.pack(counter), TOTPVerifier.DIGEST)
+        return (TOTPVerifier._CODE_FORMAT % TOTPVerifier.truncate(digest)).decode()
+
+    @staticmethod
+    def verify(key:bytes, code:str, for_time:float | None=None, window:int | None=None)->bool:
+        """
+        Verify a TOTP code.
+        Args:
+            key (bytes): The decoded key, see decode_key.
+            code (str): The code sent by the user.
+            for_time (float | None): Unix time to verify at, defaults to now.
+            window (int | None): Time steps accepted before and after the current one, defaults to TOTP_DRIFT_WINDOW.
+        Returns:
+            bool: True if the code matches a time step of the window.
+        """
+        submitted = code.encode()
+        # Locals keep the lookups out of the loop
+        digest, truncate, algorithm = hmac.digest, TOTPVerifier.truncate, TOTPVerifier.DIGEST
+        code_format = TOTPVerifier._CODE_FORMAT
+        matched = False
+        for counter in TOTPVerifier._counters(for_time, window):
+            expected = code_format % truncate(digest(key, counter, algorithm))
+            matched |= hmac.compare_digest(expected, submitted)
+        return matched
+
+    @staticmethod
+    def verify_batch(pairs:Sequence[tuple[bytes,str]], for_time:float | None=None, window:int | None=None)->list[bool]:
+        """
+        Verify many (key, code) pairs at the same time, the truncation is vectorized when numpy is installed.
+        Args:
+            pairs (Sequence[tuple[bytes,str]]): Decoded keys and the codes to verify against them.
+            for_time (float | None): Unix time to verify at, defaults to now.
+            window (int | None): Time steps accepted before and after the current one, defaults to TOTP_DRIFT_WINDOW.
+        Returns:
+            list[bool]: Whether each code matched, in the order of pairs.
+        """
+        counters = TOTPVerifier._counters(for_time, window)
+        span = len(counters)
+        digest, algorithm = hmac.digest, TOTPVerifier.DIGEST
+        digests = [digest(key, counter, algorithm) for key, _ in pairs for counter in counters]
+        if np is not None and len(digests) >= TOTPVerifier.VECTORIZE_MIN_CODES:
+            # Codes that are not exactly DIGITS digits can not match, -1 is never a truncated value
+            submitted = np.array([int(code) if len(code) == TOTPVerifier.DIGITS and code.isascii() and code.isdigit() else -1
+                                  for _, code in pairs], dtype=np.int64)
+            expected = TOTPVerifier._truncate_many(digests).reshape(len(pairs), span)
+            return (expected == submitted[:, None]).any(axis=1).tolist()
+        truncate, code_format = TOTPVerifier.truncate, TOTPVerifier._CODE_FORMAT
+        results = []
+        for index, (_, code) in enumerate(pairs):
+            submitted = code.encode()
+            matched = False
+            for candidate in digests[index * span:(index + 1) * span]:
+                matched |= hmac.compare_digest(code_format % truncate(candidate), submitted)
+            results.append(matched)
+        return results
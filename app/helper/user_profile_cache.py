@@ -0,0 +1,238 @@
+import json
+import logging
+import weakref
+from datetime import datetime
+import redis.asyncio as aioredis
+from app.config.settings import settings
+from app.helper.cache import TTLCache
+from app.helper.metrics import USER_PROFILE_CACHE_REQUESTS, USER_PROFILE_CACHE_INVALIDATIONS
+from app.model.user_profile import UserProfile
+import app.dependacy.redis_database as redis_database
+from app.repository.state_backend import _to_str
+
+# Never copied into snapshots, secrets are read from the primary only when they are needed
+SECRET_COLUMNS = frozenset({"totp_secret_encrypted"})
+# Columns of a snapshot, in the order of the serialized array
+PROFILE_COLUMNS = tuple(column.key for column in UserProfile.__table__.columns if column.key not in SECRET_COLUMNS)
+_DATETIME_COLUMNS = frozenset(column.key for column in UserProfile.__table__.columns if column.type.python_type is datetime)
+
+_set_slot = object.__setattr__
+
+# Stores the snapshot ARGV[1] under KEYS[1] for ARGV[3] seconds unless the generation KEYS[2] moved past ARGV[2],
+# that is unless the profile was invalidated since the snapshot started loading. Returns 1 when stored.
+SET_IF_CURRENT_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[2] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+class UserProfileSnapshot:
+    """Immutable copy of a user_profile row without its secret columns, detached from any session."""
+
+    __slots__ = PROFILE_COLUMNS
+
+    def __init__(self, *values):
+        for column, value in zip(PROFILE_COLUMNS, values):
+            _set_slot(self, column, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserProfileSnapshot is read-only")
+
+    @staticmethod
+    def from_profile(profile:UserProfile)->"UserProfileSnapshot":
+        return UserProfileSnapshot(*(getattr(profile, column) for column in PROFILE_COLUMNS))
+
+    def to_profile(self)->UserProfile:
+        """A transient UserProfile holding the snapshot values."""
+        return UserProfile(**{column: getattr(self, column) for column in PROFILE_COLUMNS})
+
+    def dumps(self)->str:
+        """Serialize as a JSON array of the column values, without the column names."""
+        return json.dumps([value.isoformat() if isinstance(value, datetime) else value
+                           for value in (getattr(self, column) for column in PROFILE_COLUMNS)], separators=(",", ":"))
+
+    @staticmethod
+    def loads(data:str)->"UserProfileSnapshot":
+        values = json.loads(data)
+        if len(values) != len(PROFILE_COLUMNS):
+            raise ValueError("Snapshot does not match the user_profile columns")
+        return UserProfileSnapshot(*(datetime.fromisoformat(value) if column in _DATETIME_COLUMNS and value else value
+                                     for column, value in zip(PROFILE_COLUMNS, values)))
+
+
+class UserProfileCache:
+    """
+    Read-through cache of user profiles in front of Postgres.
+
+    The in-process LRU tier answers most lookups, the Redis tier is shared between workers. Both hold
+    snapshots for USER_PROFILE_CACHE_TTL seconds at most. Writes through UserRepository invalidate both
+    tiers and publish the username on a channel so the other workers drop their local copy. Only existing
+    profiles are cached, a missing profile is looked up again on the next request.
+
+    A load that started before an invalidation must not cache the row it read, it may predate the write.
+    Invalidations bump a local sequence number and a per-user generation in Redis. load_token captures both
+    before the SELECT and set only stores the snapshot while they are unchanged.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    CHANNEL = "user-profile-cache:invalidate"
+
+    _local = TTLCache(max_size=settings.user_profile_cache_max_size, ttl=settings.user_profile_cache_ttl)
+    # Sequence number of the latest local invalidation, the one of each recently invalidated username and the
+    # sequence of the last clear, loads started before it are not cached
+    _sequence = 0
+    _invalidated = TTLCache(max_size=settings.user_profile_cache_max_size, ttl=settings.user_profile_cache_ttl)
+    _cleared_at = 0
+    # One registered script per Redis client
+    _scripts: "weakref.WeakKeyDictionary[aioredis.Redis, object]" = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def enabled()->bool:
+        return settings.user_profile_cache_enabled
+
+    @staticmethod
+    def _redis()->aioredis.Redis | None:
+        if not settings.user_profile_cache_redis:
+            return None
+        return redis_database.redis_pool
+
+    @staticmethod
+    def profile_key(username:str)->str:
+        # Versioned so a schema change does not read snapshots of the previous columns
+        return f"{{{username}}}:profile:v2"
+
+    @staticmethod
+    def generation_key(username:str)->str:
+        # Same hash tag as the profile key so the script and the invalidation touch a single cluster slot
+        return f"{{{username}}}:profile:generation"
+
+    @staticmethod
+    def _set_if_current(redis:aioredis.Redis):
+        script = UserProfileCache._scripts.get(redis)
+        if script is None:
+            script = UserProfileCache._scripts[redis] = redis.register_script(SET_IF_CURRENT_SCRIPT)
+        return script
+
+    @staticmethod
+    def _bump(username:str):
+        UserProfileCache._sequence += 1
+        UserProfileCache._invalidated.set(username, UserProfileCache._sequence)
+
+    @staticmethod
+    async def get(username:str)->UserProfileSnapshot | None:
+        """
+        Return the cached profile of a user.
+
+        Args:
+            username (str): Username of the profile.
+
+        Returns:
+            UserProfileSnapshot | None: The profile, None when it is not cached.
+        """
+        snapshot = UserProfileCache._local.get(username)
+        if snapshot is not None:
+            USER_PROFILE_CACHE_REQUESTS.labels(tier="local", result="hit").inc()
+            return snapshot
+        USER_PROFILE_CACHE_REQUESTS.labels(tier="local", result="miss").inc()
+        redis = UserProfileCache._redis()
+        if redis is None:
+            return None
+        try:
+            # Read from the primary, a lagging replica could still serve an invalidated snapshot
+            data = await redis.get(UserProfileCache.profile_key(username))
+            snapshot = UserProfileSnapshot.loads(data) if data else None
+        except Exception:
+            UserProfileCache.logger.exception("Could not read the shared user profile cache")
+            return None
+        USER_PROFILE_CACHE_REQUESTS.labels(tier="redis", result="hit" if snapshot else "miss").inc()
+        if snapshot is None:
+            return None
+        UserProfileCache._local.set(username, snapshot)
+        return snapshot
+
+    @staticmethod
+    async def load_token(username:str)->tuple[int,str | None]:
+        """
+        Capture the invalidation state of a profile, call it before reading the profile from Postgres.
+
+        Args:
+            username (str): Username of the profile.
+
+        Returns:
+            tuple[int,str | None]: The local sequence number and the Redis generation (None without the Redis tier).
+        """
+        sequence = UserProfileCache._sequence
+        redis = UserProfileCache._redis()
+        if redis is None:
+            return sequence, None
+        try:
+            return sequence, _to_str(await redis.get(UserProfileCache.generation_key(username))) or "0"
+        except Exception:
+            UserProfileCache.logger.exception("Could not read the shared user profile cache")
+            return sequence, None
+
+    @staticmethod
+    async def set(snapshot:UserProfileSnapshot, token:tuple[int,str | None]):
+        """
+        Cache a profile just read from Postgres, unless it was invalidated since token was captured.
+
+        Args:
+            snapshot (UserProfileSnapshot): The profile.
+            token (tuple[int,str | None]): load_token of the username, captured before the read.
+        """
+        sequence, generation = token
+        invalidated = UserProfileCache._invalidated.peek(snapshot.username)
+        if sequence < UserProfileCache._cleared_at or (invalidated is not None and invalidated > sequence):
+            return
+        UserProfileCache._local.set(snapshot.username, snapshot)
+        redis = UserProfileCache._redis()
+        if redis is None or generation is None:
+            return
+        try:
+            await UserProfileCache._set_if_current(redis)(
+                keys=[UserProfileCache.profile_key(snapshot.username), UserProfileCache.generation_key(snapshot.username)],
+                args=[snapshot.dumps(), generation, settings.user_profile_cache_ttl])
+        except Exception:
+            UserProfileCache.logger.exception("Could not write the shared user profile cache")
+
+    @staticmethod
+    async def invalidate(username:str):
+        """Forget the profile of a user in every tier and in the other workers."""
+        UserProfileCache._bump(username)
+        UserProfileCache._local.pop(username)
+        USER_PROFILE_CACHE_INVALIDATIONS.labels(source="local").inc()
+        redis = UserProfileCache._redis()
+        if redis is None:
+            return
+        try:
+            # Both keys share a slot, the generation outlives any snapshot stored under the previous one
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.delete(UserProfileCache.profile_key(username))
+                pipe.incr(UserProfileCache.generation_key(username))
+                pipe.expire(UserProfileCache.generation_key(username), settings.user_profile_cache_ttl)
+                await pipe.execute()
+            if isinstance(redis, aioredis.RedisCluster):
+                # Keyless command, any node broadcasts it to the whole cluster
+                await redis.execute_command("PUBLISH", UserProfileCache.CHANNEL, username, target_nodes=aioredis.RedisCluster.RANDOM)
+            else:
+                await redis.publish(UserProfileCache.CHANNEL, username)
+        except Exception:
+            UserProfileCache.logger.exception("Could not invalidate the shared user profile cache")
+
+    @staticmethod
+    def evict(username:str):
+        """Drop the local copy of a profile changed by another worker."""
+        UserProfileCache._bump(username)
+        UserProfileCache._local.pop(username)
+        USER_PROFILE_CACHE_INVALIDATIONS.labels(source="remote").inc()
+
+    @staticmethod
+    def clear():
+        """Drop the in-process tier, loads in flight are not cached."""
+        UserProfileCache._sequence += 1
+        UserProfileCache._cleared_at = UserProfileCache._sequence
+        UserProfileCache._invalidated.clear()
+        UserProfileCache._local.clear()
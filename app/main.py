@@ -3,6 +3,12 @@ from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 from app.dependacy.pg_database import create_pg_db_pool,close_pg_db_pool
 from app.dependacy.redis_database import close_redis_db_pool,create_redis_db_pool
+from app.dependacy.http_client import create_http_clients,close_http_clients
+from app.dependacy.render_pool import create_render_pool,close_render_pool
+from app.dependacy.profile_cache_listener import create_profile_cache_listener,close_profile_cache_listener
+from app.repository.otp_repo import OTPRepository
+from app.config.settings import settings
+import app.dependacy.redis_database as redis_database
 from app.helper.metrics import MetricsMiddleware, metrics_app
 from app.route.user import user_router
 from fastapi.staticfiles import StaticFiles
@@ -13,24 +19,35 @@ logger=logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
-    """Manages the databasees connection pool's lifecycle."""
+    """Manages the databasees connection pool's and outbound HTTP clients lifecycle."""
     # Connect to PostgreSQL and Redis
     try:
         await create_pg_db_pool()
         await create_redis_db_pool()
+        if settings.redis_migrate_legacy_otp_keys:
+            await OTPRepository.migrate_legacy_otp_keys(redis_database.redis_pool)
+        await create_profile_cache_listener()
+        await create_http_clients()
+        await create_render_pool()
         logger.info("All database connections successfully created.")
         yield  # The application serves requests here
     except Exception as e:
         print(f"Failed to connect to one or more databases: {e}")
         # Optionally, you can handle shutdown here if startup fails
+        await close_profile_cache_listener()
         await close_pg_db_pool()
         await close_redis_db_pool()
+        await close_http_clients()
+        await close_render_pool()
         raise  # Re-raise the exception to stop the app from starting
     finally:
         # Disconnect from PostgreSQL and Redis on shutdown
         logger.info("Application shutdown initiated...")
+        await close_profile_cache_listener()
         await close_pg_db_pool()
         await close_redis_db_pool()
+        await close_http_clients()
+        await close_render_pool()
         logger.info("All database connections successfully closed.")
 
 app = FastAPI(
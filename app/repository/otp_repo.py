@@ -1,128 +1,176 @@
 from app.config.settings import settings
+from app.repository.state_backend import StateBackend,as_state_backend,_to_str
 import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+from app.exception.exceptions import TooManyOTPAttemptsError
+import logging
+import re
+
+
+# Exact shape of the keys used before the per-user hashes: <username>:<otp_type>:<email or mobile number>.
+# SCAN MATCH narrows the walk, every key is then checked against the full pattern. Usernames never hold a
+# colon and hash tagged ({username}:...) keys belong to the current layout.
+LEGACY_OTP_KEY_MATCH={"email":"*:email:*@*","mobile":"*:mobile:+*"}
+LEGACY_OTP_KEY={"email":re.compile(r"([^{}:]+):email:([^:\s@]+@[^:\s@]+)"),
+                "mobile":re.compile(r"([^{}:]+):mobile:(\+\d+)")}
+
 
 class OTPRepository():
+    OTP_TYPES=("mobile","email")
+    logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def otp_key(username:str, otp_type:str)->str:
+        """
+        Build the key of the hash holding the pending OTPs of a user for one OTP type.
+        Args:
+            username (str): username of the user owning the otps
+            otp_type (str): type of otp ("email" or "mobile")
+        Returns:
+            str: key pattern {username}:otp:<otp_type>, its fields map identifier -> otp
+        """
+        if otp_type not in OTPRepository.OTP_TYPES:
+            raise ValueError("Invalid OTP type")
+        # The {username} hash tag keeps all keys of a user in one cluster slot so scripts can use them together
+        return f"{{{username}}}:otp:{otp_type}"
+
+    @staticmethod
+    def attempts_key(username:str, otp_type:str)->str:
+        """Key of the counter of verification attempts against the pending OTPs of a user."""
+        if otp_type not in OTPRepository.OTP_TYPES:
+            raise ValueError("Invalid OTP type")
+        return f"{{{username}}}:otp-attempts:{otp_type}"
+
+    @staticmethod
+    async def store_otp(db:StateBackend|aioredis.Redis, username:str, identifier:str, otp:str, otp_type:str):
+        """
+        Store an OTP for a user in the per-user hash of the OTP type.
+        Args:
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
+            username (str): username of the user want to store otp
+            identifier (str): email or mobile number the otp was sent to
+            otp (str): otp code to store
+            otp_type (str): type of otp to store ("email" or "mobile")
+        """
+        # A new otp starts with a fresh attempts budget
+        await as_state_backend(db).hash_store(OTPRepository.otp_key(username, otp_type), identifier, otp, settings.redis_ttl,
+                                              reset_key=OTPRepository.attempts_key(username, otp_type))
+
+    @staticmethod
+    async def reserve_otp(db:StateBackend|aioredis.Redis, username:str, identifier:str, otp:str, otp_type:str)->tuple[bool,int]:
+        """
+        Store an OTP for a user only if no other OTP of the same type is pending, in one atomic call.
+        Args:
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
+            username (str): username of the user want to store otp
+            identifier (str): email or mobile number the otp will be sent to
+            otp (str): otp code to store
+            otp_type (str): type of otp to store ("email" or "mobile")
+        Returns:
+            tuple[bool,int]: True and the otp lifetime when reserved, False and the remaining
+            lifetime of the pending otp otherwise.
+        """
+        return await as_state_backend(db).hash_reserve(OTPRepository.otp_key(username, otp_type), identifier, otp, settings.redis_ttl,
+                                                       reset_key=OTPRepository.attempts_key(username, otp_type))
+
     @staticmethod
-    async def store_email_otp(db:aioredis.Redis, username:str, email:str, otp:str):
+    async def store_email_otp(db:StateBackend|aioredis.Redis, username:str, email:str, otp:str):
         """
         Store the email OTP for a user.
 
         Args:
-            db (aioredis.Redis): redis client instance
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
             username (str): username of the user want to store otp
             email (str): email of the user want to store otp
             otp (str): otp code to store
         """
-        # Store OTP with a key pattern: username:email:<email>
-        key = f"{username}:email:{email}"
-        await db.set(key, otp, ex=settings.redis_ttl)
+        await OTPRepository.store_otp(db, username, email, otp, "email")
     
     @staticmethod
-    async def store_sms_otp(db:aioredis.Redis, username:str, mobile:str, otp:str):
+    async def store_sms_otp(db:StateBackend|aioredis.Redis, username:str, mobile:str, otp:str):
         """
         Store the mobile OTP for a user.
         Args:
-            db (aioredis.Redis): redis client instance
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
             username (str): username of the user want to store otp
             mobile (str): mobile number of the user want to store otp
             otp (str): otp code to store
         """
-        # Store OTP with a key pattern: username:mobile:<mobile>
-        key = f"{username}:mobile:{mobile}"
-        await db.set(key, otp, ex=settings.redis_ttl)
+        await OTPRepository.store_otp(db, username, mobile, otp, "mobile")
 
     @staticmethod
-    async def find_user_key_value_by_otp(db: aioredis.Redis, username: str, otp: str,otp_type:str) -> str | None:
+    async def verify_and_consume_otp(db: StateBackend|aioredis.Redis, username: str, otp: str, otp_type:str) -> str | None:
         """
-        Find the identifier (email or mobile) associated with the given OTP for a user.
+        Atomically find, compare, delete the matching OTP and count the attempt in one round trip.
         Args:
-            db (aioredis.Redis): redis client instance
-            username (str): username of the user want to find otp
-            otp (str): otp code to search
-            otp_type (str): type of otp to search ("email" or "mobile")
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
+            username (str): username of the user want to verify otp
+            otp (str): otp code received from the user
+            otp_type (str): type of otp to verify ("email" or "mobile")
         Returns:
-            str | None: The identifier (email or mobile) if found, else None.
+            str | None: The identifier (email or mobile) the OTP was sent to if it matched, else None.
+        Raises:
+            TooManyOTPAttemptsError: When the user exceeded the allowed verification attempts.
         """
-        identifier_value = None
-        try:
-            # Validate OTP type
-            if otp_type not in ["mobile", "email"]:
-                raise ValueError("Invalid OTP type")
-
-            # Construct the key pattern to search
-            pattern = f"{username}:{otp_type}:*"
-
-            # Scan through keys matching the pattern
-            keys = await db.keys(pattern)
+        status, identifier = await as_state_backend(db).hash_consume(
+            OTPRepository.otp_key(username, otp_type), otp, OTPRepository.attempts_key(username, otp_type),
+            settings.otp_max_attempts, settings.redis_ttl)
+        if status == "locked":
+            raise TooManyOTPAttemptsError()
+        return identifier
 
-            # Iterate through the keys to find the matching OTP
-            for key in keys:
-                # keys() may return bytes depending on client; normalize to str
-                raw_key = key.decode() if isinstance(key, (bytes, bytearray)) else str(key)
-                value = await db.get(key)
-                # value may be bytes as well
-                raw_value = value.decode() if isinstance(value, (bytes, bytearray)) else value
-                if raw_value == otp:
-                    # Extract the identifier from the key: username:otp_type:<identifier>
-                    identifier_value = raw_key.split(":", 2)[-1]
-                    return identifier_value
-
-            return None
-        except Exception:
-            return None
-        
     @staticmethod
-    async def confirm_and_delete_otp(db: aioredis.Redis, username:str, identifier:str, otp:str, otp_type:str)->bool:
+    async def user_has_existing_otp_by_otp_type(db: StateBackend|aioredis.Redis, username:str,  otp_type:str, allow_stale:bool=False)->bool:
         """
-        Confirm the OTP for a user and delete it if it matches.
+        Check for users existing OTP by otp type.
         Args:
-            db (aioredis.Redis): redis client instance
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
             username (str): username of the user want to confirm otp
-            identifier (str): email or mobile number associated with the OTP
-            otp (str): otp code to confirm
             otp_type (str): type of otp to confirm ("email" or "mobile")
+            allow_stale (bool): read from a replica, an otp stored moments ago may be missing
         Returns:
-            bool: True if OTP is confirmed and deleted, False otherwise.
+            bool: True if there are otps for the user.
         """
         try:
-            # Validate OTP type
-            if otp_type not in ["mobile","email"]:
-                raise ValueError("Invalid OTP type")
-            # Construct the key pattern to search
-            pattern = f"{username}:{otp_type}:{identifier}"
-            # Retrieve the stored OTP
-            stored_otp = await db.get(pattern)
-            if not stored_otp:
-                return False  # No OTP found
-            # Compare and delete if it matches
-            if stored_otp == otp:
-                await db.delete(pattern)
-                return True  # OTP confirmed and deleted
-            return False  # OTP mismatch
+            # The hash disappears with its last field or when it expires
+            return await as_state_backend(db).exists(OTPRepository.otp_key(username, otp_type), allow_stale)
         except Exception as exc:
             return False
+
     @staticmethod
-    async def user_has_existing_otp_by_otp_type(db: aioredis.Redis, username:str,  otp_type:str)->bool:
+    async def migrate_legacy_otp_keys(db: aioredis.Redis, batch_size:int=500)->int:
         """
-        Check for users existing OTP by otp type.
+        Move OTPs stored under the old username:<otp_type>:<identifier> keys into the per-user hashes.
+        Uses SCAN so Redis keeps serving other clients while the keyspace is walked, the remaining
+        TTL of every legacy key is carried over to its hash.
         Args:
             db (aioredis.Redis): redis client instance
-            username (str): username of the user want to confirm otp
-            otp_type (str): type of otp to confirm ("email" or "mobile")
+            batch_size (int): SCAN count hint
         Returns:
-            bool: True if there are otps for the user.
+            int: number of migrated otps
         """
-        try:
-            # Validate OTP type
-            if otp_type not in ["mobile","email"]:
-                raise ValueError("Invalid OTP type")
-            # Construct the key pattern to search
-            pattern = f"{username}:{otp_type}:*"
-            # Retrieve the stored OTP
-            stored_otp = await db.get(pattern)
-            if not stored_otp:
-                return False  # No OTP found
-            else:
-                return True 
-        except Exception as exc:
-            return False
\ No newline at end of file
+        migrated = 0
+        for otp_type in OTPRepository.OTP_TYPES:
+            async for key in db.scan_iter(match=LEGACY_OTP_KEY_MATCH[otp_type], count=batch_size):
+                legacy_key = LEGACY_OTP_KEY[otp_type].fullmatch(_to_str(key))
+                if legacy_key is None:
+                    continue  # Another key that happens to match the glob
+                username, identifier = legacy_key.groups()
+                try:
+                    otp = await db.get(key)
+                    ttl = await db.ttl(key)
+                except ResponseError:
+                    continue  # Not a plain otp string
+                # Skip keys that expired meanwhile
+                if not otp or ttl == -2:
+                    continue
+                hash_key = OTPRepository.otp_key(username, otp_type)
+                # The legacy key lives in another cluster slot, so this cannot be a transaction
+                async with db.pipeline(transaction=False) as pipe:
+                    pipe.hset(hash_key, identifier, _to_str(otp))
+                    pipe.expire(hash_key, ttl if ttl > 0 else settings.redis_ttl)
+                    pipe.delete(key)
+                    await pipe.execute()
+                migrated += 1
+        OTPRepository.logger.info(f"⛁ Migrated {migrated} legacy OTP keys")
+        return migrated
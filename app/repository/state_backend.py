@@ -0,0 +1,424 @@
+from abc import ABC, abstractmethod
+import bisect
+import heapq
+import hmac
+import secrets
+import time
+import weakref
+import redis.asyncio as aioredis
+from app.dependacy.redis_database import redis_reader
+
+# Reserves the hash KEYS[1] unless it already exists. On success ARGV[2] is stored for the field ARGV[1],
+# the hash expires after ARGV[3] seconds and the optional key KEYS[2] is reset.
+# Returns {1, ttl} when reserved, {0, remaining ttl} of the existing hash otherwise.
+HASH_RESERVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return {0, redis.call('TTL', KEYS[1])}
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if KEYS[2] then
+    redis.call('DEL', KEYS[2])
+end
+return {1, tonumber(ARGV[3])}
+"""
+
+# Finds the field of the hash KEYS[1] holding ARGV[1], deletes it and returns the field name.
+# Every call bumps the attempts counter KEYS[2], once it exceeds ARGV[2] the hash is discarded.
+# All values are compared over their full length so the time taken does not depend on where they differ.
+HASH_CONSUME_SCRIPT = """
+local attempts = redis.call('INCR', KEYS[2])
+if attempts == 1 then
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+local max_attempts = tonumber(ARGV[2])
+if max_attempts > 0 and attempts > max_attempts then
+    redis.call('DEL', KEYS[1])
+    return {'locked', false}
+end
+local value = ARGV[1]
+local entries = redis.call('HGETALL', KEYS[1])
+local matched = false
+for i = 1, #entries, 2 do
+    local stored = entries[i + 1]
+    local diff = #stored == #value and 0 or 1
+    for j = 1, #stored do
+        if string.byte(stored, j) ~= (string.byte(value, j) or -1) then
+            diff = 1
+        end
+    end
+    if diff == 0 then
+        matched = entries[i]
+    end
+end
+if not matched then
+    return {'mismatch', false}
+end
+redis.call('HDEL', KEYS[1], matched)
+redis.call('DEL', KEYS[2])
+return {'ok', matched}
+"""
+
+# Sets the field ARGV[1] of the hash KEYS[1] to ARGV[2] only while the string KEYS[2] holds ARGV[3], the hash
+# then expires together with KEYS[2]. Returns 1 when stored.
+HASH_STORE_IF_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= ARGV[3] then
+    return 0
+end
+local ttl = redis.call('PTTL', KEYS[2])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
+# Sliding window log over the sorted set KEYS[1]: entries older than the window ARGV[2] (ms) are dropped,
+# the request ARGV[4] is recorded at ARGV[1] (ms) if fewer than ARGV[3] requests remain in the window.
+# Returns {1, 0} when allowed, {0, ms until the oldest request leaves the window} otherwise.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    return {1, 0}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, tonumber(oldest[2]) + window - now}
+"""
+
+
+def _to_str(value)->str | None:
+    # Values may be bytes depending on the client decode_responses option
+    if value is None:
+        return None
+    return value.decode() if isinstance(value, (bytes, bytearray)) else str(value)
+
+
+class StateBackend(ABC):
+    """
+    Storage for short lived OTP, TOTP and rate limit state.
+
+    Keys hold either a string or a hash (field -> value) and expire after their TTL. Every method is
+    atomic, reserve and consume operations are check-and-set in a single step.
+    """
+
+    @abstractmethod
+    async def set(self, key:str, value:str, ttl:int, reset_key:str | None=None):
+        """Store value under key for ttl seconds and delete reset_key in the same step."""
+
+    @abstractmethod
+    async def reserve(self, key:str, value:str, ttl:int)->str | None:
+        """Store value unless key exists, return None when stored or the existing value."""
+
+    @abstractmethod
+    async def get(self, key:str, allow_stale:bool=False)->str | None:
+        """Return the string under key, allow_stale lets replicated backends read from a replica."""
+
+    @abstractmethod
+    async def delete(self, *keys:str):
+        """Delete the keys."""
+
+    @abstractmethod
+    async def exists(self, key:str, allow_stale:bool=False)->bool:
+        """Return whether key exists."""
+
+    @abstractmethod
+    async def ttl(self, key:str)->int:
+        """Remaining lifetime of key in seconds, -1 without expiry and -2 when missing."""
+
+    @abstractmethod
+    async def hash_store(self, key:str, field:str, value:str, ttl:int, reset_key:str | None=None):
+        """Set field of the hash key, (re)arm its ttl and delete reset_key."""
+
+    @abstractmethod
+    async def hash_reserve(self, key:str, field:str, value:str, ttl:int, reset_key:str | None=None)->tuple[bool,int]:
+        """Like hash_store unless the hash exists, return whether it was stored and the hash ttl."""
+
+    @abstractmethod
+    async def hash_store_if(self, key:str, field:str, value:str, guard_key:str, guard_value:str)->bool:
+        """Set field of the hash key only while guard_key holds guard_value, the hash expires with guard_key."""
+
+    @abstractmethod
+    async def hash_get_all(self, key:str, allow_stale:bool=False)->dict[str,str]:
+        """Return every field of the hash key."""
+
+    @abstractmethod
+    async def hash_get(self, key:str, field:str)->str | None:
+        """Return field of the hash key."""
+
+    @abstractmethod
+    async def hash_delete(self, key:str, field:str):
+        """Delete field of the hash key."""
+
+    @abstractmethod
+    async def hash_consume(self, key:str, value:str, attempts_key:str, max_attempts:int, ttl:int)->tuple[str,str | None]:
+        """
+        Delete the field of the hash key holding value and count the attempt in attempts_key.
+
+        Returns:
+            tuple[str,str | None]: ("ok", field) on a match, ("mismatch", None) otherwise and
+            ("locked", None) once more than max_attempts (0 disables the limit) were made, the hash
+            is discarded then.
+        """
+
+    @abstractmethod
+    async def sliding_window_hit(self, key:str, limit:int, window:int)->int:
+        """
+        Record a request in the sliding window log key unless limit requests were made within window ms.
+
+        Returns:
+            int: 0 when the request was recorded, otherwise the ms until the oldest request leaves the window.
+        """
+
+
+class RedisStateBackend(StateBackend):
+    """State backend on a Redis (or Redis Cluster) client, multi-key operations run as Lua scripts."""
+
+    def __init__(self, redis:aioredis.Redis):
+        self.redis = redis
+        self._hash_reserve = redis.register_script(HASH_RESERVE_SCRIPT)
+        self._hash_consume = redis.register_script(HASH_CONSUME_SCRIPT)
+        self._hash_store_if = redis.register_script(HASH_STORE_IF_SCRIPT)
+        self._sliding_window = redis.register_script(SLIDING_WINDOW_SCRIPT)
+
+    async def set(self, key:str, value:str, ttl:int, reset_key:str | None=None):
+        if not reset_key:
+            await self.redis.set(key, value, ex=ttl)
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(key, value, ex=ttl)
+            pipe.delete(reset_key)
+            await pipe.execute()
+
+    async def reserve(self, key:str, value:str, ttl:int)->str | None:
+        # SET NX GET (Redis >= 7.0) returns the current value and leaves it untouched when the key exists
+        return _to_str(await self.redis.set(key, value, ex=ttl, nx=True, get=True))
+
+    async def get(self, key:str, allow_stale:bool=False)->str | None:
+        return _to_str(await redis_reader(self.redis, allow_stale).get(key))
+
+    async def delete(self, *keys:str):
+        await self.redis.delete(*keys)
+
+    async def exists(self, key:str, allow_stale:bool=False)->bool:
+        return bool(await redis_reader(self.redis, allow_stale).exists(key))
+
+    async def ttl(self, key:str)->int:
+        return int(await self.redis.ttl(key))
+
+    async def hash_store(self, key:str, field:str, value:str, ttl:int, reset_key:str | None=None):
+        # Write the field and (re)arm the expiry in one round trip
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, field, value)
+            pipe.expire(key, ttl)
+            if reset_key:
+                pipe.delete(reset_key)
+            await pipe.execute()
+
+    async def hash_reserve(self, key:str, field:str, value:str, ttl:int, reset_key:str | None=None)->tuple[bool,int]:
+        reserved, remaining = await self._hash_reserve(keys=[key, reset_key] if reset_key else [key], args=[field, value, ttl])
+        return bool(reserved), int(remaining)
+
+    async def hash_store_if(self, key:str, field:str, value:str, guard_key:str, guard_value:str)->bool:
+        return bool(await self._hash_store_if(keys=[key, guard_key], args=[field, value, guard_value]))
+
+    async def hash_get_all(self, key:str, allow_stale:bool=False)->dict[str,str]:
+        entries = await redis_reader(self.redis, allow_stale).hgetall(key)
+        return {_to_str(field): _to_str(value) for field, value in entries.items()}
+
+    async def hash_get(self, key:str, field:str)->str | None:
+        return _to_str(await self.redis.hget(key, field))
+
+    async def hash_delete(self, key:str, field:str):
+        await self.redis.hdel(key, field)
+
+    async def hash_consume(self, key:str, value:str, attempts_key:str, max_attempts:int, ttl:int)->tuple[str,str | None]:
+        status, field = await self._hash_consume(keys=[key, attempts_key], args=[value, max_attempts, ttl])
+        # Lua false comes back as None
+        return _to_str(status), _to_str(field) if field else None
+
+    async def sliding_window_hit(self, key:str, limit:int, window:int)->int:
+        # The random member keeps requests of the same millisecond apart
+        allowed, retry_in = await self._sliding_window(keys=[key], args=[int(time.time() * 1000), window, limit, secrets.token_hex(8)])
+        return 0 if allowed else int(retry_in)
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value, expires_at:float):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class InMemoryStateBackend(StateBackend):
+    """
+    Process local state backend for single node deployments, tests and benchmarks.
+
+    Expiry is indexed by a heap of (expires_at, key), expired entries are dropped at the start of every
+    operation and checked again on access. No method awaits, so each one runs without interleaving
+    on the event loop and is atomic without a lock. State is not shared between worker processes.
+    """
+
+    def __init__(self):
+        self._entries: dict[str,_Entry] = {}
+        self._expiries: list[tuple[float,str]] = []
+
+    def _purge(self, now:float):
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= now:
+            expires_at, key = heapq.heappop(expiries)
+            entry = self._entries.get(key)
+            # Skip heap items left behind when the ttl of the key was re-armed
+            if entry is not None and entry.expires_at == expires_at:
+                del self._entries[key]
+
+    def _live(self, key:str)->_Entry | None:
+        now = time.monotonic()
+        self._purge(now)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _put(self, key:str, value, ttl:int)->_Entry:
+        expires_at = time.monotonic() + ttl
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry(value, expires_at)
+        else:
+            entry.value, entry.expires_at = value, expires_at
+        heapq.heappush(self._expiries, (expires_at, key))
+        return entry
+
+    async def set(self, key:str, value:str, ttl:int, reset_key:str | None=None):
+        self._live(key)
+        self._put(key, value, ttl)
+        if reset_key:
+            self._entries.pop(reset_key, None)
+
+    async def reserve(self, key:str, value:str, ttl:int)->str | None:
+        entry = self._live(key)
+        if entry is not None:
+            return entry.value
+        self._put(key, value, ttl)
+        return None
+
+    async def get(self, key:str, allow_stale:bool=False)->str | None:
+        entry = self._live(key)
+        return entry.value if entry is not None and isinstance(entry.value, str) else None
+
+    async def delete(self, *keys:str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def exists(self, key:str, allow_stale:bool=False)->bool:
+        return self._live(key) is not None
+
+    async def ttl(self, key:str)->int:
+        entry = self._live(key)
+        if entry is None:
+            return -2
+        return max(0, round(entry.expires_at - time.monotonic()))
+
+    async def hash_store(self, key:str, field:str, value:str, ttl:int, reset_key:str | None=None):
+        entry = self._live(key)
+        fields = dict(entry.value) if entry is not None else {}
+        fields[field] = value
+        self._put(key, fields, ttl)
+        if reset_key:
+            self._entries.pop(reset_key, None)
+
+    async def hash_reserve(self, key:str, field:str, value:str, ttl:int, reset_key:str | None=None)->tuple[bool,int]:
+        entry = self._live(key)
+        if entry is not None:
+            return False, max(0, round(entry.expires_at - time.monotonic()))
+        self._put(key, {field: value}, ttl)
+        if reset_key:
+            self._entries.pop(reset_key, None)
+        return True, ttl
+
+    async def hash_store_if(self, key:str, field:str, value:str, guard_key:str, guard_value:str)->bool:
+        guard = self._live(guard_key)
+        if guard is None or guard.value != guard_value:
+            return False
+        entry = self._live(key)
+        fields = dict(entry.value) if entry is not None else {}
+        fields[field] = value
+        self._put(key, fields, guard.expires_at - time.monotonic())
+        return True
+
+    async def hash_get_all(self, key:str, allow_stale:bool=False)->dict[str,str]:
+        entry = self._live(key)
+        return dict(entry.value) if entry is not None else {}
+
+    async def hash_get(self, key:str, field:str)->str | None:
+        entry = self._live(key)
+        return entry.value.get(field) if entry is not None else None
+
+    async def hash_delete(self, key:str, field:str):
+        entry = self._live(key)
+        if entry is not None:
+            entry.value.pop(field, None)
+            # Like Redis, a hash without fields does not exist
+            if not entry.value:
+                del self._entries[key]
+
+    async def hash_consume(self, key:str, value:str, attempts_key:str, max_attempts:int, ttl:int)->tuple[str,str | None]:
+        attempts = self._live(attempts_key)
+        if attempts is None:
+            attempts = self._put(attempts_key, 0, ttl)
+        attempts.value += 1
+        if max_attempts > 0 and attempts.value > max_attempts:
+            self._entries.pop(key, None)
+            return "locked", None
+        entry = self._live(key)
+        matched = None
+        for field, stored in (entry.value.items() if entry is not None else ()):
+            # Compare every entry in constant time so timing does not leak the matching value
+            if hmac.compare_digest(stored.encode(), value.encode()):
+                matched = field
+        if matched is None:
+            return "mismatch", None
+        del entry.value[matched]
+        if not entry.value:
+            del self._entries[key]
+        self._entries.pop(attempts_key, None)
+        return "ok", matched
+
+    async def sliding_window_hit(self, key:str, limit:int, window:int)->int:
+        now = int(time.time() * 1000)
+        entry = self._live(key)
+        # Request times in ms, oldest first
+        log = entry.value if entry is not None else []
+        del log[:bisect.bisect_right(log, now - window)]
+        if len(log) < limit:
+            log.append(now)
+            self._put(key, log, window / 1000)
+            return 0
+        return log[0] + window - now
+
+    def clear(self):
+        self._entries.clear()
+        self._expiries.clear()
+
+    def __len__(self)->int:
+        self._purge(time.monotonic())
+        return len(self._entries)
+
+
+# One backend per Redis client so the scripts are registered once
+_redis_backends: "weakref.WeakKeyDictionary[aioredis.Redis, RedisStateBackend]" = weakref.WeakKeyDictionary()
+
+def as_state_backend(db:"StateBackend | aioredis.Redis")->StateBackend:
+    """Return db itself when it is a state backend, otherwise the Redis backend wrapping the client."""
+    if isinstance(db, StateBackend):
+        return db
+    backend = _redis_backends.get(db)
+    if backend is None:
+        backend = _redis_backends[db] = RedisStateBackend(db)
+    return backend
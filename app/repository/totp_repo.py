@@ -1,54 +1,126 @@
 from app.config.settings import settings
+from app.repository.state_backend import StateBackend,as_state_backend
+from app.schema.totp import SeedFullInfo,QRCodeFormat
 import redis.asyncio as aioredis
 
 class TOTPRepository():
 
     @staticmethod
-    async def store_totp_seed(db:aioredis.Redis, username:str, seed:str):
+    def totp_key(username:str)->str:
+        """
+        Build the key of the TOTP seed waiting for confirmation of a user.
+        Args:
+            username (str): username of the user owning the seed
+        Returns:
+            str: key pattern {username}:totp, hash tagged on the username like the otp keys
+        """
+        return f"{{{username}}}:totp"
+
+    @staticmethod
+    def enrollment_key(username:str)->str:
+        """
+        Build the key of the rendered enrollments of the pending TOTP seed of a user.
+        Args:
+            username (str): username of the user owning the seed
+        Returns:
+            str: key pattern {username}:totp-enrollment, its fields map qrcode format -> enrollment json
+        """
+        return f"{{{username}}}:totp-enrollment"
+
+    @staticmethod
+    async def store_totp_seed(db:StateBackend|aioredis.Redis, username:str, seed:str):
         """
         Store the TOTP seed for a user.
         Args:
-            db (aioredis.Redis): redis client instance
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
             username (str): username of the user want to store totp
             seed (str): totp seed to store
         Return:
             bool : True if successful and False is not successful
         """
         try:
-            # Store TOTP with a key pattern: username:totp
-            key = f"{username}:totp"
-            await db.set(key, seed, ex=settings.redis_ttl)
+            key = TOTPRepository.totp_key(username)
+            await as_state_backend(db).set(key, seed, settings.redis_ttl, reset_key=TOTPRepository.enrollment_key(username))
             return True
         except Exception as exc:
             return False
 
     @staticmethod
-    async def get_totp_seed(db:aioredis.Redis, username:str) -> str | None:
+    async def reserve_totp_seed(db:StateBackend|aioredis.Redis, username:str, seed:str) -> str | None:
+        """
+        Store the TOTP seed for a user unless a seed is already waiting for confirmation, in one atomic call.
+        Args:
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
+            username (str): username of the user want to store totp
+            seed (str): totp seed to store
+        Returns:
+            str | None: None if the seed was reserved, else the seed already waiting for confirmation.
+        """
+        key = TOTPRepository.totp_key(username)
+        return await as_state_backend(db).reserve(key, seed, settings.redis_ttl)
+
+    @staticmethod
+    async def replace_totp_seed(db:StateBackend|aioredis.Redis, username:str, seed:str):
+        """
+        Replace the TOTP seed waiting for confirmation and forget the enrollments rendered for the old one, in one atomic call.
+        Args:
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
+            username (str): username of the user want to store totp
+            seed (str): totp seed to store
+        """
+        await as_state_backend(db).set(TOTPRepository.totp_key(username), seed, settings.redis_ttl,
+                                       reset_key=TOTPRepository.enrollment_key(username))
+
+    @staticmethod
+    async def get_totp_enrollment(db:StateBackend|aioredis.Redis, username:str, qrcode_format:QRCodeFormat) -> SeedFullInfo | None:
+        """
+        Get the enrollment rendered in a format for the pending TOTP seed of a user, in a single read.
+        Args:
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
+            username (str): username of the user want to get the enrollment
+            qrcode_format (QRCodeFormat): format the qr code was rendered in
+        Returns:
+            SeedFullInfo | None: The enrollment if it was rendered in that format, else None.
+        """
+        # Enrollments are only stored for the pending seed and dropped with it, see store_totp_enrollment
+        enrollment = await as_state_backend(db).hash_get(TOTPRepository.enrollment_key(username), qrcode_format.value)
+        return SeedFullInfo.model_validate_json(enrollment) if enrollment else None
+
+    @staticmethod
+    async def store_totp_enrollment(db:StateBackend|aioredis.Redis, username:str, enrollment:SeedFullInfo) -> bool:
+        """
+        Store the enrollment rendered for the pending TOTP seed of a user, it expires with the seed.
+        Args:
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
+            username (str): username of the user want to store the enrollment
+            enrollment (SeedFullInfo): seed, seed uri and qr code rendered in enrollment.qrcode_format
+        Returns:
+            bool: False when enrollment.seed is no longer pending (confirmed, expired or replaced meanwhile).
+        """
+        # Checked and stored in one step, so an enrollment never outlives or precedes a change of the seed
+        return await as_state_backend(db).hash_store_if(TOTPRepository.enrollment_key(username), enrollment.qrcode_format.value,
+                                                        enrollment.model_dump_json(), TOTPRepository.totp_key(username), enrollment.seed)
+
+    @staticmethod
+    async def get_totp_seed(db:StateBackend|aioredis.Redis, username:str, allow_stale:bool=False) -> str | None:
         """
         Get the TOTP seed for a user.
         Args:
-            db (aioredis.Redis): redis client instance
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
             username (str): username of the user want to get totp
+            allow_stale (bool): read from a replica, a seed reserved moments ago may be missing
         Returns:
             str | None: The TOTP seed if found, else None.
         """
-        key = f"{username}:totp"
-        value = await db.get(key)
-        # Just in case the value in Byts then decode it
-        if isinstance(value, (bytes, bytearray)):
-            try:
-                return value.decode()
-            except Exception:
-                return None
-        return value
+        key = TOTPRepository.totp_key(username)
+        return await as_state_backend(db).get(key, allow_stale)
     
     @staticmethod
-    async def delete_totp_seed(db:aioredis.Redis, username:str):
+    async def delete_totp_seed(db:StateBackend|aioredis.Redis, username:str):
         """
         Delete the TOTP seed for a user.
         Args:
-            db (aioredis.Redis): redis client instance
+            db (StateBackend | aioredis.Redis): state backend or redis client instance
             username (str): username of the user want to delete totp
         """
-        key = f"{username}:totp"
-        await db.delete(key)
\ No newline at end of file
+        await as_state_backend(db).delete(TOTPRepository.totp_key(username), TOTPRepository.enrollment_key(username))
\ No newline at end of file
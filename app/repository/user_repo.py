@@ -1,25 +1,94 @@
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession,async_sessionmaker
 from app.model.user_profile import UserProfile
 from sqlalchemy.future import select
+from sqlalchemy import insert,update,bindparam
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.helper.single_flight import SingleFlight
+from app.helper.user_profile_cache import UserProfileCache,UserProfileSnapshot,PROFILE_COLUMNS
+from app.dependacy.pg_database import execute_read,mark_written,written_recently,release_connection,session_maker_of
 import logging
 
+# Core statement of the hot profile lookup, built once: rows come back as plain tuples in snapshot column
+# order and its compiled form (and the asyncpg prepared statement) is reused by every lookup
+_SELECT_USER_BY_USERNAME=(select(*(UserProfile.__table__.c[column] for column in PROFILE_COLUMNS))
+                          .where(UserProfile.__table__.c.username==bindparam("username")))
+# Same lookup pinned to the primary, for profiles a replica may not have caught up with
+_SELECT_USER_BY_USERNAME_ON_PRIMARY=_SELECT_USER_BY_USERNAME.execution_options(primary=True)
+# The TOTP seed is not part of the cached profile, it is read from the primary when a code is verified
+_SELECT_TOTP_SECRET_BY_USERNAME=(select(UserProfile.__table__.c.totp_secret_encrypted)
+                                 .where(UserProfile.__table__.c.username==bindparam("username"))
+                                 .execution_options(primary=True))
+
 class UserRepository():
     """Repository for user profile related database operations."""
 
     logger=logging.getLogger(__name__)
 
+    # Identical concurrent lookups share one query
+    _user_flight=SingleFlight("user_by_username")
+
     @staticmethod
-    async def get_user_by_username(username:str,db: AsyncSession)->UserProfile | None:
+    async def get_user_by_username(username:str,db: AsyncSession)->UserProfileSnapshot | None:
         """
-         Retrieve a user by username.
+         Retrieve a user by username, from the user profile cache when possible.
+         The profile is a read-only snapshot with the UserProfile attributes, it is not attached to db.
          Args:
             username (str): The username of the user to retrieve.
-            db (AsyncSession): The database session. 
+            db (AsyncSession): The database session, the lookup runs on a session of its own on the same database.
         Returns:
-            UserProfile | None: The user profile if found, otherwise None.
+            UserProfileSnapshot | None: The user profile if found, otherwise None.
+        """
+        if UserProfileCache.enabled():
+            user=await UserProfileCache.get(username)
+            if user is not None:
+                return user
+        # The coalesced lookup is shared by every waiting request, so it must not run on (and fail with) the
+        # session of the request that happened to start it
+        session_maker=session_maker_of(db)
+        return await UserRepository._user_flight.do(username,lambda: UserRepository._load_user_by_username(username,session_maker))
+
+    @staticmethod
+    async def _load_user_by_username(username:str,session_maker:async_sessionmaker[AsyncSession])->UserProfileSnapshot | None:
+        """Load the user profile of username on a dedicated session and cache it."""
+        # Captured before the SELECT so a profile invalidated meanwhile is not cached
+        token=await UserProfileCache.load_token(username) if UserProfileCache.enabled() else None
+        async with session_maker() as db:
+            user=await UserRepository._select_user_by_username(username,db)
+        if user and token is not None:
+            await UserProfileCache.set(user,token)
+        return user
+
+    @staticmethod
+    async def _select_user_by_username(username:str,db: AsyncSession)->UserProfileSnapshot | None:
+        """Load the user profile of username, without going through the ORM identity map."""
+        # A replica may not have a recent write yet
+        statement=_SELECT_USER_BY_USERNAME_ON_PRIMARY if written_recently(username) else _SELECT_USER_BY_USERNAME
+        result=await execute_read(db,statement,{"username":username})
+        row=result.first()
+        await release_connection(db)
+        return UserProfileSnapshot(*row) if row else None
+
+    @staticmethod
+    async def get_user_totp_secret(username:str,db: AsyncSession)->str|None:
+        """
+         Retrieve the encrypted TOTP seed of a user, never cached and always read from the primary.
+         Args:
+            username (str): The username of the user.
+            db (AsyncSession): The database session.
+        Returns:
+            str | None: The encrypted seed, None if the user or its seed does not exist.
         """
-        result = await db.execute(select(UserProfile).where(UserProfile.username == username))
-        return result.scalars().first()
+        result=await db.execute(_SELECT_TOTP_SECRET_BY_USERNAME,{"username":username})
+        secret=result.scalar()
+        await release_connection(db)
+        return secret
+
+    @staticmethod
+    def _column_values(user_profile:UserProfile)->dict:
+        """Column values set on a transient profile, unset columns are left to their defaults."""
+        return {column.key:getattr(user_profile,column.key) for column in UserProfile.__table__.columns
+                if getattr(user_profile,column.key) is not None}
 
     @staticmethod
     async def create_new_user(user_profile:UserProfile,db: AsyncSession)->UserProfile:
@@ -29,12 +98,58 @@ class UserRepository():
             user_profile (UserProfile): User profile info.
             db (AsyncSession): The database session. 
         Returns:
-            UserProfile: Get refereshed user profile info.
+            UserProfile: The created user profile, with its generated id and defaults.
+        """
+        values=UserRepository._column_values(user_profile)
+        # INSERT ... RETURNING gives the generated id and defaults without a refresh
+        result=await db.execute(insert(UserProfile).values(**values).returning(UserProfile))
+        created=result.scalars().one()
+        await db.commit()
+        mark_written(created.username)
+        return created
+
+    @staticmethod
+    async def create_user_if_missing(user_profile:UserProfile,db: AsyncSession)->bool:
+        """
+         Insert a user unless a profile with the same username exists (INSERT ... ON CONFLICT DO NOTHING).
+         Args:
+            user_profile (UserProfile): User profile info.
+            db (AsyncSession): The database session.
+        Returns:
+            bool: True if the profile was inserted, False if it already existed.
+        """
+        values=UserRepository._column_values(user_profile)
+        dialect_insert=postgresql_insert if db.get_bind().dialect.name=="postgresql" else sqlite_insert
+        statement=dialect_insert(UserProfile).values(**values).on_conflict_do_nothing(index_elements=[UserProfile.username])
+        result=await db.execute(statement)
+        await db.commit()
+        if result.rowcount==1:
+            mark_written(user_profile.username)
+        return result.rowcount==1
+
+    @staticmethod
+    async def _update_user(username:str,db: AsyncSession,**values)->UserProfile|None:
+        """
+        Update columns of a user in a single UPDATE ... RETURNING statement.
+        Args:
+            username (str): The username of the user to update.
+            db (AsyncSession): The database session.
+            **values: New column values.
+        Returns:
+            UserProfile | None: The updated user profile if found, otherwise None.
         """
-        db.add(user_profile)
+        # RETURNING hands back the updated row and keeps profiles already loaded in the session in sync,
+        # no SELECT before nor refresh after the update
+        statement=(update(UserProfile).where(UserProfile.username==username).values(**values)
+                   .returning(UserProfile).execution_options(synchronize_session="fetch"))
+        result=await db.execute(statement)
+        user=result.scalars().first()
         await db.commit()
-        await db.refresh(user_profile)
-        return user_profile
+        if user:
+            mark_written(username)
+        if user and UserProfileCache.enabled():
+            await UserProfileCache.invalidate(username)
+        return user
 
     @staticmethod
     async def update_user_totp(username:str,seed:str,db: AsyncSession)->UserProfile|None:
@@ -47,18 +162,12 @@ class UserRepository():
         Returns:
             UserProfile | None: The user profile if found, otherwise None.
         """
-        user = await UserRepository.get_user_by_username(username, db)
-        if user:
-            user.totp_secret_encrypted = seed
-            user.is_totp_verified = True
-            await db.commit()
-            await db.refresh(user)
-        return user
+        return await UserRepository._update_user(username,db,totp_secret_encrypted=seed,is_totp_verified=True)
     
     @staticmethod
     async def update_user_email(username:str,email:str,db: AsyncSession)->UserProfile|None:
         """
-        Update user totp.   
+        Update user email.   
         Args:
             username (str): The username of the user to retrieve.
             email (str): New email address of the user
@@ -66,29 +175,17 @@ class UserRepository():
         Returns:
             UserProfile | None: The user profile if found, otherwise None.
         """
-        user = await UserRepository.get_user_by_username(username, db)
-        if user:
-            user.email_address=email
-            user.is_email_address_verified = True
-            await db.commit()
-            await db.refresh(user)
-        return user
+        return await UserRepository._update_user(username,db,email_address=email,is_email_address_verified=True)
     
     @staticmethod
     async def update_user_mobile(username:str,mobile:str,db: AsyncSession)->UserProfile|None:
         """
-        Update user totp.   
+        Update user mobile.   
         Args:
             username (str): The username of the user to retrieve.
-            movile (str): New mobile number of the user
+            mobile (str): New mobile number of the user
             db (AsyncSession): The database session.
         Returns:
             UserProfile | None: The user profile if found, otherwise None.
         """
-        user = await UserRepository.get_user_by_username(username, db)
-        if user:
-            user.mobile_number=mobile
-            user.is_mobile_number_verified = True
-            await db.commit()
-            await db.refresh(user)
-        return user
\ No newline at end of file
+        return await UserRepository._update_user(username,db,mobile_number=mobile,is_mobile_number_verified=True)
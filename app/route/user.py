@@ -1,17 +1,21 @@
-from fastapi import APIRouter,Depends,BackgroundTasks
+from fastapi import APIRouter,Depends,BackgroundTasks,HTTPException,Response,status
+from typing import Literal
 from sqlalchemy.ext.asyncio import AsyncSession
-import redis.asyncio as aioredis
 from app.dependacy.authenticate_user import AuthenticateUser
 from app.schema.token import TokenValidationResponse
 from app.schema.user import UserProfileInfoResponse,UpdateUserInfo,UpdateUserInfoResponse
 from app.schema.otp import SendOTPSchema,OTPVerificationResponse
-from app.schema.totp import SendTOTP,TOTPGenerationResult,TOTPVerificationResult
+from app.schema.totp import SendTOTP,TOTPGenerationResult,TOTPVerificationResult,QRCodeFormat
 from app.dependacy.pg_database import get_pg_db_connection
-from app.dependacy.redis_database import get_redis_db_client
+from app.dependacy.state_backend import get_state_backend
+from app.repository.state_backend import StateBackend
+from app.dependacy.rate_limit import update_rate_limit,otp_verification_rate_limit,totp_verification_rate_limit
 from app.controller.user_profile import UserProfileController
 
 user_router = APIRouter()
 
+QRCODE_MEDIA_TYPES={QRCodeFormat.PNG:"image/png",QRCodeFormat.SVG:"image/svg+xml"}
+
 @user_router.post('/user')
 async def create_user_profile(authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_logged_in_user),
                               db:AsyncSession=Depends(get_pg_db_connection))->UserProfileInfoResponse:
@@ -19,26 +23,37 @@ async def create_user_profile(authentication_results: TokenValidationResponse=De
     return await UserProfileController.create_user_profile(authentication_results,db)
 
 @user_router.get('/user')
-async def get_user_profile(authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_logged_in_user),
+async def get_user_profile(authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_provisioned_user),
                               db:AsyncSession=Depends(get_pg_db_connection)):
     return await UserProfileController.get_user_profile(authentication_results,db)
 
-@user_router.patch('/user')
-async def update_user_profile(updated_user_info:UpdateUserInfo,background_tasks: BackgroundTasks,authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_logged_in_user),
-                              db:AsyncSession=Depends(get_pg_db_connection),redis:aioredis.Redis=Depends(get_redis_db_client))->UpdateUserInfoResponse:
-    return await UserProfileController.update_user_info(authentication_results,updated_user_info,db,redis,background_tasks)
+@user_router.patch('/user',dependencies=[Depends(update_rate_limit),Depends(update_rate_limit.check_user)])
+async def update_user_profile(updated_user_info:UpdateUserInfo,background_tasks: BackgroundTasks,authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_provisioned_user),
+                              db:AsyncSession=Depends(get_pg_db_connection),state:StateBackend=Depends(get_state_backend))->UpdateUserInfoResponse:
+    return await UserProfileController.update_user_info(authentication_results,updated_user_info,db,state,background_tasks)
 
-@user_router.post('/user/verify-otp')
-async def verify_otp(received_otp:SendOTPSchema,authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_logged_in_user),
-                              db:AsyncSession=Depends(get_pg_db_connection),redis:aioredis.Redis=Depends(get_redis_db_client))->OTPVerificationResponse:
-    return await UserProfileController.verify_otp(authentication_results,received_otp,db,redis)
+@user_router.post('/user/verify-otp',dependencies=[Depends(otp_verification_rate_limit),Depends(otp_verification_rate_limit.check_user)])
+async def verify_otp(received_otp:SendOTPSchema,authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_provisioned_user),
+                              db:AsyncSession=Depends(get_pg_db_connection),state:StateBackend=Depends(get_state_backend))->OTPVerificationResponse:
+    return await UserProfileController.verify_otp(authentication_results,received_otp,db,state)
 
 @user_router.post('/user/generate-totp')
-async def generate_totp(authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_logged_in_user),
-                              db:AsyncSession=Depends(get_pg_db_connection),redis:aioredis.Redis=Depends(get_redis_db_client))->TOTPGenerationResult:
-    return await UserProfileController.generate_totp_seed(authentication_results,db,redis)
-
-@user_router.post('/user/verify-totp')
-async def verify_totp(received_totp:SendTOTP,authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_logged_in_user),
-                              db:AsyncSession=Depends(get_pg_db_connection),redis:aioredis.Redis=Depends(get_redis_db_client))->TOTPVerificationResult:
-    return await UserProfileController.verify_totp_seed(authentication_results,received_totp.totp,received_totp.is_new_seed,db,redis)
\ No newline at end of file
+async def generate_totp(format:QRCodeFormat=QRCodeFormat.PNG,regenerate:bool=False,authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_provisioned_user),
+                              db:AsyncSession=Depends(get_pg_db_connection),state:StateBackend=Depends(get_state_backend))->TOTPGenerationResult:
+    return await UserProfileController.generate_totp_seed(authentication_results,db,state,format,regenerate)
+
+@user_router.get('/user/totp-qrcode',response_class=Response,responses={200:{"content":{"image/png":{},"image/svg+xml":{}}}})
+async def get_totp_qrcode(format:Literal[QRCodeFormat.PNG,QRCodeFormat.SVG]=QRCodeFormat.PNG,
+                          authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_provisioned_user),
+                          state:StateBackend=Depends(get_state_backend))->Response:
+    """Raw QR code image of the seed waiting for confirmation."""
+    image=await UserProfileController.get_pending_totp_qrcode(authentication_results,state,format)
+    if image is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="There is no seed waiting for confirmation.")
+    # The image carries the seed, keep it out of every cache
+    return Response(content=image,media_type=QRCODE_MEDIA_TYPES[format],headers={"Cache-Control":"no-store"})
+
+@user_router.post('/user/verify-totp',dependencies=[Depends(totp_verification_rate_limit),Depends(totp_verification_rate_limit.check_user)])
+async def verify_totp(received_totp:SendTOTP,authentication_results: TokenValidationResponse=Depends(AuthenticateUser.get_provisioned_user),
+                              db:AsyncSession=Depends(get_pg_db_connection),state:StateBackend=Depends(get_state_backend))->TOTPVerificationResult:
+    return await UserProfileController.verify_totp_seed(authentication_results,received_totp.totp,received_totp.is_new_seed,db,state)
\ No newline at end of file
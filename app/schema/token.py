@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass,field
+from typing import Optional
 
 @dataclass
 class TokenGenerationResponse:
@@ -18,4 +19,5 @@ class TokenValidationResponse:
     """
     successful:bool
     username:str
+    claims:Optional[dict]=field(default=None,repr=False)
 
@@ -1,17 +1,26 @@
 from pydantic import BaseModel
 from typing import Optional
+from enum import Enum
+
+class QRCodeFormat(str, Enum):
+    """How the TOTP QR code is delivered."""
+    PNG = "png"
+    SVG = "svg"
+    URI_ONLY = "uri-only"
 
 class SeedURIImage(BaseModel):
-    """Class to hold TOTP seed URI and QR code image."""
+    """Class to hold TOTP seed URI and QR code image (base64 PNG, SVG markup or None for uri-only)."""
     seed_uri: str
-    qrcode: str
+    qrcode: Optional[str] = None
+    qrcode_format: QRCodeFormat = QRCodeFormat.PNG
 
 class SeedFullInfo(BaseModel):
     """Class to hold full TOTP information including seed, username, seed URI, and QR code image."""
     seed: str
     user_name:str
     seed_uri: str
-    qrcode: str
+    qrcode: Optional[str] = None
+    qrcode_format: QRCodeFormat = QRCodeFormat.PNG
 
 class TOTPGenerationResult(BaseModel):
     """Class to hold TOTP generation result."""
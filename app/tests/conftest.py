@@ -14,7 +14,14 @@ import app.dependacy.redis_database as redis_database
 from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession 
 from app.dependacy.pg_database import get_pg_db_connection
 from app.dependacy.redis_database import get_redis_db_client
+from app.dependacy.state_backend import get_state_backend
+from app.repository.state_backend import as_state_backend
 from app.model.user_profile import Base
+from app.helper.auth_cache import AuthCache
+from app.helper.user_profile_cache import UserProfileCache
+from app.schema.token import TokenGenerationResponse, TokenValidationResponse
+from app.controller.user_profile import UserProfileController
+from app.dependacy.http_client import close_http_clients
 
 
 @pytest_asyncio.fixture(scope="function")
@@ -134,8 +141,18 @@ async def client(db_session):
             await _placeholder_create_redis_db_pool()
         yield redis_database.redis_pool
 
+    async def override_get_state_backend():
+        async for redis in override_get_redis_db_client():
+            yield as_state_backend(redis)
+
     app.dependency_overrides[get_pg_db_connection] = override_get_pg_db_connection
     app.dependency_overrides[get_redis_db_client] = override_get_redis_db_client
+    app.dependency_overrides[get_state_backend] = override_get_state_backend
+
+    # Start every test with empty in-process caches
+    AuthCache.clear()
+    UserProfileCache.clear()
+    UserProfileController._provisioned_users.clear()
 
     # Create test client (this will run lifespan but create_* functions are no-ops patched above)
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as test_client:
@@ -146,6 +163,28 @@ async def client(db_session):
     # ensure we call close hooks to clear fake pools if needed
     await _placeholder_close_redis_db_pool()
     await _placeholder_close_pg_db_pool()
+    await close_http_clients()
+
+@pytest.fixture
+def keycloak_calls(monkeypatch):
+    """Fake Keycloak token generation and validation and record the calls."""
+    calls = {"generate": 0, "validate": 0}
+
+    async def _generate(username, password):
+        calls["generate"] += 1
+        if password != "secret":
+            return TokenGenerationResponse(successful=False, token=None, token_type=None, token_expires_in=0)
+        return TokenGenerationResponse(successful=True, token=f"token-{username}", token_type="Bearer", token_expires_in=300)
+
+    async def _validate(token, introspect=False):
+        calls["validate"] += 1
+        if token is None:
+            return TokenValidationResponse(successful=False, username=None)
+        return TokenValidationResponse(successful=True, username=token.removeprefix("token-"))
+
+    monkeypatch.setattr("app.dependacy.authenticate_user.KeycloakHelper.generat_token", _generate)
+    monkeypatch.setattr("app.dependacy.authenticate_user.KeycloakHelper.validate_token", _validate)
+    return calls
 
 @pytest.fixture(scope="session")
 def anyio_backend():
@@ -0,0 +1,78 @@
+import asyncio
+import time
+import pytest
+from app.exception.exceptions import ServiceUnavailableError
+from app.helper.circuit_breaker import CircuitBreaker, keycloak_breaker
+
+
+def _breaker(**overrides):
+    options = dict(latency_budget=0.05, slow_call_threshold=0.04, failure_threshold=2, reset_timeout=0.05)
+    options.update(overrides)
+    return CircuitBreaker("test", **options)
+
+
+async def _ok():
+    return "ok"
+
+
+async def _error():
+    raise ConnectionError("down")
+
+
+async def _hang():
+    await asyncio.sleep(1)
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_after_consecutive_failures_and_fails_fast():
+    breaker = _breaker()
+    with pytest.raises(ConnectionError):
+        await breaker.call(_error)
+    # Calls over the latency budget are cut short and count as failures
+    with pytest.raises(ServiceUnavailableError):
+        await breaker.call(_hang)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    calls = []
+
+    async def _tracked():
+        calls.append(1)
+        return "ok"
+    with pytest.raises(ServiceUnavailableError) as exc_info:
+        await breaker.call(_tracked)
+    assert exc_info.value.retry_after >= 1
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_half_open_probe_closes_or_reopens_the_circuit():
+    breaker = _breaker(failure_threshold=1)
+    with pytest.raises(ConnectionError):
+        await breaker.call(_error)
+    await asyncio.sleep(0.06)
+    # A failed probe opens the circuit again
+    with pytest.raises(ConnectionError):
+        await breaker.call(_error)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    await asyncio.sleep(0.06)
+    assert await breaker.call(_ok) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_result_based_failures_count_towards_opening():
+    breaker = _breaker()
+    for _ in range(2):
+        assert await breaker.call(_ok, is_failure=lambda result: True) == "ok"
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_open_keycloak_circuit_answers_503(client, monkeypatch):
+    monkeypatch.setattr(keycloak_breaker, "state", CircuitBreaker.OPEN)
+    monkeypatch.setattr(keycloak_breaker, "_opened_at", time.monotonic())
+
+    response = await client.get("/user", auth=("alice", "secret"))
+    assert response.status_code == 503
+    assert int(response.headers["retry-after"]) >= 1
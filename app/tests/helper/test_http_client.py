@@ -0,0 +1,47 @@
+import httpx
+import pytest
+import pytest_asyncio
+from app.dependacy.http_client import create_http_clients, close_http_clients, get_http_client, KEYCLOAK, TWILIO
+from app.helper.keycloak_helper import KeycloakHelper
+from app.helper.sms_helper import SMSHelper
+
+
+@pytest_asyncio.fixture
+async def requests_seen():
+    """Route every outbound call through a mock transport and record the requests."""
+    seen = []
+
+    def _handler(request: httpx.Request):
+        seen.append(request)
+        if request.url.path.endswith("/token"):
+            return httpx.Response(200, json={"access_token": "abc", "token_type": "Bearer", "expires_in": 300})
+        return httpx.Response(201, json={})
+
+    await create_http_clients(transport=httpx.MockTransport(_handler))
+    yield seen
+    await close_http_clients()
+
+
+@pytest.mark.asyncio
+async def test_upstream_calls_share_app_lifetime_clients(requests_seen):
+    keycloak_client = get_http_client(KEYCLOAK)
+
+    first = await KeycloakHelper.generat_token("alice", "secret")
+    second = await KeycloakHelper.generat_token("alice", "secret")
+    assert first.successful and second.successful
+    assert first.token == "abc"
+    assert await SMSHelper.send_sms_otp("+97300000000", "Alice", "123456") is True
+
+    # The same pooled client serves every Keycloak call and each upstream has its own client
+    assert get_http_client(KEYCLOAK) is keycloak_client
+    assert get_http_client(TWILIO) is not keycloak_client
+    assert [r.url.host for r in requests_seen] == ["localhost", "localhost", "api.twilio.com"]
+
+
+@pytest.mark.asyncio
+async def test_closed_clients_are_recreated_on_demand():
+    await close_http_clients()
+    client = get_http_client(KEYCLOAK)
+    assert not client.is_closed
+    await close_http_clients()
+    assert client.is_closed
@@ -0,0 +1,44 @@
+import asyncio
+import time
+import pytest
+from app.helper.keycloak_helper import KeycloakHelper
+from app.schema.token import TokenGenerationResponse
+
+
+@pytest.fixture
+def admin_grants(monkeypatch):
+    """Fake the admin password grant and count how often Keycloak is asked."""
+    grants = []
+
+    async def _generate(username, password):
+        grants.append(username)
+        await asyncio.sleep(0.01)
+        return TokenGenerationResponse(successful=True, token=f"admin-{len(grants)}", token_type="Bearer", token_expires_in=300)
+
+    monkeypatch.setattr(KeycloakHelper, "generat_token", _generate)
+    KeycloakHelper.invalidate_admin_token()
+    yield grants
+    KeycloakHelper.invalidate_admin_token()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_admin_login(admin_grants):
+    tokens = await asyncio.gather(*(KeycloakHelper.get_admin_token() for _ in range(20)))
+    assert {token.token for token in tokens} == {"admin-1"}
+    # Later calls are served from the cache
+    assert (await KeycloakHelper.get_admin_token()).token == "admin-1"
+    assert len(admin_grants) == 1
+
+
+@pytest.mark.asyncio
+async def test_admin_token_is_refreshed_before_it_expires(admin_grants):
+    await KeycloakHelper.get_admin_token()
+    # Pretend the token is about to expire
+    KeycloakHelper._admin_token_expires_at = time.monotonic() + 20
+
+    tokens = await asyncio.gather(*(KeycloakHelper.get_admin_token() for _ in range(5)))
+    # The current token is still handed out while a single refresh runs in the background
+    assert {token.token for token in tokens} == {"admin-1"}
+    await KeycloakHelper._admin_token_refresh
+    assert (await KeycloakHelper.get_admin_token()).token == "admin-2"
+    assert len(admin_grants) == 2
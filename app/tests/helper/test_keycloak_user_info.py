@@ -0,0 +1,60 @@
+import httpx
+import pytest
+import pytest_asyncio
+from app.dependacy.http_client import create_http_clients, close_http_clients
+from app.helper.keycloak_helper import KeycloakHelper
+from app.schema.token import TokenGenerationResponse
+from app.schema.user import UpdateUserInfo
+
+
+@pytest_asyncio.fixture
+async def admin_requests(monkeypatch):
+    """Fake the Keycloak admin API and record the requests it receives."""
+    seen = []
+
+    def _handler(request: httpx.Request):
+        seen.append(request)
+        if request.method == "GET":
+            return httpx.Response(200, json=[{
+                "id": "kc-1", "username": "alice", "firstName": "Alice", "lastName": "Doe",
+                "email": "alice@example.com", "emailVerified": True,
+                "attributes": {"mobile": ["+97311111111"], "mobileVerified": ["true"]},
+            }])
+        return httpx.Response(204)
+
+    async def _admin_token():
+        return TokenGenerationResponse(successful=True, token="admin", token_type="Bearer", token_expires_in=300)
+
+    monkeypatch.setattr(KeycloakHelper, "get_admin_token", _admin_token)
+    KeycloakHelper._user_info_cache.clear()
+    await create_http_clients(transport=httpx.MockTransport(_handler))
+    yield seen
+    await close_http_clients()
+    KeycloakHelper._user_info_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_user_info_uses_exact_lookup_and_is_cached(admin_requests):
+    first = await KeycloakHelper.return_matching_user_info("alice")
+    second = await KeycloakHelper.return_matching_user_info("alice")
+
+    assert first == second
+    assert first.id == "kc-1"
+    assert first.mobile_verified is True
+    assert len(admin_requests) == 1
+    assert admin_requests[0].url.params["username"] == "alice"
+    assert admin_requests[0].url.params["exact"] == "true"
+
+
+@pytest.mark.asyncio
+async def test_update_user_attributes_invalidates_cached_user_info(admin_requests):
+    await KeycloakHelper.return_matching_user_info("alice")
+
+    result = await KeycloakHelper.update_user_attributes("alice", UpdateUserInfo(email="new@example.com"))
+    assert result.successful_update is True
+    assert admin_requests[-1].method == "PUT"
+    assert b"new@example.com" in admin_requests[-1].content
+
+    await KeycloakHelper.return_matching_user_info("alice")
+    # Initial lookup, fresh lookup before the update and the lookup after invalidation
+    assert [request.method for request in admin_requests] == ["GET", "GET", "PUT", "GET"]
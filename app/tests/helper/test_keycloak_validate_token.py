@@ -0,0 +1,113 @@
+import time
+from dataclasses import replace
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from app.config.settings import settings
+from app.helper.jwks_helper import JWKSHelper
+from app.helper.keycloak_helper import KeycloakHelper
+from app.schema.token import TokenValidationResponse
+
+
+def _signing_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk_data = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    jwk_data.update({"kid": kid, "alg": "RS256", "use": "sig"})
+    return private_key, jwt.PyJWK(jwk_data)
+
+
+def _token(private_key, kid, **claims):
+    payload = {"iss": JWKSHelper.issuer(), "exp": int(time.time()) + 300, "typ": "Bearer", "preferred_username": "jwtuser",
+               "aud": "account", "azp": settings.keycloak_client_id}
+    payload.update(claims)
+    return jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+@pytest.fixture(autouse=True)
+def clear_jwks():
+    JWKSHelper.clear()
+    yield
+    JWKSHelper.clear()
+
+
+@pytest.mark.asyncio
+async def test_validate_token_locally(monkeypatch):
+    private_key, public_jwk = _signing_key("kid-1")
+    fetches = []
+
+    async def _fetch_keys():
+        fetches.append(1)
+        return {"kid-1": public_jwk}
+    monkeypatch.setattr(JWKSHelper, "fetch_keys", _fetch_keys)
+
+    async def _introspect(token):
+        raise AssertionError("Introspection must not be called")
+    monkeypatch.setattr(KeycloakHelper, "introspect_token", _introspect)
+
+    for _ in range(3):
+        result = await KeycloakHelper.validate_token(_token(private_key, "kid-1"))
+        assert result.successful is True
+        assert result.username == "jwtuser"
+    # Keys are downloaded once and reused
+    assert len(fetches) == 1
+
+
+@pytest.mark.asyncio
+async def test_validate_token_rejects_expired_and_foreign_tokens(monkeypatch):
+    private_key, public_jwk = _signing_key("kid-1")
+    foreign_key, _ = _signing_key("kid-1")
+
+    async def _fetch_keys():
+        return {"kid-1": public_jwk}
+    monkeypatch.setattr(JWKSHelper, "fetch_keys", _fetch_keys)
+
+    expired = await KeycloakHelper.validate_token(_token(private_key, "kid-1", exp=int(time.time()) - 60))
+    assert expired.successful is False
+    wrong_issuer = await KeycloakHelper.validate_token(_token(private_key, "kid-1", iss="http://evil/realms/x"))
+    assert wrong_issuer.successful is False
+    tampered = await KeycloakHelper.validate_token(_token(foreign_key, "kid-1"))
+    assert tampered.successful is False
+
+
+@pytest.mark.asyncio
+async def test_validate_token_rejects_tokens_of_other_clients(monkeypatch):
+    private_key, public_jwk = _signing_key("kid-1")
+
+    async def _fetch_keys():
+        return {"kid-1": public_jwk}
+    monkeypatch.setattr(JWKSHelper, "fetch_keys", _fetch_keys)
+
+    other_client = _token(private_key, "kid-1", azp="other-client")
+    assert (await KeycloakHelper.validate_token(other_client)).successful is False
+    # Tokens of another client that list this one as audience are accepted
+    audience = _token(private_key, "kid-1", azp="other-client", aud=["account", settings.keycloak_client_id])
+    assert (await KeycloakHelper.validate_token(audience)).successful is True
+    # Explicit opt-out
+    monkeypatch.setattr("app.helper.jwks_helper.settings", replace(settings, keycloak_verify_audience=False))
+    assert (await KeycloakHelper.validate_token(other_client)).successful is True
+
+
+@pytest.mark.asyncio
+async def test_validate_token_refetches_on_key_rotation(monkeypatch):
+    old_key, old_jwk = _signing_key("kid-old")
+    new_key, new_jwk = _signing_key("kid-new")
+    key_sets = [{"kid-old": old_jwk}, {"kid-old": old_jwk, "kid-new": new_jwk}]
+
+    async def _fetch_keys():
+        return key_sets.pop(0)
+    monkeypatch.setattr(JWKSHelper, "fetch_keys", _fetch_keys)
+    monkeypatch.setattr("app.helper.jwks_helper.settings", replace(settings, keycloak_jwks_min_refresh_interval=0))
+
+    assert (await KeycloakHelper.validate_token(_token(old_key, "kid-old"))).successful is True
+    assert (await KeycloakHelper.validate_token(_token(new_key, "kid-new"))).successful is True
+    assert key_sets == []
+
+
+@pytest.mark.asyncio
+async def test_validate_token_introspection_opt_in(monkeypatch):
+    async def _introspect(token):
+        return TokenValidationResponse(successful=True, username="introspected")
+    monkeypatch.setattr(KeycloakHelper, "introspect_token", _introspect)
+
+    result = await KeycloakHelper.validate_token("opaque", introspect=True)
+    assert result.username == "introspected"
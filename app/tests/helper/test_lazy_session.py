@@ -0,0 +1,65 @@
+import pytest
+import pytest_asyncio
+from prometheus_client import REGISTRY
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+import app.dependacy.pg_database as pg_database
+from app.dependacy.pg_database import LazySession, _create_engine, get_pg_db_connection
+from app.helper.user_profile_cache import UserProfileCache
+from app.model.user_profile import Base, UserProfile
+from app.repository.user_repo import UserRepository
+
+
+@pytest_asyncio.fixture
+async def engine(tmp_path):
+    engine = _create_engine(f"sqlite+aiosqlite:///{tmp_path}/lazy.db", "lazy-test")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(UserProfile.__table__.insert().values(username="luser1", first_name="L"))
+    yield engine
+    await engine.dispose()
+
+
+def _samples(name):
+    return REGISTRY.get_sample_value(f"{name}_count", {"pool": "lazy-test"}) or 0
+
+
+@pytest.mark.asyncio
+async def test_connection_is_checked_out_on_first_use_and_released_after_reads(engine):
+    session_maker = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    checkouts, holds = _samples("pg_pool_checkout_seconds"), _samples("pg_pool_hold_seconds")
+    db = LazySession(session_maker)
+    assert not db.opened and engine.sync_engine.pool.checkedout() == 0
+
+    assert (await db.execute(select(UserProfile.first_name))).scalar() == "L"
+    assert engine.sync_engine.pool.checkedout() == 1
+    await db.release()
+    assert engine.sync_engine.pool.checkedout() == 0
+    assert _samples("pg_pool_checkout_seconds") == checkouts + 1
+    assert _samples("pg_pool_hold_seconds") == holds + 1
+
+    # Still usable, and pending writes are never dropped by a release
+    db.add(UserProfile(username="luser2"))
+    await db.flush()
+    await db.release()
+    assert engine.sync_engine.pool.checkedout() == 1
+    await db.commit()
+    assert engine.sync_engine.pool.checkedout() == 0
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_request_sessions_are_lazy_and_released_by_the_repository(engine, monkeypatch):
+    monkeypatch.setattr(pg_database, "_async_session_maker", async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+    UserProfileCache.clear()
+    dependency = get_pg_db_connection()
+    db = await dependency.__anext__()
+    assert isinstance(db, LazySession) and not db.opened
+
+    user = await UserRepository.get_user_by_username("luser1", db)
+    assert user.first_name == "L"
+    assert engine.sync_engine.pool.checkedout() == 0
+    with pytest.raises(StopAsyncIteration):
+        await dependency.__anext__()
+    assert not db.opened
+    UserProfileCache.clear()
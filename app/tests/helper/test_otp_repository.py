@@ -0,0 +1,105 @@
+import asyncio
+import dataclasses
+import pytest
+import pytest_asyncio
+import fakeredis.aioredis as fakeredis_async
+from app.config.settings import settings
+from app.exception.exceptions import TooManyOTPAttemptsError
+from app.repository.otp_repo import OTPRepository
+from app.repository.totp_repo import TOTPRepository
+
+
+@pytest_asyncio.fixture
+async def redis():
+    db = fakeredis_async.FakeRedis(decode_responses=True)
+    yield db
+    await db.aclose()
+
+
+@pytest.mark.asyncio
+async def test_otps_live_in_one_hash_per_user_and_type(redis):
+    await OTPRepository.store_email_otp(redis, "alice", "a@example.com", "111111")
+    await OTPRepository.store_email_otp(redis, "alice", "b@example.com", "222222")
+    await OTPRepository.store_sms_otp(redis, "alice", "+97311111111", "333333")
+
+    assert sorted(await redis.keys("*")) == ["{alice}:otp:email", "{alice}:otp:mobile"]
+    assert 0 < await redis.ttl("{alice}:otp:email")
+    assert await redis.hgetall("{alice}:otp:email") == {"a@example.com": "111111", "b@example.com": "222222"}
+    assert await OTPRepository.user_has_existing_otp_by_otp_type(redis, "alice", "mobile") is True
+    assert await OTPRepository.user_has_existing_otp_by_otp_type(redis, "bob", "mobile") is False
+
+
+@pytest.mark.asyncio
+async def test_legacy_keys_are_migrated_with_their_ttl(redis):
+    await redis.set("alice:email:a@example.com", "111111", ex=100)
+    await redis.set("bob:mobile:+97311111111", "222222", ex=100)
+    await redis.set("unrelated", "value")
+    # Keys of other features and of the current layout are left alone
+    await redis.set("session:email:token", "value")
+    await redis.set("{carol}:mobile:+97322222222", "333333")
+    await OTPRepository.store_email_otp(redis, "carol", "c@example.com", "444444")
+
+    assert await OTPRepository.migrate_legacy_otp_keys(redis) == 2
+    assert await redis.exists("alice:email:a@example.com", "bob:mobile:+97311111111") == 0
+    assert await redis.hgetall("{alice}:otp:email") == {"a@example.com": "111111"}
+    assert await redis.hgetall("{bob}:otp:mobile") == {"+97311111111": "222222"}
+    assert 0 < await redis.ttl("{alice}:otp:email") <= 100
+    assert await redis.get("unrelated") == "value"
+    assert await redis.get("session:email:token") == "value"
+    assert await redis.get("{carol}:mobile:+97322222222") == "333333"
+    assert await redis.hgetall("{carol}:otp:email") == {"c@example.com": "444444"}
+
+
+@pytest.mark.asyncio
+async def test_verify_and_consume_returns_identifier_once(redis):
+    await OTPRepository.store_email_otp(redis, "alice", "a@example.com", "111111")
+    await OTPRepository.store_email_otp(redis, "alice", "b@example.com", "222222")
+
+    assert await OTPRepository.verify_and_consume_otp(redis, "alice", "22222", "email") is None
+    assert await OTPRepository.verify_and_consume_otp(redis, "alice", "222222", "email") == "b@example.com"
+    # Consumed otps cannot be replayed
+    assert await OTPRepository.verify_and_consume_otp(redis, "alice", "222222", "email") is None
+    assert await redis.hgetall("{alice}:otp:email") == {"a@example.com": "111111"}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_verifications_consume_the_otp_only_once(redis):
+    await OTPRepository.store_sms_otp(redis, "alice", "+97311111111", "333333")
+
+    results = await asyncio.gather(*(OTPRepository.verify_and_consume_otp(redis, "alice", "333333", "mobile") for _ in range(5)))
+    assert results.count("+97311111111") == 1
+    assert results.count(None) == 4
+
+
+@pytest.mark.asyncio
+async def test_too_many_attempts_discards_pending_otps(redis, monkeypatch):
+    monkeypatch.setattr("app.repository.otp_repo.settings", dataclasses.replace(settings, otp_max_attempts=2))
+    await OTPRepository.store_email_otp(redis, "alice", "a@example.com", "111111")
+
+    for _ in range(2):
+        assert await OTPRepository.verify_and_consume_otp(redis, "alice", "000000", "email") is None
+    with pytest.raises(TooManyOTPAttemptsError):
+        await OTPRepository.verify_and_consume_otp(redis, "alice", "111111", "email")
+    assert await OTPRepository.user_has_existing_otp_by_otp_type(redis, "alice", "email") is False
+
+    # A new otp comes with a fresh attempts budget
+    await OTPRepository.store_email_otp(redis, "alice", "a@example.com", "444444")
+    assert await OTPRepository.verify_and_consume_otp(redis, "alice", "444444", "email") == "a@example.com"
+
+
+@pytest.mark.asyncio
+async def test_reserve_otp_keeps_the_pending_otp(redis):
+    assert (await OTPRepository.reserve_otp(redis, "alice", "a@example.com", "111111", "email"))[0] is True
+    reserved, ttl = await OTPRepository.reserve_otp(redis, "alice", "b@example.com", "222222", "email")
+    assert reserved is False
+    assert 0 < ttl <= settings.redis_ttl
+    assert await redis.hgetall("{alice}:otp:email") == {"a@example.com": "111111"}
+    # Other otp types have their own slot
+    assert (await OTPRepository.reserve_otp(redis, "alice", "+97311111111", "333333", "mobile"))[0] is True
+
+
+@pytest.mark.asyncio
+async def test_reserve_totp_seed_returns_the_seed_waiting_for_confirmation(redis):
+    assert await TOTPRepository.reserve_totp_seed(redis, "alice", "SEEDONE") is None
+    assert await TOTPRepository.reserve_totp_seed(redis, "alice", "SEEDTWO") == "SEEDONE"
+    assert await TOTPRepository.get_totp_seed(redis, "alice") == "SEEDONE"
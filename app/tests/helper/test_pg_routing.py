@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+import pytest
+import pytest_asyncio
+from sqlalchemy import select, table, text, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+import app.dependacy.pg_database as pg_database
+from app.config.settings import settings
+from app.dependacy.pg_database import Replica, RoutingSession, execute_read, mark_written, pick_replica
+from app.model.user_profile import Base, UserProfile
+from app.repository.user_repo import UserRepository
+
+
+async def _database(first_name):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(UserProfile.__table__.insert().values(username="puser1", first_name=first_name))
+    return engine
+
+
+@pytest_asyncio.fixture
+async def routed(monkeypatch):
+    """Session maker routing between a primary and a replica holding different first names."""
+    primary, replica = await _database("primary"), await _database("replica")
+    monkeypatch.setattr(pg_database, "_replicas", [Replica("replica-1", replica)])
+    monkeypatch.setattr(pg_database, "_recent_writes", type(pg_database._recent_writes)(max_size=10, ttl=10))
+    yield async_sessionmaker(primary, expire_on_commit=False, class_=AsyncSession, sync_session_class=RoutingSession)
+    await primary.dispose()
+    await replica.dispose()
+
+
+async def _first_name(db, **options):
+    return (await db.execute(select(UserProfile.first_name).execution_options(**options))).scalar()
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_the_replica_and_writes_to_the_primary(routed):
+    async with routed() as db:
+        assert await _first_name(db) == "replica"
+        assert await _first_name(db, primary=True) == "primary"
+        await db.execute(update(UserProfile).values(last_name="written"))
+        # Read after write stays on the primary
+        assert await _first_name(db) == "primary"
+        await db.commit()
+    async with routed() as db:
+        assert await _first_name(db) == "replica"
+
+
+@pytest.mark.asyncio
+async def test_lagging_replicas_are_skipped(routed):
+    pg_database._replicas[0].set_state(healthy=True, lag=settings.pg_db_replica_max_lag + 1)
+    assert pick_replica() is None
+    async with routed() as db:
+        assert await _first_name(db) == "primary"
+    pg_database._replicas[0].set_state(healthy=True, lag=0)
+    async with routed() as db:
+        assert await _first_name(db) == "replica"
+
+
+@pytest.mark.asyncio
+async def test_failed_replica_reads_are_retried_on_the_primary(routed, monkeypatch):
+    broken = create_async_engine("sqlite+aiosqlite:///file:/nonexistent/replica.db?mode=ro&uri=true")
+    monkeypatch.setattr(pg_database, "_replicas", [Replica("broken", broken)])
+    async with routed() as db:
+        result = await execute_read(db, select(UserProfile.first_name))
+        assert result.scalar() == "primary"
+    assert not pg_database._replicas[0].available()
+    await broken.dispose()
+
+
+@pytest.mark.asyncio
+async def test_failed_reads_after_a_write_are_not_retried(routed):
+    async with routed() as db:
+        assert await _first_name(db) == "replica"
+        await db.execute(update(UserProfile).values(last_name="pending"))
+        # The read runs on the primary and fails there, a rollback would discard the pending write
+        with pytest.raises(DBAPIError):
+            await execute_read(db, select(text("*")).select_from(table("missing")))
+        assert pg_database._replicas[0].available()
+        assert (await db.execute(select(UserProfile.last_name))).scalar() == "pending"
+
+
+@pytest.mark.asyncio
+async def test_recently_written_profiles_are_read_from_the_primary(routed):
+    async with routed() as db:
+        assert (await UserRepository._select_user_by_username("puser1", db)).first_name == "replica"
+    mark_written("puser1")
+    async with routed() as db:
+        assert (await UserRepository._select_user_by_username("puser1", db)).first_name == "primary"
+
+
+def _engine_with_connections(checked_out):
+    return SimpleNamespace(sync_engine=SimpleNamespace(pool=SimpleNamespace(checkedout=lambda: checked_out)))
+
+
+def test_least_connections_picks_the_idlest_replica(monkeypatch):
+    monkeypatch.setattr(pg_database, "_replicas", [Replica("busy", _engine_with_connections(3)), Replica("idle", _engine_with_connections(1))])
+    monkeypatch.setattr(pg_database, "settings", type(settings)(**{**settings.__dict__, "pg_db_replica_balancing": "least-connections"}))
+    assert [pick_replica().name for _ in range(3)] == ["idle"] * 3
+    # Round robin otherwise
+    monkeypatch.setattr(pg_database, "settings", settings)
+    assert {pick_replica().name for _ in range(2)} == {"busy", "idle"}
@@ -0,0 +1,50 @@
+import os
+import pytest
+import pytest_asyncio
+import redis.asyncio as aioredis
+from redis.cluster import key_slot
+from app.repository.otp_repo import OTPRepository
+from app.repository.totp_repo import TOTPRepository
+
+# Start the local cluster with `docker compose -f docker-compose.redis-cluster.yml up -d`
+# and run with REDIS_CLUSTER_TEST_URL=redis://localhost:7001/0
+REDIS_CLUSTER_TEST_URL = os.getenv("REDIS_CLUSTER_TEST_URL")
+
+
+def test_keys_of_a_user_share_one_slot():
+    keys = [OTPRepository.otp_key("alice", "email"), OTPRepository.attempts_key("alice", "email"),
+            OTPRepository.otp_key("alice", "mobile"), OTPRepository.attempts_key("alice", "mobile"),
+            TOTPRepository.totp_key("alice")]
+    assert len({key_slot(key.encode()) for key in keys}) == 1
+
+
+@pytest_asyncio.fixture
+async def cluster():
+    if not REDIS_CLUSTER_TEST_URL:
+        pytest.skip("REDIS_CLUSTER_TEST_URL is not set")
+    db = aioredis.RedisCluster.from_url(REDIS_CLUSTER_TEST_URL, decode_responses=True)
+    await db.initialize()
+    usernames = [f"cluster-user-{index}" for index in range(20)]
+    yield db, usernames
+    for username in usernames:
+        await db.delete(OTPRepository.otp_key(username, "email"), OTPRepository.attempts_key(username, "email"))
+        await db.delete(TOTPRepository.totp_key(username))
+    await db.aclose()
+
+
+@pytest.mark.asyncio
+async def test_otp_scripts_run_across_the_cluster(cluster):
+    db, usernames = cluster
+    # Enough users to spread the keys over every node
+    for username in usernames:
+        assert (await OTPRepository.reserve_otp(db, username, f"{username}@example.com", "123456", "email"))[0] is True
+        assert await OTPRepository.user_has_existing_otp_by_otp_type(db, username, "email") is True
+        assert await OTPRepository.verify_and_consume_otp(db, username, "000000", "email") is None
+        assert await OTPRepository.verify_and_consume_otp(db, username, "123456", "email") == f"{username}@example.com"
+
+
+@pytest.mark.asyncio
+async def test_totp_reservation_on_the_cluster(cluster):
+    db, usernames = cluster
+    assert await TOTPRepository.reserve_totp_seed(db, usernames[0], "SEEDONE") is None
+    assert await TOTPRepository.reserve_totp_seed(db, usernames[0], "SEEDTWO") == "SEEDONE"
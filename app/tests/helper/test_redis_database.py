@@ -0,0 +1,51 @@
+import dataclasses
+import pytest
+import fakeredis.aioredis as fakeredis_async
+import app.dependacy.redis_database as redis_database
+# Bound at collection time, the client fixture swaps the module functions for fakeredis placeholders
+from app.dependacy.redis_database import create_redis_db_pool, close_redis_db_pool
+from app.config.settings import settings
+from app.repository.totp_repo import TOTPRepository
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    primary = fakeredis_async.FakeRedis(decode_responses=True)
+    replica = fakeredis_async.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_database, "redis_pool", primary)
+    monkeypatch.setattr(redis_database, "redis_replica_pool", replica)
+    return primary, replica
+
+
+@pytest.mark.asyncio
+async def test_only_stale_tolerant_reads_go_to_the_replica(replica):
+    primary, replica = replica
+    await primary.set("{alice}:totp", "PRIMARY")
+    await replica.set("{alice}:totp", "REPLICA")
+
+    assert await TOTPRepository.get_totp_seed(primary, "alice") == "PRIMARY"
+    assert await TOTPRepository.get_totp_seed(primary, "alice", allow_stale=True) == "REPLICA"
+    # Clients that are not the shared pool (e.g. a test override) are used as they are
+    other = fakeredis_async.FakeRedis(decode_responses=True)
+    assert redis_database.redis_reader(other, allow_stale=True) is other
+
+
+@pytest.mark.asyncio
+async def test_sentinel_mode_builds_primary_and_replica_clients(monkeypatch):
+    monkeypatch.setattr(redis_database, "settings", dataclasses.replace(
+        settings, redis_url="redis://:secret@localhost:6379/2", redis_sentinels="sentinel-1:26379, sentinel-2:26379",
+        redis_read_from_replicas=True, redis_socket_timeout=0.5))
+    monkeypatch.setattr(redis_database, "redis_pool", None)
+    monkeypatch.setattr(redis_database, "redis_replica_pool", None)
+
+    # Clients connect lazily, nothing is contacted here
+    await create_redis_db_pool()
+    primary, replica = redis_database.redis_pool, redis_database.redis_replica_pool
+    assert primary.connection_pool.is_master and not replica.connection_pool.is_master
+    assert [(s.connection_pool.connection_kwargs["host"], s.connection_pool.connection_kwargs["port"])
+            for s in primary.connection_pool.sentinel_manager.sentinels] == [("sentinel-1", 26379), ("sentinel-2", 26379)]
+    assert primary.connection_pool.connection_kwargs["db"] == 2
+    assert primary.connection_pool.connection_kwargs["password"] == "secret"
+    assert primary.connection_pool.connection_kwargs["socket_timeout"] == 0.5
+    await close_redis_db_pool()
+    assert redis_database.redis_replica_pool is None
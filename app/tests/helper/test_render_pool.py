@@ -0,0 +1,66 @@
+import asyncio
+import base64
+import dataclasses
+import threading
+import pytest
+import pytest_asyncio
+import app.dependacy.render_pool as render_pool
+from app.config.settings import settings
+from app.helper.metrics import QR_RENDER_QUEUE_DEPTH, QR_RENDER_SECONDS
+from app.helper.totp_helper import TOTPHelper
+
+
+@pytest_asyncio.fixture
+async def fresh_pool():
+    await render_pool.close_render_pool()
+    yield render_pool
+    await render_pool.close_render_pool()
+
+
+@pytest.mark.asyncio
+async def test_qr_rendering_runs_off_the_event_loop(fresh_pool, monkeypatch):
+    loop_thread = threading.get_ident()
+    render_threads = []
+    render = TOTPHelper.generate_seed_uri_image
+
+    def _tracked(*args):
+        render_threads.append(threading.get_ident())
+        return render(*args)
+
+    monkeypatch.setattr(TOTPHelper, "generate_seed_uri_image", _tracked)
+    renders_before = QR_RENDER_SECONDS._sum.get()
+
+    image = await TOTPHelper.render_seed_uri_image(TOTPHelper.generate_seed(), "alice")
+    assert base64.b64decode(image.qrcode).startswith(b"\x89PNG")
+    assert "alice" in image.seed_uri
+    assert render_threads and loop_thread not in render_threads
+    assert QR_RENDER_SECONDS._sum.get() > renders_before
+    assert QR_RENDER_QUEUE_DEPTH._value.get() == 0
+
+
+@pytest.mark.asyncio
+async def test_pending_renders_are_bounded(fresh_pool, monkeypatch):
+    monkeypatch.setattr(render_pool, "settings", dataclasses.replace(settings, qr_render_workers=4, qr_render_max_pending=2))
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def _slow(value):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        threading.Event().wait(0.02)
+        with lock:
+            running -= 1
+        return value
+
+    results = await asyncio.gather(*(render_pool.run_in_render_pool(_slow, index) for index in range(6)))
+    assert results == list(range(6))
+    assert peak <= 2
+
+
+@pytest.mark.asyncio
+async def test_process_pool_renders_qr_codes(fresh_pool, monkeypatch):
+    monkeypatch.setattr(render_pool, "settings", dataclasses.replace(settings, qr_render_executor="process", qr_render_workers=1))
+    image = await TOTPHelper.render_seed_uri_image(TOTPHelper.generate_seed(), "bob")
+    assert base64.b64decode(image.qrcode).startswith(b"\x89PNG")
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from app.helper.single_flight import SingleFlight
+from app.helper.keycloak_helper import KeycloakHelper
+from app.schema.token import TokenGenerationResponse
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_result():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def _call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return object()
+
+    results = await asyncio.gather(*(flight.do("key", _call) for _ in range(10)))
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    # Nothing is cached once the call finished
+    await flight.do("key", _call)
+    assert len(calls) == 2
+    assert len(flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_different_keys_and_errors_are_not_shared():
+    flight = SingleFlight("test")
+
+    async def _fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def _ok():
+        return "ok"
+
+    results = await asyncio.gather(flight.do("a", _fail), flight.do("a", _fail), flight.do("b", _ok), return_exceptions=True)
+    assert isinstance(results[0], ValueError) and results[0] is results[1]
+    assert results[2] == "ok"
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_call():
+    flight = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def _call():
+        await release.wait()
+        return "done"
+
+    leader = asyncio.create_task(flight.do("key", _call))
+    follower = asyncio.create_task(flight.do("key", _call))
+    await asyncio.sleep(0)
+    leader.cancel()
+    release.set()
+    assert await follower == "done"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_logins_share_one_password_grant(monkeypatch):
+    grants = []
+
+    async def _request_token(username, password):
+        grants.append(username)
+        await asyncio.sleep(0.01)
+        return TokenGenerationResponse(successful=True, token="abc", token_type="Bearer", token_expires_in=300)
+
+    monkeypatch.setattr(KeycloakHelper, "_request_token", _request_token)
+    tokens = await asyncio.gather(*(KeycloakHelper.generat_token("alice", "secret") for _ in range(5)),
+                                  KeycloakHelper.generat_token("alice", "other"))
+    assert all(token.successful for token in tokens)
+    assert grants == ["alice", "alice"]
@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+import pytest_asyncio
+import fakeredis.aioredis as fakeredis_async
+from app.repository.otp_repo import OTPRepository
+from app.repository.totp_repo import TOTPRepository
+from app.schema.totp import SeedFullInfo, QRCodeFormat
+from app.repository.state_backend import InMemoryStateBackend, RedisStateBackend, as_state_backend
+
+
+@pytest_asyncio.fixture(params=["memory", "redis"])
+async def backend(request):
+    if request.param == "memory":
+        yield InMemoryStateBackend()
+        return
+    redis = fakeredis_async.FakeRedis(decode_responses=True)
+    yield as_state_backend(redis)
+    await redis.aclose()
+
+
+@pytest.mark.asyncio
+async def test_otp_flow_behaves_the_same_on_every_backend(backend):
+    assert (await OTPRepository.reserve_otp(backend, "alice", "a@example.com", "111111", "email"))[0] is True
+    assert (await OTPRepository.reserve_otp(backend, "alice", "b@example.com", "222222", "email"))[0] is False
+    assert await OTPRepository.user_has_existing_otp_by_otp_type(backend, "alice", "email") is True
+    assert await backend.hash_get_all(OTPRepository.otp_key("alice", "email")) == {"a@example.com": "111111"}
+
+    results = await asyncio.gather(*(OTPRepository.verify_and_consume_otp(backend, "alice", "111111", "email") for _ in range(3)))
+    assert results.count("a@example.com") == 1
+    # The hash is gone with its last otp
+    assert await OTPRepository.user_has_existing_otp_by_otp_type(backend, "alice", "email") is False
+
+
+@pytest.mark.asyncio
+async def test_attempts_are_limited_on_every_backend(backend):
+    await OTPRepository.store_sms_otp(backend, "bob", "+97311111111", "333333")
+    status, _ = await backend.hash_consume(OTPRepository.otp_key("bob", "mobile"), "000000",
+                                           OTPRepository.attempts_key("bob", "mobile"), 1, 60)
+    assert status == "mismatch"
+    status, _ = await backend.hash_consume(OTPRepository.otp_key("bob", "mobile"), "333333",
+                                           OTPRepository.attempts_key("bob", "mobile"), 1, 60)
+    assert status == "locked"
+    assert await backend.exists(OTPRepository.otp_key("bob", "mobile")) is False
+
+
+@pytest.mark.asyncio
+async def test_totp_reservation_on_every_backend(backend):
+    assert await TOTPRepository.reserve_totp_seed(backend, "alice", "SEEDONE") is None
+    assert await TOTPRepository.reserve_totp_seed(backend, "alice", "SEEDTWO") == "SEEDONE"
+    assert await TOTPRepository.get_totp_seed(backend, "alice") == "SEEDONE"
+    assert 0 < await backend.ttl(TOTPRepository.totp_key("alice"))
+    await TOTPRepository.delete_totp_seed(backend, "alice")
+    assert await TOTPRepository.get_totp_seed(backend, "alice") is None
+    assert await backend.ttl(TOTPRepository.totp_key("alice")) == -2
+
+
+@pytest.mark.asyncio
+async def test_enrollments_of_a_replaced_seed_are_not_served(backend):
+    def enrollment(seed):
+        return SeedFullInfo(seed=seed, user_name="alice", seed_uri=f"otpauth://totp/alice?secret={seed}", qrcode_format=QRCodeFormat.URI_ONLY)
+
+    assert await TOTPRepository.reserve_totp_seed(backend, "alice", "OLDSEED") is None
+    await TOTPRepository.replace_totp_seed(backend, "alice", "NEWSEED")
+    # A request that was still rendering the old seed stores its enrollment late
+    assert not await TOTPRepository.store_totp_enrollment(backend, "alice", enrollment("OLDSEED"))
+    assert await TOTPRepository.get_totp_enrollment(backend, "alice", QRCodeFormat.URI_ONLY) is None
+
+    assert await TOTPRepository.store_totp_enrollment(backend, "alice", enrollment("NEWSEED"))
+    assert (await TOTPRepository.get_totp_enrollment(backend, "alice", QRCodeFormat.URI_ONLY)).seed == "NEWSEED"
+    # The enrollment expires with its seed and goes away with the next one
+    assert await backend.ttl(TOTPRepository.enrollment_key("alice")) == await backend.ttl(TOTPRepository.totp_key("alice"))
+    await TOTPRepository.replace_totp_seed(backend, "alice", "NEXTSEED")
+    assert await TOTPRepository.get_totp_enrollment(backend, "alice", QRCodeFormat.URI_ONLY) is None
+
+    # Nothing is stored for a seed that was confirmed meanwhile
+    await TOTPRepository.delete_totp_seed(backend, "alice")
+    assert not await TOTPRepository.store_totp_enrollment(backend, "alice", enrollment("NEXTSEED"))
+    assert await backend.ttl(TOTPRepository.enrollment_key("alice")) == -2
+
+
+@pytest.mark.asyncio
+async def test_sliding_windows_on_every_backend(backend):
+    assert [await backend.sliding_window_hit("rate:test", 2, 60000) for _ in range(2)] == [0, 0]
+    retry_in = await backend.sliding_window_hit("rate:test", 2, 60000)
+    assert 0 < retry_in <= 60000
+    assert await backend.sliding_window_hit("rate:other", 2, 60000) == 0
+    # Requests leave the window once it elapsed
+    assert await backend.sliding_window_hit("rate:short", 1, 50) == 0
+    await asyncio.sleep(0.06)
+    assert await backend.sliding_window_hit("rate:short", 1, 50) == 0
+
+
+@pytest.mark.asyncio
+async def test_in_memory_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.repository.state_backend.time.monotonic", lambda: now[0])
+    backend = InMemoryStateBackend()
+    await backend.set("short", "a", 10)
+    await backend.set("long", "b", 100)
+    await backend.hash_store("hash", "field", "c", 10)
+    # Re-arming the ttl leaves a stale heap item behind that must not expire the key early
+    await backend.hash_store("hash", "other", "d", 50)
+
+    now[0] += 20
+    assert await backend.get("short") is None
+    assert await backend.get("long") == "b"
+    assert await backend.hash_get_all("hash") == {"field": "c", "other": "d"}
+    assert len(backend) == 2
+
+    now[0] += 100
+    assert len(backend) == 0
+
+
+def test_redis_backends_are_shared_per_client():
+    redis = fakeredis_async.FakeRedis(decode_responses=True)
+    backend = as_state_backend(redis)
+    assert isinstance(backend, RedisStateBackend)
+    assert as_state_backend(redis) is backend
+    assert as_state_backend(backend) is backend
@@ -0,0 +1,58 @@
+import time
+import pyotp
+import pytest
+import app.helper.totp_verifier as totp_verifier
+from app.helper.totp_helper import TOTPHelper
+from app.helper.totp_verifier import TOTPVerifier
+
+NOW = 1_700_000_000
+
+
+def test_codes_match_pyotp_and_drift_window():
+    seed = pyotp.random_base32()
+    key = TOTPVerifier.decode_key(seed)
+    totp = pyotp.TOTP(seed)
+    for offset in range(0, 600, 7):
+        assert TOTPVerifier.hotp(key, (NOW + offset) // 30) == totp.at(NOW + offset)
+
+    assert TOTPVerifier.verify(key, totp.at(NOW), for_time=NOW)
+    # One step either way is accepted with a window of 1, two are not
+    assert TOTPVerifier.verify(key, totp.at(NOW - 30), for_time=NOW, window=1)
+    assert TOTPVerifier.verify(key, totp.at(NOW + 30), for_time=NOW, window=1)
+    assert not TOTPVerifier.verify(key, totp.at(NOW - 60), for_time=NOW, window=1)
+    assert not TOTPVerifier.verify(key, totp.at(NOW - 30), for_time=NOW, window=0)
+
+
+@pytest.mark.parametrize("code", ["", "12345", "1234567", "abcdef", "١٢٣٤٥٦"])
+def test_malformed_codes_are_rejected(code):
+    assert not TOTPVerifier.verify(TOTPVerifier.decode_key(pyotp.random_base32()), code, for_time=NOW)
+
+
+def test_unpadded_and_lowercase_seeds_decode_like_pyotp():
+    seed = pyotp.random_base32(length=36)
+    assert TOTPVerifier.decode_key(seed.lower()) == pyotp.TOTP(seed).byte_secret()
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_batch_matches_single_verification(vectorized, monkeypatch):
+    if vectorized:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(totp_verifier, "np", None)
+    seeds = [pyotp.random_base32() for _ in range(40)]
+    codes = [pyotp.TOTP(seed).at(NOW + 30 * (index % 5 - 2)) for index, seed in enumerate(seeds)]
+    codes[3] = "12345"
+    codes[4] = "abcdef"
+    pairs = [(TOTPVerifier.decode_key(seed), code) for seed, code in zip(seeds, codes)]
+
+    results = TOTPVerifier.verify_batch(pairs, for_time=NOW, window=1)
+    assert results == [TOTPVerifier.verify(key, code, for_time=NOW, window=1) for key, code in pairs]
+    assert results.count(True) == 23
+
+
+def test_helper_accepts_the_previous_step():
+    seed = pyotp.random_base32()
+    totp = pyotp.TOTP(seed)
+    assert TOTPHelper.verify_totp(seed, totp.now())
+    assert TOTPHelper.verify_totp(seed, totp.at(time.time() - 30))
+
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime
+import pytest
+import fakeredis.aioredis as fakeredis_async
+from sqlalchemy import event
+import app.dependacy.redis_database as redis_database
+from app.dependacy.authenticate_user import AuthenticateUser
+from app.dependacy.profile_cache_listener import listen_for_invalidations
+from app.helper.user_profile_cache import UserProfileCache, UserProfileSnapshot
+from app.main import app
+from app.model.user_profile import UserProfile
+from app.repository.user_repo import UserRepository
+from app.schema.token import TokenValidationResponse
+
+
+def test_snapshot_round_trips_as_a_compact_array():
+    profile = UserProfile(id=7, username="cuser0", first_name="C", mobile_number="+97390000020", is_mobile_number_verified=True,
+                          created_at=datetime(2025, 1, 2, 3, 4, 5))
+    snapshot = UserProfileSnapshot.loads(UserProfileSnapshot.from_profile(profile).dumps())
+    assert snapshot.dumps().startswith('[7,"cuser0","C",')
+    restored = snapshot.to_profile()
+    assert (restored.id, restored.username, restored.mobile_number, restored.created_at) == (7, "cuser0", "+97390000020", datetime(2025, 1, 2, 3, 4, 5))
+    assert not hasattr(snapshot, "__dict__")
+    # Secrets never reach the cache
+    assert not hasattr(UserProfileSnapshot.from_profile(UserProfile(username="cuser0", totp_secret_encrypted="c2VlZA==")), "totp_secret_encrypted")
+    with pytest.raises(AttributeError):
+        snapshot.username = "other"
+
+
+@pytest.mark.asyncio
+async def test_profiles_are_served_from_the_cache_and_invalidated_on_write(client, db_session, db_engine, monkeypatch):
+    db_session.add(UserProfile(username="cuser1", first_name="C", last_name="One", email_address="c1@example.com", is_email_address_verified=False))
+    await db_session.commit()
+
+    async def _auth():
+        return TokenValidationResponse(successful=True, username="cuser1")
+    monkeypatch.setitem(app.dependency_overrides, AuthenticateUser.get_logged_in_user, _auth)
+    if redis_database.redis_pool is None:
+        await redis_database.create_redis_db_pool()
+    queries = []
+    event.listen(db_engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+
+    assert (await client.get("/user")).json()["email"] == "c1@example.com"
+    assert len(queries) == 1
+    assert (await client.get("/user")).json()["email"] == "c1@example.com"
+    # Another worker starts with an empty local tier and reads the shared one
+    UserProfileCache.clear()
+    assert (await client.get("/user")).json()["email"] == "c1@example.com"
+    assert len(queries) == 1
+
+    await UserRepository.update_user_email("cuser1", "c1-new@example.com", db_session)
+    assert await redis_database.redis_pool.get(UserProfileCache.profile_key("cuser1")) is None
+    body = (await client.get("/user")).json()
+    assert (body["email"], body["email_verified"]) == ("c1-new@example.com", True)
+
+
+@pytest.mark.asyncio
+async def test_other_workers_evict_published_profiles():
+    redis = fakeredis_async.FakeRedis()
+    listener = asyncio.create_task(listen_for_invalidations(redis))
+    try:
+        # Wait for the subscription, it starts from an empty local tier
+        while not (await redis.pubsub_numsub(UserProfileCache.CHANNEL))[0][1]:
+            await asyncio.sleep(0.01)
+        UserProfileCache._local.set("cuser2", UserProfileSnapshot.from_profile(UserProfile(username="cuser2")))
+        UserProfileCache._local.set("cuser3", UserProfileSnapshot.from_profile(UserProfile(username="cuser3")))
+        await redis.publish(UserProfileCache.CHANNEL, "cuser2")
+        while "cuser2" in UserProfileCache._local:
+            await asyncio.sleep(0.01)
+        assert "cuser3" in UserProfileCache._local
+    finally:
+        listener.cancel()
+        UserProfileCache.clear()
+        await redis.aclose()
+
+
+@pytest.mark.asyncio
+async def test_loads_started_before_an_invalidation_are_not_cached(client):
+    if redis_database.redis_pool is None:
+        await redis_database.create_redis_db_pool()
+    redis = redis_database.redis_pool
+    stale = UserProfileSnapshot.from_profile(UserProfile(id=5, username="cuser4", first_name="Before"))
+
+    # Invalidated by this worker while the row was being read
+    token = await UserProfileCache.load_token("cuser4")
+    await UserProfileCache.invalidate("cuser4")
+    await UserProfileCache.set(stale, token)
+    assert "cuser4" not in UserProfileCache._local
+    assert await redis.get(UserProfileCache.profile_key("cuser4")) is None
+
+    # Invalidated by another worker, its message has not arrived yet
+    token = await UserProfileCache.load_token("cuser4")
+    await redis.incr(UserProfileCache.generation_key("cuser4"))
+    await UserProfileCache.set(stale, token)
+    assert await redis.get(UserProfileCache.profile_key("cuser4")) is None
+
+    token = await UserProfileCache.load_token("cuser4")
+    await UserProfileCache.set(stale, token)
+    assert UserProfileSnapshot.loads(await redis.get(UserProfileCache.profile_key("cuser4"))).first_name == "Before"
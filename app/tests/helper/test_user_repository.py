@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from app.dependacy.pg_database import LazySession
+from app.model.user_profile import UserProfile
+from app.repository.user_repo import UserRepository
+from app.helper.user_profile_cache import UserProfileCache, UserProfileSnapshot
+
+
+@pytest.fixture
+def statements(db_engine):
+    """SQL statements sent to the database, commits included."""
+    sent = []
+
+    def _execute(conn, cursor, statement, *args):
+        sent.append(statement.split()[0].upper())
+
+    def _commit(conn):
+        sent.append("COMMIT")
+    event.listen(db_engine.sync_engine, "before_cursor_execute", _execute)
+    event.listen(db_engine.sync_engine, "commit", _commit)
+    yield sent
+    event.remove(db_engine.sync_engine, "before_cursor_execute", _execute)
+    event.remove(db_engine.sync_engine, "commit", _commit)
+
+
+@pytest.mark.asyncio
+async def test_create_and_updates_take_one_statement_each(db_session, statements):
+    created = await UserRepository.create_new_user(UserProfile(username="ruser1", first_name="R"), db_session)
+    assert created.id is not None and created.created_at is not None
+    assert statements == ["INSERT", "COMMIT"]
+
+    statements.clear()
+    updated = await UserRepository.update_user_email("ruser1", "r1@example.com", db_session)
+    assert statements == ["UPDATE", "COMMIT"]
+    assert updated.email_address == "r1@example.com" and updated.is_email_address_verified is True
+
+    statements.clear()
+    updated = await UserRepository.update_user_mobile("ruser1", "+97390000011", db_session)
+    updated = await UserRepository.update_user_totp("ruser1", "c2VlZA==", db_session)
+    assert statements == ["UPDATE", "COMMIT", "UPDATE", "COMMIT"]
+    assert (updated.mobile_number, updated.totp_secret_encrypted, updated.is_totp_verified) == ("+97390000011", "c2VlZA==", True)
+
+
+@pytest.mark.asyncio
+async def test_update_syncs_loaded_profiles_and_misses_unknown_users(db_session):
+    loaded = await UserRepository.create_new_user(UserProfile(username="ruser2"), db_session)
+    await UserRepository.update_user_mobile("ruser2", "+97390000012", db_session)
+    # The profile already in the session reflects the update
+    assert loaded.mobile_number == "+97390000012" and loaded.is_mobile_number_verified is True
+
+    assert await UserRepository.update_user_totp("nobody", "c2VlZA==", db_session) is None
+
+
+@pytest.mark.asyncio
+async def test_lookup_returns_a_detached_snapshot(db_session, statements):
+    await UserRepository.create_new_user(UserProfile(username="ruser3", first_name="R", mobile_number="+97390000013"), db_session)
+    db_session.expunge_all()
+
+    statements.clear()
+    user = await UserRepository.get_user_by_username("ruser3", db_session)
+    assert statements == ["SELECT"]
+    assert isinstance(user, UserProfileSnapshot) and not hasattr(user, "__dict__")
+    assert (user.username, user.first_name, user.mobile_number) == ("ruser3", "R", "+97390000013")
+    # Core rows do not populate the identity map
+    assert len(db_session.identity_map) == 0
+    with pytest.raises(AttributeError):
+        user.first_name = "X"
+
+    assert await UserRepository.get_user_by_username("nobody", db_session) is None
+
+
+@pytest.mark.asyncio
+async def test_coalesced_lookup_survives_the_request_that_started_it(db_engine, db_session):
+    await UserRepository.create_new_user(UserProfile(username="ruser4", first_name="R"), db_session)
+    UserProfileCache.clear()
+    session_maker = async_sessionmaker(db_engine, expire_on_commit=False, class_=AsyncSession)
+    leader, waiter = LazySession(session_maker), LazySession(session_maker)
+
+    leading = asyncio.ensure_future(UserRepository.get_user_by_username("ruser4", leader))
+    waiting = asyncio.ensure_future(UserRepository.get_user_by_username("ruser4", waiter))
+    await asyncio.sleep(0)
+    assert len(UserRepository._user_flight) == 1
+    leading.cancel()
+    await leader.close()
+
+    assert (await waiting).first_name == "R"
+    # The shared lookup ran on a session of its own
+    assert not leader.opened and not waiter.opened
+    UserProfileCache.clear()
@@ -0,0 +1,92 @@
+import dataclasses
+import pytest
+from app.config.settings import settings
+import app.dependacy.redis_database as redis_database
+from app.schema.token import TokenValidationResponse
+from app.model.user_profile import UserProfile
+from app.helper.auth_cache import AuthCache
+
+
+@pytest.mark.asyncio
+async def test_repeated_basic_auth_uses_cached_login(client, db_session, keycloak_calls):
+    db_session.add(UserProfile(username="cached", first_name="Ca", last_name="Ched"))
+    await db_session.commit()
+
+    for _ in range(3):
+        response = await client.get("/user", auth=("cached", "secret"))
+        assert response.status_code == 200
+        assert response.json()["username"] == "cached"
+
+    assert keycloak_calls == {"generate": 1, "validate": 1}
+
+
+@pytest.mark.asyncio
+async def test_wrong_password_is_not_served_from_cache(client, keycloak_calls):
+    assert (await client.get("/user", auth=("cached2", "secret"))).status_code == 200
+    assert (await client.get("/user", auth=("cached2", "wrong"))).status_code == 401
+    assert (await client.get("/user", auth=("cached2", "wrong"))).status_code == 401
+    # Failed logins are never cached
+    assert keycloak_calls["generate"] == 3
+
+
+@pytest.mark.asyncio
+async def test_invalidate_user_forces_new_login(client, keycloak_calls):
+    assert (await client.get("/user", auth=("cached4", "secret"))).status_code == 200
+    await AuthCache.invalidate_user("cached4")
+    assert (await client.get("/user", auth=("cached4", "secret"))).status_code == 200
+    assert keycloak_calls["generate"] == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate_user_reaches_logins_shared_through_redis(client, keycloak_calls, monkeypatch):
+    monkeypatch.setattr("app.helper.auth_cache.settings", dataclasses.replace(settings, auth_cache_redis=True, auth_cache_secret="shared"))
+    await redis_database.create_redis_db_pool()
+    assert (await client.get("/user", auth=("cached5", "secret"))).status_code == 200
+    # Another worker is served from Redis
+    AuthCache.clear()
+    assert (await client.get("/user", auth=("cached5", "secret"))).status_code == 200
+    assert keycloak_calls["generate"] == 1
+
+    await AuthCache.invalidate_user("cached5")
+    # Logins still cached by other workers are stamped with the previous generation
+    AuthCache.clear()
+    assert (await client.get("/user", auth=("cached5", "secret"))).status_code == 200
+    assert keycloak_calls["generate"] == 2
+    assert 0 < await redis_database.redis_pool.ttl("auth-cache:v3:{cached5}:generation")
+
+
+@pytest.mark.asyncio
+async def test_shared_tier_keeps_the_token_claims(client, monkeypatch):
+    monkeypatch.setattr("app.helper.auth_cache.settings", dataclasses.replace(settings, auth_cache_redis=True, auth_cache_secret="shared"))
+    await redis_database.create_redis_db_pool()
+    claims = {"preferred_username": "cached3", "given_name": "Ca", "email": "cached3@example.com"}
+    digest = await AuthCache.digest("cached3", "secret")
+    await AuthCache.set(digest, TokenValidationResponse(successful=True, username="cached3", claims=claims), 300)
+
+    # Another worker only has the Redis tier
+    AuthCache.clear()
+    cached = await AuthCache.get("cached3", digest)
+    assert (cached.username, cached.claims) == ("cached3", claims)
+    assert AuthCache._local.get(digest) == cached
+
+
+@pytest.mark.asyncio
+async def test_bearer_token_skips_token_generation(client, db_session, keycloak_calls):
+    db_session.add(UserProfile(username="bearer", first_name="Be", last_name="Arer"))
+    await db_session.commit()
+
+    response = await client.get("/user", headers={"Authorization": "Bearer token-bearer"})
+    assert response.status_code == 200
+    assert response.json()["username"] == "bearer"
+    assert keycloak_calls == {"generate": 0, "validate": 1}
+
+
+@pytest.mark.asyncio
+async def test_invalid_bearer_token_is_rejected(client, monkeypatch):
+    async def _validate(token, introspect=False):
+        return TokenValidationResponse(successful=False, username=None)
+    monkeypatch.setattr("app.dependacy.authenticate_user.KeycloakHelper.validate_token", _validate)
+
+    response = await client.get("/user", headers={"Authorization": "Bearer forged"})
+    assert response.status_code == 401
+    assert response.headers["www-authenticate"] == "Bearer"
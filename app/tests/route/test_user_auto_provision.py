@@ -0,0 +1,59 @@
+import dataclasses
+import pytest
+from sqlalchemy import select, func
+from app.config.settings import settings
+from app.schema.token import TokenValidationResponse
+from app.dependacy.authenticate_user import AuthenticateUser
+from app.model.user_profile import UserProfile
+from app.main import app
+
+
+CLAIMS = {"sub": "kc-1", "preferred_username": "noor", "given_name": "Noor", "family_name": "Ali",
+          "email": "noor@example.com", "email_verified": True, "mobile": "+97333333333", "mobileVerified": "true"}
+
+
+@pytest.fixture
+def auto_provision(monkeypatch):
+    monkeypatch.setattr("app.dependacy.authenticate_user.settings", dataclasses.replace(settings, auto_provision_user_profile=True))
+
+    async def _override_auth():
+        return TokenValidationResponse(successful=True, username="noor", claims=CLAIMS)
+
+    monkeypatch.setitem(app.dependency_overrides, AuthenticateUser.get_logged_in_user, _override_auth)
+
+
+@pytest.mark.asyncio
+async def test_first_request_provisions_profile_from_claims(client, db_session, auto_provision):
+    for _ in range(3):
+        response = await client.get("/user")
+        assert response.status_code == 200
+        assert response.json()["username"] == "noor"
+
+    profile = (await db_session.execute(select(UserProfile).where(UserProfile.username == "noor"))).scalar_one()
+    assert profile.email_address == "noor@example.com"
+    assert profile.is_email_address_verified is True
+    assert profile.mobile_number == "+97333333333"
+    assert profile.is_mobile_number_verified is True
+
+
+@pytest.mark.asyncio
+async def test_existing_profile_is_left_untouched(client, db_session, auto_provision):
+    db_session.add(UserProfile(username="noor", first_name="Existing", last_name="Profile"))
+    await db_session.commit()
+
+    response = await client.get("/user")
+    assert response.status_code == 200
+    assert response.json()["first_name"] == "Existing"
+    count = await db_session.scalar(select(func.count()).select_from(UserProfile).where(UserProfile.username == "noor"))
+    assert count == 1
+
+
+@pytest.mark.asyncio
+async def test_profiles_are_not_provisioned_by_default(client, monkeypatch):
+    async def _override_auth():
+        return TokenValidationResponse(successful=True, username="noor", claims=CLAIMS)
+
+    monkeypatch.setitem(app.dependency_overrides, AuthenticateUser.get_logged_in_user, _override_auth)
+    response = await client.get("/user")
+    assert response.status_code == 200
+    assert response.json()["username"] is None
@@ -1,6 +1,8 @@
+import base64
 import pytest
 from app.schema.token import TokenValidationResponse
 from app.helper.totp_helper import TOTPHelper
+from app.schema.totp import QRCodeFormat
 from app.repository.totp_repo import TOTPRepository
 from app.model.user_profile import UserProfile
 import app.dependacy.redis_database as rdb
@@ -132,3 +134,83 @@ async def test_existing_verified_seed_invalid_totp(client, db_session, monkeypat
     assert resp.status_code == 200
     body = resp.json()
     assert body["successful"] is False
+
+
+@pytest.mark.asyncio
+async def test_generate_totp_formats_and_qrcode_endpoint(client, db_session, monkeypatch):
+    user = UserProfile(username="guser4", first_name="G", last_name="Four", mobile_number="+97390000004", is_mobile_number_verified=False, email_address="g4@example.com", is_email_address_verified=False)
+    db_session.add(user)
+    await db_session.commit()
+
+    async def _auth():
+        return TokenValidationResponse(successful=True, username="guser4")
+    monkeypatch.setitem(app.dependency_overrides, AuthenticateUser.get_logged_in_user, _auth)
+
+    # No pending seed yet
+    assert (await client.get("/user/totp-qrcode")).status_code == 404
+
+    resp = await client.post("/user/generate-totp", params={"format": "uri-only"})
+    data = resp.json()["data"]
+    assert data["qrcode"] is None and data["qrcode_format"] == "uri-only"
+    assert data["seed"] in data["seed_uri"]
+
+    png = await client.get("/user/totp-qrcode")
+    assert png.status_code == 200
+    assert png.headers["content-type"] == "image/png"
+    assert png.headers["cache-control"] == "no-store"
+    assert png.content.startswith(b"\x89PNG")
+
+    svg = await client.get("/user/totp-qrcode", params={"format": "svg"})
+    assert svg.headers["content-type"].startswith("image/svg+xml")
+    assert b"<svg" in svg.content
+    assert (await client.get("/user/totp-qrcode", params={"format": "uri-only"})).status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_svg_format_is_returned_as_markup():
+    info = TOTPHelper.generate_seed_uri_image(TOTPHelper.generate_seed(), "guser5", QRCodeFormat.SVG)
+    assert info.qrcode.lstrip().startswith("<")
+    assert "<svg" in info.qrcode
+    png = TOTPHelper.generate_seed_uri_image(TOTPHelper.generate_seed(), "guser5")
+    # Default stays a base64 PNG for existing clients
+    assert png.qrcode_format == QRCodeFormat.PNG and base64.b64decode(png.qrcode).startswith(b"\x89PNG")
+
+
+@pytest.mark.asyncio
+async def test_repeated_generate_totp_serves_the_pending_enrollment(client, db_session, monkeypatch):
+    user = UserProfile(username="guser6", first_name="G", last_name="Six", mobile_number="+97390000006", is_mobile_number_verified=False, email_address="g6@example.com", is_email_address_verified=False)
+    db_session.add(user)
+    await db_session.commit()
+
+    async def _auth():
+        return TokenValidationResponse(successful=True, username="guser6")
+    monkeypatch.setitem(app.dependency_overrides, AuthenticateUser.get_logged_in_user, _auth)
+
+    first = (await client.post("/user/generate-totp")).json()
+    assert first["successful"] is True
+
+    # The repeat is answered from the stored enrollment, nothing is generated nor rendered again
+    renders = []
+    with monkeypatch.context() as patched:
+        patched.setattr(TOTPHelper, "render_seed_uri_image", lambda *args: renders.append(args))
+        patched.setattr(TOTPHelper, "generate_seed", lambda: renders.append("seed"))
+        again = (await client.post("/user/generate-totp")).json()
+    assert again == first
+    assert renders == []
+
+    # Another format renders the same pending seed
+    svg = (await client.post("/user/generate-totp", params={"format": "svg"})).json()["data"]
+    assert svg["seed"] == first["data"]["seed"] and "<svg" in svg["qrcode"]
+
+    # Regenerate rotates the seed and the enrollments rendered for the old one
+    rotated = (await client.post("/user/generate-totp", params={"regenerate": True})).json()["data"]
+    assert rotated["seed"] != first["data"]["seed"]
+    assert (await client.post("/user/generate-totp", params={"format": "svg"})).json()["data"]["seed"] == rotated["seed"]
+    assert (await client.post("/user/generate-totp")).json()["data"] == rotated
+
+    # Confirming the seed discards its enrollments
+    import pyotp
+    verified = await client.post("/user/verify-totp", json={"totp": pyotp.TOTP(rotated["seed"]).now(), "is_new_seed": True})
+    assert verified.json()["successful"] is True
+    fresh = (await client.post("/user/generate-totp")).json()["data"]
+    assert fresh["seed"] != rotated["seed"]
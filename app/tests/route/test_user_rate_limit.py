@@ -0,0 +1,64 @@
+import dataclasses
+import pytest
+from app.config.settings import settings
+from app.dependacy.rate_limit import otp_verification_rate_limit, RateLimiter
+
+
+@pytest.fixture
+def verify_limits(monkeypatch):
+    monkeypatch.setattr(otp_verification_rate_limit, "per_user", 2)
+    monkeypatch.setattr(otp_verification_rate_limit, "per_ip", 100)
+
+
+@pytest.mark.asyncio
+async def test_verify_otp_is_limited_per_authenticated_user(client, keycloak_calls, verify_limits):
+    for _ in range(2):
+        response = await client.post("/user/verify-otp", json={"otp": "123456", "otp_type": "email"}, auth=("bob", "secret"))
+        assert response.status_code != 429
+
+    response = await client.post("/user/verify-otp", json={"otp": "123456", "otp_type": "email"}, auth=("bob", "secret"))
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["retry-after"]) <= settings.rate_limit_window
+
+    # Other OTP types and other users have their own buckets
+    response = await client.post("/user/verify-otp", json={"otp": "123456", "otp_type": "mobile"}, auth=("bob", "secret"))
+    assert response.status_code != 429
+    response = await client.post("/user/verify-otp", json={"otp": "123456", "otp_type": "email"}, auth=("carol", "secret"))
+    assert response.status_code != 429
+
+
+@pytest.mark.asyncio
+async def test_failed_logins_do_not_spend_the_user_budget(client, keycloak_calls, verify_limits):
+    # Someone else sending bob's username with a wrong password
+    for _ in range(3):
+        response = await client.post("/user/verify-otp", json={"otp": "123456", "otp_type": "email"}, auth=("bob", "wrong"))
+        assert response.status_code == 401
+    response = await client.post("/user/verify-otp", json={"otp": "123456", "otp_type": "email"}, auth=("bob", "secret"))
+    assert response.status_code != 429
+
+
+@pytest.mark.asyncio
+async def test_verify_otp_is_limited_per_ip(client, keycloak_calls, monkeypatch):
+    monkeypatch.setattr(otp_verification_rate_limit, "per_ip", 2)
+    statuses = [(await client.post("/user/verify-otp", json={"otp": "1", "otp_type": "email"}, auth=(f"user{i}", "wrong"))).status_code
+                for i in range(3)]
+    assert statuses == [401, 401, 429]
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_fails_open_when_redis_errors(client, keycloak_calls, verify_limits, monkeypatch):
+    async def _broken(self, state, key, limit):
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(RateLimiter, "_hit", _broken)
+    for _ in range(3):
+        response = await client.post("/user/verify-otp", json={"otp": "123456", "otp_type": "email"}, auth=("bob", "secret"))
+        assert response.status_code != 429
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_can_be_disabled(client, keycloak_calls, verify_limits, monkeypatch):
+    monkeypatch.setattr("app.dependacy.rate_limit.settings", dataclasses.replace(settings, rate_limit_enabled=False))
+    for _ in range(3):
+        response = await client.post("/user/verify-otp", json={"otp": "123456", "otp_type": "email"}, auth=("bob", "secret"))
+        assert response.status_code != 429
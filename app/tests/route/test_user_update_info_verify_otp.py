@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from app.schema.token import TokenValidationResponse
 from app.helper.otp_helper import OTPHelper
@@ -139,3 +140,22 @@ async def test_enter_valid_mobile_otp_and_verify_changes(client, db_session, mon
     # Check mobile updated
     mobile_val = body2.get("user_profile_info", {}).get("mobile") if body2.get("user_profile_info") else body2.get("mobile")
     assert mobile_val == new_mobile
+
+
+@pytest.mark.asyncio
+async def test_double_submitted_update_sends_a_single_otp(client, db_session, monkeypatch):
+    user = UserProfile(username="user6", first_name="U6", last_name="Six", mobile_number="+97366666666", is_mobile_number_verified=False, email_address="old6@example.com", is_email_address_verified=False)
+    db_session.add(user)
+    await db_session.commit()
+
+    test_user = TokenValidationResponse(successful=True, username="user6")
+    async def _auth():
+        return test_user
+    monkeypatch.setitem(app.dependency_overrides, AuthenticateUser.get_logged_in_user, _auth)
+
+    sent = []
+    monkeypatch.setattr("app.controller.user_profile.EmailHelper.send_email_otp", lambda *a, **k: sent.append(a))
+
+    responses = await asyncio.gather(*(client.patch("/user", json={"email": "new6@example.com"}) for _ in range(3)))
+    assert sorted(response.json()["successful"] for response in responses) == [False, False, True]
+    assert len(sent) == 1